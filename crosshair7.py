@@ -1,711 +1,4880 @@
-
-import sys
-import threading
-import queue
-import json
-import os
-import keyboard
-from PyQt5 import QtCore, QtGui, QtWidgets
-
-CONFIG_FILE = os.path.join(os.path.expanduser("~"), ".crosshair_config.json")
-command_queue = queue.Queue()
-overlay = None
-
-
-def print_help():
-    print("使用可能なコマンド一覧:")
-    print("  -crosshair            : クロスヘア（十字）の表示/非表示を切り替え")
-    print("  -dot                  : 中央のドットの表示/非表示を切り替え")
-    print("  -dotsize [0〜100]     : 中央のドットの直径を指定ピクセルに変更")
-    print("  --crosshair-color     : クロスヘアの色をカラーピッカーで変更")
-    print("  --dot-out-color       : ドット外枠の色をカラーピッカーで変更")
-    print("  --dot-in-color        : ドット内側の色をカラーピッカーで変更")
-    print("  --crosshair-alpha [0.0〜1.0] : クロスヘアの透明度を変更")
-    print("  --dot-alpha [0.0〜1.0]       : ドットの透明度を変更（外枠・内側共通）")
-    print("  --disable-key         : 指定したキーを無効化する")
-    print("  --multiple-disable-keys : 複数のキーをまとめて無効化する（Enterキーで確定）")
-    print("  --enable-key          : 無効化されたキーを1つ有効化する")
-    print("  --all-enable-keys     : 無効化されたキーを全て有効化する")
-    print("  -gui                 : GUIモードに切り替え（以後もGUIで起動）")
-    print("  -cui                 : CUIモードに切り替え（以後もCUIで起動）")
-    print("  -exit                 : プログラムを終了")
-    print("  -help                 : このヘルプを表示します")
-
-def load_config():
-    defaults = {
-        "crosshair_visible": True,
-        "dot_visible": True,
-        "dot_radius": 5,
-        "crosshair_color": "#00FF66",
-        "dot_outer_color": "#FFFFFF",
-        "dot_inner_color": "#000000",
-        "disabled_keys": [],  # 追加
-        "crosshair_alpha": 1.0,
-        "launch_mode": "gui",
-        "dot_alpha": 1.0,
-    }
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                config = json.load(f)
-            for key, value in defaults.items():
-                config.setdefault(key, value)
-            return config
-        except Exception:
-            pass
-    return defaults
-
-def save_config(config):
-    try:
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(config, f, indent=4)
-    except Exception as e:
-        print("設定保存に失敗:", e)
-
-class CrosshairOverlay(QtWidgets.QWidget):
-    def __init__(self):
-        super().__init__()
-        self.setWindowFlags(
-            QtCore.Qt.FramelessWindowHint |
-            QtCore.Qt.WindowStaysOnTopHint |
-            QtCore.Qt.WindowTransparentForInput |
-            QtCore.Qt.Tool
-        )
-        self.setAttribute(QtCore.Qt.WA_TranslucentBackground)
-        self.showFullScreen()
-
-        screen = QtWidgets.QApplication.primaryScreen().size()
-        self.center_x = screen.width() // 2
-        self.center_y = screen.height() // 2
-        self.size = 20
-
-        config = load_config()
-
-        self.crosshair_visible = config["crosshair_visible"]
-        self.dot_visible = config["dot_visible"]
-        self.dot_radius = config["dot_radius"]
-        self.crosshair_color = config["crosshair_color"]
-        self.dot_outer_color = config["dot_outer_color"]
-        self.dot_inner_color = config["dot_inner_color"]
-        self.launch_mode = config.get("launch_mode", "cui")
-
-        self.crosshair_alpha = config.get("crosshair_alpha", 1.0)
-        self.dot_alpha = config.get("dot_alpha", 1.0)
-
-
-
-        self.disabled_keys = config["disabled_keys"]
-        # 起動時に保存されたキーを無効化
-        for k in self.disabled_keys:
-            try:
-                keyboard.block_key(k)
-            except Exception as e:
-                print(f"キー {k} の無効化に失敗: {e}")
-
-    class KeyCaptureDialog(QtWidgets.QDialog):
-        def __init__(self, parent=None, message="キーを押してください", allow_keys=None, cancel_callback=None, key_callback=None):
-            super().__init__(parent)
-            self.setWindowFlags(self.windowFlags() & ~QtCore.Qt.WindowContextHelpButtonHint)
-            self.setWindowTitle("キー入力待機")
-            self.setWindowModality(QtCore.Qt.ApplicationModal)
-            self.setLayout(QtWidgets.QVBoxLayout())
-            self.label = QtWidgets.QLabel(message)
-            self.layout().addWidget(self.label)
-            self.cancel_callback = cancel_callback
-            self.key_callback = key_callback
-            self.allow_keys = allow_keys
-
-            cancel_button = QtWidgets.QPushButton("キャンセル")
-            cancel_button.clicked.connect(self.cancel)
-            self.layout().addWidget(cancel_button)
-            self.resize(300, 100)
-
-        def cancel(self):
-            self.reject()
-            if self.cancel_callback:
-                self.cancel_callback()
-
-        def keyPressEvent(self, event):
-            # まず event.text() で取得を試みる
-            key = event.text().lower()
-            if not key:
-                # 取得できなければ従来の方法へフォールバック
-                key = QtGui.QKeySequence(event.key()).toString().lower()
-            if key == "return":
-                QtWidgets.QMessageBox.information(self, "無効化不可", "Enterキーは無効化できません。")
-                return
-            self.accept()
-            if self.key_callback:
-                self.key_callback(key)
-
-    def toggle_crosshair(self):
-        self.crosshair_visible = not self.crosshair_visible
-
-    def toggle_dot(self):
-        self.dot_visible = not self.dot_visible
-
-    def set_dot_size(self, diameter):
-        self.dot_radius = max(1, min(diameter, 100)) // 2
-
-    def pick_crosshair_color(self):
-        color = QtWidgets.QColorDialog.getColor(QtGui.QColor(self.crosshair_color), self)
-        if color.isValid():
-            self.crosshair_color = color.name()
-
-    def pick_dot_outer_color(self):
-        color = QtWidgets.QColorDialog.getColor(QtGui.QColor(self.dot_outer_color), self)
-        if color.isValid():
-            self.dot_outer_color = color.name()
-
-    def pick_dot_inner_color(self):
-        color = QtWidgets.QColorDialog.getColor(QtGui.QColor(self.dot_inner_color), self)
-        if color.isValid():
-            self.dot_inner_color = color.name()
-
-    def get_config(self):
-        return {
-            "crosshair_visible": self.crosshair_visible,
-            "dot_visible": self.dot_visible,
-            "dot_radius": self.dot_radius,
-            "crosshair_color": self.crosshair_color,
-            "dot_outer_color": self.dot_outer_color,
-            "dot_inner_color": self.dot_inner_color,
-            "disabled_keys": self.disabled_keys,
-            "crosshair_alpha": self.crosshair_alpha,
-            "dot_alpha": self.dot_alpha,
-            "launch_mode": self.launch_mode if hasattr(self, "launch_mode") else "cui"
-        }
-
-    def print_parameters(self):
-        print("=== 現在のパラメータ ===")
-        print(f"  クロスヘア表示: {'ON' if self.crosshair_visible else 'OFF'}")
-        print(f"  クロスヘア色 : {self.crosshair_color}")
-        print(f"  ドット表示   : {'ON' if self.dot_visible else 'OFF'}")
-        print(f"  ドット外枠色 : {self.dot_outer_color}")
-        print(f"  ドット内側色 : {self.dot_inner_color}")
-        print(f"  ドット直径   : {self.dot_radius * 2}")
-        print(f"  クロスヘア透明度: {self.crosshair_alpha}")
-        print(f"  ドット透明度   : {self.dot_alpha}")
-        print(f"  無効化キー   : {', '.join(self.disabled_keys) if self.disabled_keys else 'なし'}")
-        print("=====================")
-
-    def paintEvent(self, event):
-        painter = QtGui.QPainter(self)
-        painter.setRenderHint(QtGui.QPainter.Antialiasing)
-
-        # クロスヘア
-        if self.crosshair_visible:
-            color = QtGui.QColor(self.crosshair_color)
-            color.setAlphaF(self.crosshair_alpha)
-            pen = QtGui.QPen(color, 2)
-            painter.setPen(pen)
-            gap = 10
-            painter.drawLine(self.center_x - self.size, self.center_y,
-                             self.center_x - gap, self.center_y)
-            painter.drawLine(self.center_x + gap, self.center_y,
-                             self.center_x + self.size, self.center_y)
-            painter.drawLine(self.center_x, self.center_y - self.size,
-                             self.center_x, self.center_y - gap)
-            painter.drawLine(self.center_x, self.center_y + gap,
-                             self.center_x, self.center_y + self.size)
-
-        # ドット
-        if self.dot_visible and self.dot_radius > 0:
-            outer_color = QtGui.QColor(self.dot_outer_color)
-            outer_color.setAlphaF(self.dot_alpha)
-            painter.setBrush(QtGui.QBrush(outer_color))
-            painter.setPen(QtGui.QPen(outer_color))
-            painter.drawEllipse(QtCore.QRect(
-                self.center_x - self.dot_radius,
-                self.center_y - self.dot_radius,
-                self.dot_radius * 2,
-                self.dot_radius * 2
-            ))
-            if self.dot_radius > 1:
-                inner_r = self.dot_radius - 1
-                inner_color = QtGui.QColor(self.dot_inner_color)
-                inner_color.setAlphaF(self.dot_alpha)
-                painter.setBrush(QtGui.QBrush(inner_color))
-                painter.setPen(QtGui.QPen(inner_color))
-                painter.drawEllipse(QtCore.QRect(
-                    self.center_x - inner_r,
-                    self.center_y - inner_r,
-                    inner_r * 2,
-                    inner_r * 2
-                ))
-
-    
-    def disable_key(self, key):
-        if key == "enter":
-            print("Enterキーは無効化できません。")
-            return
-        if key not in self.disabled_keys:
-            self.disabled_keys.append(key)
-            keyboard.block_key(key)
-
-    def enable_key(self, key):
-        if key in self.disabled_keys:
-            self.disabled_keys.remove(key)
-            try:
-                keyboard.unblock_key(key)
-            except KeyError:
-                pass  # すでにアンブロックされている場合は無視
-
-
-    def enable_all_keys(self):
-        for k in self.disabled_keys:
-            keyboard.unblock_key(k)
-        self.disabled_keys.clear()
-
-    def show_control_panel(self):
-        self.panel = QtWidgets.QWidget()
-        self.panel.setWindowTitle("Crosshair Control Panel")
-        layout = QtWidgets.QVBoxLayout()
-
-        # クロスヘア表示切替
-        self.crosshair_btn = QtWidgets.QPushButton("クロスヘア表示/非表示")
-        self.crosshair_state = QtWidgets.QLabel("ON" if self.crosshair_visible else "OFF")
-        self.crosshair_btn.clicked.connect(self.toggle_crosshair_button)
-        h1 = QtWidgets.QHBoxLayout()
-        h1.addWidget(self.crosshair_btn)
-        h1.addWidget(self.crosshair_state)
-        layout.addLayout(h1)
-
-        # ドット表示切替
-        self.dot_btn = QtWidgets.QPushButton("ドット表示/非表示")
-        self.dot_state = QtWidgets.QLabel("ON" if self.dot_visible else "OFF")
-        self.dot_btn.clicked.connect(self.toggle_dot_button)
-        h2 = QtWidgets.QHBoxLayout()
-        h2.addWidget(self.dot_btn)
-        h2.addWidget(self.dot_state)
-        layout.addLayout(h2)
-
-        # ドットサイズスライダー
-        dotsize_layout = QtWidgets.QHBoxLayout()
-        dotsize_label = QtWidgets.QLabel("ドットサイズ")
-        self.dot_slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
-        self.dot_slider.setMinimum(0)
-        self.dot_slider.setMaximum(100)
-        self.dot_slider.setValue(self.dot_radius * 2)
-        self.dot_value = QtWidgets.QLabel(str(self.dot_radius * 2))
-        self.dot_slider.valueChanged.connect(self.update_dot_size)
-        dotsize_layout.addWidget(dotsize_label)
-        dotsize_layout.addWidget(self.dot_slider)
-        dotsize_layout.addWidget(self.dot_value)
-        layout.addLayout(dotsize_layout)
-
-        # カラー選択ヘルパー関数
-        def make_color_button(label_text, getter, setter):
-            layout_ = QtWidgets.QHBoxLayout()
-            button = QtWidgets.QPushButton(label_text)
-            square = QtWidgets.QLabel()
-            square.setFixedSize(20, 20)
-            square.setStyleSheet(f"background-color: {getter()}; border: 1px solid black;")
-            def pick_color():
-                color = QtWidgets.QColorDialog.getColor(QtGui.QColor(getter()))
-                if color.isValid():
-                    setter(color.name())
-                    square.setStyleSheet(f"background-color: {color.name()}; border: 1px solid black;")
-                    self.update()
-                    save_config(self.get_config())
-            button.clicked.connect(pick_color)
-            layout_.addWidget(button)
-            layout_.addWidget(square)
-            return layout_
-
-        layout.addLayout(make_color_button("クロスヘア色", lambda: self.crosshair_color, self.set_crosshair_color))
-        layout.addLayout(make_color_button("ドット外枠色", lambda: self.dot_outer_color, self.set_dot_outer_color))
-        layout.addLayout(make_color_button("ドット内側色", lambda: self.dot_inner_color, self.set_dot_inner_color))
-
-        # クロスヘア透明度スライダー
-        alpha_layout = QtWidgets.QHBoxLayout()
-        alpha_label = QtWidgets.QLabel("クロスヘア透明度")
-        self.alpha_slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
-        self.alpha_slider.setMinimum(0)
-        self.alpha_slider.setMaximum(100)
-        self.alpha_slider.setValue(int(self.crosshair_alpha * 100))
-        self.alpha_value = QtWidgets.QLabel(str(self.crosshair_alpha))
-        self.alpha_slider.valueChanged.connect(self.update_alpha)
-        alpha_layout.addWidget(alpha_label)
-        alpha_layout.addWidget(self.alpha_slider)
-        alpha_layout.addWidget(self.alpha_value)
-        layout.addLayout(alpha_layout)
-
-        # ドット透明度スライダー
-        dot_alpha_layout = QtWidgets.QHBoxLayout()
-        dot_alpha_label = QtWidgets.QLabel("ドット透明度")
-        self.dot_alpha_slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
-        self.dot_alpha_slider.setMinimum(0)
-        self.dot_alpha_slider.setMaximum(100)
-        self.dot_alpha_slider.setValue(int(self.dot_alpha * 100))
-        self.dot_alpha_value = QtWidgets.QLabel(str(self.dot_alpha))
-        self.dot_alpha_slider.valueChanged.connect(self.update_dot_alpha)
-        dot_alpha_layout.addWidget(dot_alpha_label)
-        dot_alpha_layout.addWidget(self.dot_alpha_slider)
-        dot_alpha_layout.addWidget(self.dot_alpha_value)
-        layout.addLayout(dot_alpha_layout)
-
-        # キー無効化
-        disable_layout = QtWidgets.QHBoxLayout()
-        disable_btn = QtWidgets.QPushButton("キーを無効化")
-        self.disabled_keys_label = QtWidgets.QLabel(", ".join(self.disabled_keys) if self.disabled_keys else "なし")
-        disable_btn.clicked.connect(self.disable_key_gui)
-        disable_layout.addWidget(disable_btn)
-        disable_layout.addWidget(self.disabled_keys_label)
-        layout.addLayout(disable_layout)
-
-        # キー有効化
-        enable_btn = QtWidgets.QPushButton("キーを有効化")
-        enable_btn.clicked.connect(self.enable_key_gui)
-        layout.addWidget(enable_btn)
-
-        # すべて有効化
-        enable_all_btn = QtWidgets.QPushButton("すべてのキーを有効化")
-        enable_all_btn.clicked.connect(self.enable_all_keys_gui)
-        layout.addWidget(enable_all_btn)
-
-        # CUIモードへ切り替え
-        cui_btn = QtWidgets.QPushButton("CUIモードに切り替え")
-        cui_btn.clicked.connect(self.switch_to_cui)
-        layout.addWidget(cui_btn)
-
-        self.panel.setLayout(layout)
-        self.panel.setGeometry(100, 100, 300, 100)
-        self.panel.show()
-
-    def toggle_crosshair_button(self):
-        self.toggle_crosshair()
-        self.crosshair_state.setText("ON" if self.crosshair_visible else "OFF")
-        self.update()
-        save_config(self.get_config())
-
-    def toggle_dot_button(self):
-        self.toggle_dot()
-        self.dot_state.setText("ON" if self.dot_visible else "OFF")
-        self.update()
-        save_config(self.get_config())
-
-    def update_dot_size(self, val):
-        self.set_dot_size(val)
-        self.dot_value.setText(str(val))
-        self.update()
-        save_config(self.get_config())    
-        
-    def update_alpha(self, val):
-        alpha = round(val / 100, 2)
-        self.crosshair_alpha = alpha
-        self.alpha_value.setText(str(alpha))
-        self.update()
-        save_config(self.get_config())
-
-    def update_dot_alpha(self, val):
-        alpha = round(val / 100, 2)
-        self.dot_alpha = alpha
-        self.dot_alpha_value.setText(str(alpha))
-        self.update()
-        save_config(self.get_config())
-
-    def set_crosshair_color(self, val):
-        self.crosshair_color = val
-
-    def set_dot_outer_color(self, val):
-        self.dot_outer_color = val
-
-    def set_dot_inner_color(self, val):
-        self.dot_inner_color = val
-
-    def disable_key_gui(self):
-        def on_key_selected(key):
-            self.disable_key(key)
-            self.disabled_keys_label.setText(", ".join(self.disabled_keys))
-            save_config(self.get_config())
-            self.update()
-
-        dlg = self.KeyCaptureDialog(
-            self,
-            message="無効化したいキーを押してください（Enterキーは無効化できません）",
-            key_callback=on_key_selected
-        )
-        dlg.exec_()
-
-    def capture_disable_key(self, msgbox):
-        if self._disable_cancelled:
-            return  # キャンセルされたら何もしない
-
-        key = keyboard.read_key()
-        msgbox.close()
-
-        if key == "enter":
-            QtWidgets.QMessageBox.information(None, "無効化失敗", "Enterキーは無効化できません。")
-            return
-
-        self.disable_key(key)
-        self.disabled_keys_label.setText(", ".join(self.disabled_keys))
-        save_config(self.get_config())
-        self.update()
-
-    def enable_key_gui(self):
-        def on_key_selected(key):
-            for k in self.disabled_keys:
-                try:
-                    keyboard.unblock_key(k)
-                except:
-                    pass
-
-            for k in self.disabled_keys:
-                if k != key:
-                    try:
-                        keyboard.block_key(k)
-                    except:
-                        pass
-
-            self.enable_key(key)
-
-            if key in self.disabled_keys:
-                self.disabled_keys.remove(key)
-
-            self.disabled_keys_label.setText(", ".join(self.disabled_keys) if self.disabled_keys else "なし")
-            save_config(self.get_config())
-            self.update()
-
-        for k in self.disabled_keys:
-            try:
-               keyboard.unblock_key(k)
-            except:
-              pass
-
-        dlg = self.KeyCaptureDialog(
-            self,
-            message="有効化したいキーを押してください（現在無効化中のキー: " + ", ".join(self.disabled_keys) + "）",
-            key_callback=on_key_selected
-        )
-        dlg.exec_()
-
-    def capture_enable_key(self, msgbox):
-        if self._enable_cancelled:
-            return  # キャンセルされたら何もしない
-
-        # 一時的に無効化キーを解除してキーを取得
-        for k in self.disabled_keys:
-            try:
-                keyboard.unblock_key(k)
-            except KeyError:
-                pass
-
-        key = keyboard.read_key()
-
-        # 再度無効化（除外キー以外）
-        for k in self.disabled_keys:
-            if k != key:
-                try:
-                    keyboard.block_key(k)
-                except Exception:
-                    pass
-
-        msgbox.close()
-
-        self.enable_key(key)
-        self.disabled_keys_label.setText(", ".join(self.disabled_keys) if self.disabled_keys else "なし")
-        save_config(self.get_config())
-        self.update()
-
-    def enable_all_keys_gui(self):
-        self.enable_all_keys()
-        self.disabled_keys_label.setText("なし")
-        save_config(self.get_config())
-        self.update()
-
-    def switch_to_cui(self):
-        config = load_config()
-        config["launch_mode"] = "cui"
-        save_config(config)
-        QtWidgets.QMessageBox.information(None, "切り替え", "CUIモードに切り替えます。再起動します。")
-        os.execv(sys.executable, [sys.executable] + sys.argv)
-
-
-COMMANDS = {
-    "-crosshair": "toggle_crosshair",
-    "-dot": "toggle_dot",
-    "--crosshair-color": "pick_crosshair_color",
-    "--dot-out-color": "pick_dot_outer_color",
-    "--dot-in-color": "pick_dot_inner_color",
-    "--all-enable-keys": "enable_all_keys",
-    "-gui": "enter_gui_mode",
-    "-exit": "exit",
-    "-help": "help",
-    "--crosshair-alpha": "set_crosshair_alpha",
-    "--dot-alpha": "set_dot_alpha",
-    "launch_mode": "cui",
-    "-gui": "switch_to_gui",
-    "-cui": "switch_to_cui",
-}
-
-def clear_keyboard_buffer():
-    try:
-        # バッファに残っているイベントを全て読み捨てる
-        while True:
-            event = keyboard.read_event(suppress=False)
-            # ここに到達するとイベントを消費する
-            if event.event_type == keyboard.KEY_UP:
-                # 何も押されていないときはbreak
-                break
-    except:
-        # イベントが無い場合や例外発生時は終了
-        pass
-
-def input_thread():
-    print("終了するにはウィンドウを閉じるか -exit を入力してください。")
-    print("-help でコマンド一覧を表示できます。")
-    while True:
-        raw = input(">>> ").strip().lower()
-        if raw.startswith("-dotsize"):
-            parts = raw.split()
-            if len(parts) == 2 and parts[1].isdigit():
-                command_queue.put(("set_dot_size", int(parts[1])))
-            else:
-                print("使用方法: -dotsize [0〜100]")
-        elif raw == "--disable-key":
-            print("どのキーを無効化しますか？キーを押してください。")
-            clear_keyboard_buffer()
-            key = keyboard.read_key()
-            if key == "enter":
-                print("Enterキーは無効化できません。")
-            else:
-                command_queue.put(("disable_key", key))
-                print(f"キー {key} を無効化しました。")
-        elif raw == "--multiple-disable-keys":
-            print("無効化したいキーをすべて押し、最後にEnterを押してください。")
-            keys = []
-            clear_keyboard_buffer()
-            while True:
-                k = keyboard.read_event(suppress=False)
-                if k.event_type == keyboard.KEY_DOWN:
-                    if k.name == "enter":
-                        break
-                    if k.name not in keys:
-                        keys.append(k.name)
-            for k in keys:
-                command_queue.put(("disable_key", k))
-            print(f"キー {', '.join(keys)} を無効化しました。")
-        elif raw == "--enable-key":
-            print(f"無効化されているキー: {', '.join(overlay.disabled_keys) if overlay.disabled_keys else 'なし'}")
-            print("有効化したいキーを押してください。")
-            clear_keyboard_buffer()
-            key = keyboard.read_key()
-            command_queue.put(("enable_key", key))
-            print(f"キー {key} を有効化しました。")
-        elif raw.startswith("--crosshair-alpha"):
-            parts = raw.split()
-            if len(parts) == 2:
-                try:
-                    alpha = float(parts[1])
-                    command_queue.put(("set_crosshair_alpha", alpha))
-                except ValueError:
-                    print("使用方法: --crosshair-alpha [0.0〜1.0]")
-            else:
-                print("使用方法: --crosshair-alpha [0.0〜1.0]")
-        elif raw.startswith("--dot-alpha"):
-            parts = raw.split()
-            if len(parts) == 2:
-                try:
-                    alpha = float(parts[1])
-                    command_queue.put(("set_dot_alpha", alpha))
-                except ValueError:
-                    print("使用方法: --dot-alpha [0.0〜1.0]")
-            else:
-                print("使用方法: --dot-alpha [0.0〜1.0]")
-        elif raw == "-gui":
-            config = load_config()
-            config["launch_mode"] = "gui"
-            save_config(config)
-            print("GUIモードに切り替えます。再起動してください。")
-            os.execv(sys.executable, [sys.executable] + sys.argv)
-        elif raw == "-cui":
-            config = load_config()
-            config["launch_mode"] = "cui"
-            save_config(config)
-            print("CUIモードに切り替えます。再起動してください。")
-            os.execv(sys.executable, [sys.executable] + sys.argv)
-        elif raw in COMMANDS:
-            if raw == "-exit":
-                if overlay:
-                    save_config(overlay.get_config())
-                    overlay.enable_all_keys()
-                command_queue.put(("exit", None))
-                break
-            elif raw == "-help":
-                print_help()
-            else:
-                command_queue.put((COMMANDS[raw], None))
-        elif raw == "":
-            continue
-        else:
-            print("不明なコマンドです。-help で確認してください。")
-
-
-
-def gui_main():
-    global overlay
-    app = QtWidgets.QApplication(sys.argv)
-    overlay = CrosshairOverlay()
-
-    # 起動時のモードに応じてGUIパネルを自動表示
-    config = load_config()
-    if config.get("launch_mode") == "gui":
-        overlay.show_control_panel()
-    
-     # 起動時にパラメータとヘルプを表示
-    overlay.print_parameters()
-    print_help()
-
-    def poll_commands():
-        while not command_queue.empty():
-            cmd, val = command_queue.get()
-            if cmd == "toggle_crosshair":
-                overlay.toggle_crosshair()
-            elif cmd == "toggle_dot":
-                overlay.toggle_dot()
-            elif cmd == "set_dot_size":
-                overlay.set_dot_size(val)
-            elif cmd == "pick_crosshair_color":
-                overlay.pick_crosshair_color()
-            elif cmd == "pick_dot_outer_color":
-                overlay.pick_dot_outer_color()
-            elif cmd == "pick_dot_inner_color":
-                overlay.pick_dot_inner_color()
-            elif cmd == "disable_key":
-                overlay.disable_key(val)
-            elif cmd == "enable_key":
-                overlay.enable_key(val)
-            elif cmd == "enable_all_keys":
-                overlay.enable_all_keys()
-            elif cmd == "set_crosshair_alpha":
-                overlay.crosshair_alpha = max(0.0, min(val, 1.0))
-            elif cmd == "set_dot_alpha":
-                overlay.dot_alpha = max(0.0, min(val, 1.0))
-            elif cmd == "enter_gui_mode":
-                overlay.show_control_panel()
-            elif cmd == "exit":
-                app.quit()
-                return
-            overlay.print_parameters()
-            save_config(overlay.get_config())
-            overlay.update()
-        QtCore.QTimer.singleShot(100, poll_commands)
-
-    app.aboutToQuit.connect(lambda: [
-    save_config(overlay.get_config()),
-    overlay.enable_all_keys()  # 終了時に解除
-    ])
-    QtCore.QTimer.singleShot(100, poll_commands)
-    overlay.show()
-    sys.exit(app.exec_())
-
-if __name__ == "__main__":
-    config = load_config()
-    if config.get("launch_mode") == "gui":
-        gui_main()  # GUIモード → コントロールパネル＋オーバーレイのみ
-    else:
-        threading.Thread(target=input_thread, daemon=True).start()
-        gui_main()  # CUIモード → オーバーレイ＋CUIプロンプト
-
+
+import sys
+import threading
+import queue
+import asyncio
+import concurrent.futures
+import json
+import os
+import copy
+import types
+import ctypes
+import fnmatch
+import collections
+import itertools
+import gc
+import math
+import time
+import tracemalloc
+import traceback
+import logging
+import logging.handlers
+import hashlib
+import struct
+import base64
+import binascii
+import tempfile
+import shutil
+import multiprocessing
+from multiprocessing import shared_memory
+import keyboard
+import reticle_reader
+from PyQt5 import QtCore, QtGui, QtWidgets, QtNetwork, sip
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import mouse  # マウス移動に応じた拡散表示で使用（任意）
+except ImportError:
+    mouse = None
+
+try:
+    import evdev  # Linux でキーボードを直接つかむバックエンドで使用（任意）
+except ImportError:
+    evdev = None
+
+try:
+    import readline  # Windows では pyreadline3 があれば利用
+except ImportError:
+    readline = None
+
+CONFIG_FILE = os.path.join(os.path.expanduser("~"), ".crosshair_config.json")
+HISTORY_FILE = os.path.join(os.path.expanduser("~"), ".crosshair_history")
+HISTORY_LENGTH = 500
+JOURNAL_FILE = CONFIG_FILE + ".journal"
+GOOD_CONFIG_FILE = CONFIG_FILE + ".good"
+JOURNAL_COMPACT_EVERY = 16
+JOURNAL_UNDO_DEPTH = 100
+PRESET_DIR = os.path.join(os.path.expanduser("~"), ".crosshair_presets")
+PRESET_THUMB_SIZE = 48
+STALL_LOG_FILE = os.path.join(os.path.expanduser("~"), ".crosshair_stalls.log")
+GOLDEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden", "reticles.npz")
+GOLDEN_SIZE = 64
+GOLDEN_TOLERANCE = 2
+ADAPTIVE_ROI = 48
+SCOPE_ROI = 40
+SCOPE_OFFSET = 40  # 中心からスコープ左上までの距離
+SPREAD_GAP = 12  # 最大拡散時に中心の隙間へ足すピクセル数
+SPREAD_SIZE = 16  # 最大拡散時に線の長さへ足すピクセル数
+SPREAD_RATE = 60  # GUIへ拡散量を送る頻度（Hz）
+SHARE_CODE_PREFIX = "XH"
+SHARE_CODE_VERSION = 1
+EVENT_LOG_SIZE = 5000  # メモリに残すイベントの件数
+HUD_CHARS = "0123456789:.-FPST "
+HUD_MARGIN = 12
+KEY_DOWN = "down"
+KEY_UP = "up"
+EV_SYN = 0
+EV_KEY = 1
+command_queue = queue.Queue()
+overlay = None
+
+def current_state():
+    # 参照の差し替えは1回の代入なのでロック不要で一貫した状態が読める
+    if overlay is None:
+        return None
+    return overlay.state
+
+
+def print_help():
+    print("使用可能なコマンド一覧:")
+    print("  -crosshair            : クロスヘア（十字）の表示/非表示を切り替え")
+    print("  -dot                  : 中央のドットの表示/非表示を切り替え")
+    print("  -dotsize [0〜100]     : 中央のドットの直径を指定ピクセルに変更")
+    print("  --crosshair-color [色] : クロスヘアの色を変更（省略時はカラーピッカー）")
+    print("  --dot-out-color [色]   : ドット外枠の色を変更（省略時はカラーピッカー）")
+    print("  --dot-in-color [色]    : ドット内側の色を変更（省略時はカラーピッカー）")
+    print("      色の例: #ff0000 / #ff0000cc / rgba(255,0,0,0.8) / hsv(120,100,100)")
+    print("  --crosshair-alpha [0.0〜1.0] : クロスヘアの透明度を変更")
+    print("  --dot-alpha [0.0〜1.0]       : ドットの透明度を変更（外枠・内側共通）")
+    print("  --disable-key         : 指定したキーを無効化する")
+    print("  --multiple-disable-keys : 複数のキーをまとめて無効化する（Enterキーで確定）")
+    print("  --enable-key          : 無効化されたキーを1つ有効化する")
+    print("  --all-enable-keys     : 無効化されたキーを全て有効化する")
+    print("  --remap-key 元 先      : キーを別のキーに置き換える（空白は _ で指定。例: caps_lock ctrl）")
+    print("  --unremap-key 元       : キーの置き換えをやめる")
+    print("  --key-layer 名前|none : キーレイヤーを切り替える（差分だけを反映）")
+    print("  --key-layer-save 名前 : 今の無効化キーをレイヤーとして保存")
+    print("  --key-layer-hotkey ホットキー 名前 : レイヤー切り替えのホットキーを登録（例: ctrl+alt+1 game）")
+    print("  -key-layers           : キーレイヤーの一覧を表示")
+    print("  -gui                 : GUIモードに切り替え（以後もGUIで起動）")
+    print("  -cui                 : CUIモードに切り替え（以後もCUIで起動）")
+    print("  --adaptive-color on|off [Hz] [CPU割合] : 背景に応じてクロスヘア色を自動で見やすくする")
+    print("  --scope on|off [倍率2〜8] [fps] : 中心付近を拡大表示するスコープを切り替え")
+    print("  -scope-stats          : スコープの描画時間の統計を表示")
+    print("  --animation none|pulse|rotate : クロスヘアのアニメーションを切り替え")
+    print("  --blink-on-toggle on|off      : 表示に切り替えたときに点滅させる")
+    print("  -bloom                : クロスヘアを一瞬広げる")
+    print("  -anim-stats           : アニメーションの描画時間の統計を表示")
+    print("  --dynamic-spread on|off [px/秒] : マウスの移動速度に応じてクロスヘアを広げる")
+    print("  --shm-publish on|off [名前] : クロスヘア画像を共有メモリへ公開（配信ツール向け）")
+    print("  -stalls [件数]        : GUIが止まった記録（時間・待ちコマンド数・スタック）を表示")
+    print("  -undo / -redo         : 直前の設定変更を取り消す / やり直す")
+    print("  -mark-good            : 現在の設定を「正常だった設定」として記録")
+    print("  -revert-good          : 最後に正常だった設定へ戻す")
+    print("  -presets [検索語]     : プリセットを名前・タグで検索して一覧表示")
+    print("  -preset-load 名前     : プリセットを読み込む")
+    print("  -preset-save 名前 [タグ...] : 現在の見た目をプリセットとして保存")
+    print("  -export-code          : 現在の見た目を共有コードで表示")
+    print("  -import-code コード   : 共有コードの見た目を読み込む")
+    print("  --auto-profile on|off : 前面のアプリに応じてプロファイルを自動で切り替える")
+    print("  -profile 名前         : プロファイルを適用（-profile-save 名前 で現在の設定を保存）")
+    print("  -profile-rule パターン 名前 : プロセス名/タイトルのパターンにプロファイルを割り当て")
+    print("  -profiles             : プロファイルと割り当てルールを表示")
+    print("  --anchor [パターン]   : 指定ウィンドウの中央に追従（省略で画面中央に戻す）")
+    print("  --reticle add 名前 [dx dy] / set 名前 項目 値 / remove 名前 : 追加の照準を操作")
+    print("  -reticles             : 追加の照準を一覧表示")
+    print("  --hud clock|timer|fps on|off : 時計・経過時間・ゲームFPS（UDPで受信）を右上に表示")
+    print("  -history              : 入力したコマンドの履歴を表示（Tabキーで補完）")
+    print("  -params               : 現在のパラメータを全項目表示")
+    print("  --trace-start パス / --trace-stop : 届いたコマンドを記録（--replay で再生）")
+    print("  -events [件数] [語句] : コマンドと設定変更の記録を表示（語句で絞り込み）")
+    print("  --events-dump パス    : 記録を JSON Lines で書き出す")
+    print("  -exit                 : プログラムを終了")
+    print("  -help                 : このヘルプを表示します")
+
+DEFAULT_CONFIG = {
+    "crosshair_visible": True,
+    "dot_visible": True,
+    "dot_radius": 5,
+    "crosshair_color": "#00FF66",
+    "dot_outer_color": "#FFFFFF",
+    "dot_inner_color": "#000000",
+    "disabled_keys": [],  # 追加
+    "crosshair_alpha": 1.0,
+    "launch_mode": "gui",
+    "dot_alpha": 1.0,
+    "adaptive_color": False,
+    "adaptive_rate": 10,  # 1秒あたりのサンプリング回数
+    "adaptive_cpu_budget": 0.02,  # サンプリングに使ってよいCPU時間の割合
+    "scope_enabled": False,
+    "scope_zoom": 4,
+    "scope_fps": 30,
+    "render_backend": "qpainter",  # qpainter / numpy / opengl / opengl-software
+    "animation": "none",  # none / pulse / rotate
+    "blink_on_toggle": False,
+    "dynamic_spread": False,
+    "spread_sensitivity": 3000,  # この速度(px/秒)で最大まで広がる
+    "shm_publish": False,
+    "shm_name": "crosshair_reticle",
+    "stall_threshold_ms": 200,
+    "auto_profiles": False,
+    "profiles": {},  # 名前 → 設定（"preset" でプリセットの見た目を参照可）
+    "profile_rules": [],  # [{"match": "valorant.exe", "profile": "valorant"}, ...]
+    "anchor_window": "",  # 空なら画面中央。プロセス名/タイトルのパターンでウィンドウ中央に追従
+    "hud_clock": False,
+    "hud_timer": False,
+    "hud_fps": False,
+    "hud_fps_port": 47800,  # 外部ツールが FPS の数値を UDP で送る先（127.0.0.1）
+    "hud_color": "#FFFFFF",
+    "keyboard_backend": "keyboard",  # keyboard / evdev（Linux、次回起動時に反映）
+    "extra_reticles": [],  # 中心からずらして重ねる追加の照準（名前・位置・見た目）
+    "key_layers": {},  # 名前 → 無効化するキーの一覧（例: {"game": ["windows"], "chat": []}）
+    "key_layer": "",  # 使用中のレイヤー名（空なら disabled_keys をそのまま使う）
+    "key_layer_hotkeys": {},  # ホットキー → レイヤー名（例: {"ctrl+alt+1": "game"}）
+    "key_remaps": {},  # キー → 代わりに送るキー（例: {"caps lock": "ctrl"}）。無効化より優先
+}
+
+# GUIスレッド以外（CUI・IPC・計測など）から参照するための読み取り専用スナップショット
+OverlayState = collections.namedtuple("OverlayState", list(DEFAULT_CONFIG) + ["version"])
+
+def copy_config(config):
+    # ほとんどの値はスカラーなので、リストと辞書だけ複製する
+    return {k: copy.deepcopy(v) if isinstance(v, (list, dict)) else v for k, v in config.items()}
+
+
+def freeze_value(value):
+    # スナップショット用に、入れ子の辞書は読み取り専用のビュー、リストはタプルへ複製する
+    if isinstance(value, dict):
+        return types.MappingProxyType({k: freeze_value(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze_value(v) for v in value)
+    return value
+
+
+def thaw_value(value):
+    # freeze_value の逆。記録や JSON への書き出し用に通常の辞書・リストへ戻す
+    if isinstance(value, types.MappingProxyType):
+        return {k: thaw_value(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [thaw_value(v) for v in value]
+    return value
+
+
+class ConfigJournal:
+    # 変更は差分だけを追記し、一定件数ごとにスナップショット（CONFIG_FILE）へまとめる
+    def __init__(self, path=CONFIG_FILE, journal_path=JOURNAL_FILE, good_path=GOOD_CONFIG_FILE,
+                 compact_every=JOURNAL_COMPACT_EVERY):
+        self.path = path
+        self.journal_path = journal_path
+        self.good_path = good_path
+        self.compact_every = compact_every
+        self.lock = threading.RLock()
+        self.config = None
+        self.seq = 0
+        self.records = 0
+        self.undo_stack = collections.deque(maxlen=JOURNAL_UNDO_DEPTH)
+        self.redo_stack = []
+
+    def load(self):
+        with self.lock:
+            config = copy_config(DEFAULT_CONFIG)
+            seq = 0
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    snapshot = json.loads(f.read())
+                seq = snapshot.pop("_journal_seq", 0)
+                config.update(snapshot)
+            except Exception:
+                pass
+            self.records = 0
+            lines = []
+            try:
+                if os.stat(self.journal_path).st_size:
+                    with open(self.journal_path, "r", encoding="utf-8") as f:
+                        lines = f.read().splitlines()
+            except OSError:
+                pass
+            if lines:
+                try:
+                    # まとめて1回でデコードする（1行ずつより速い）
+                    records = json.loads("[" + ",".join(lines) + "]")
+                except ValueError:
+                    records = []
+                    for line in lines:
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            break  # 書き込み途中で落ちた末尾の行は捨てる
+                for record in records:
+                    if record["seq"] <= seq:
+                        continue  # スナップショットに反映済み
+                    config.update(record["set"])
+                    seq = record["seq"]
+                    self.records += 1
+            self.config = config
+            self.seq = seq
+            return copy_config(config)
+
+    def current(self):
+        # 書き込むのはこのプロセスだけなので、2回目以降はメモリ上の設定を返す
+        with self.lock:
+            if self.config is None:
+                return self.load()
+            return copy_config(self.config)
+
+    def append(self, changes):
+        self.seq += 1
+        line = json.dumps({"seq": self.seq, "t": round(time.time(), 3), "set": changes}, ensure_ascii=False)
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        self.config.update(copy_config(changes))
+        self.records += 1
+        if self.records >= self.compact_every:
+            self.compact()
+
+    def record(self, config):
+        # 前回から変わった項目だけを1行で追記する。戻り値は変更があったかどうか
+        with self.lock:
+            if self.config is None:
+                self.load()
+            changes = copy_config({k: v for k, v in config.items() if self.config.get(k) != v})
+            if not changes:
+                return False
+            previous = copy_config({k: self.config.get(k) for k in changes})
+            self.append(changes)
+            self.undo_stack.append((previous, changes))
+            self.redo_stack.clear()
+            return True
+
+    def compact(self):
+        with self.lock:
+            if self.config is None:
+                return
+            snapshot = dict(self.config, _journal_seq=self.seq)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, indent=4)
+            os.replace(tmp, self.path)
+            # スナップショットが先に置き換わるので、ここで落ちても二重適用はされない
+            open(self.journal_path, "w", encoding="utf-8").close()
+            self.records = 0
+
+    def undo(self):
+        with self.lock:
+            if not self.undo_stack:
+                return None
+            previous, changes = self.undo_stack.pop()
+            self.append(previous)
+            self.redo_stack.append((previous, changes))
+            return copy_config(self.config)
+
+    def redo(self):
+        with self.lock:
+            if not self.redo_stack:
+                return None
+            previous, changes = self.redo_stack.pop()
+            self.append(changes)
+            self.undo_stack.append((previous, changes))
+            return copy_config(self.config)
+
+    def mark_good(self):
+        # 正常に使えた設定を「最後に正常だった設定」として残す
+        with self.lock:
+            if self.config is None:
+                return
+            with open(self.good_path, "w", encoding="utf-8") as f:
+                json.dump(self.config, f, indent=4)
+
+    def revert_good(self):
+        with self.lock:
+            if not os.path.exists(self.good_path):
+                return None
+            with open(self.good_path, "r", encoding="utf-8") as f:
+                good = json.load(f)
+            self.record(dict(self.config or self.load(), **good))
+            return copy_config(self.config)
+
+
+config_journal = None
+
+
+def get_journal():
+    global config_journal
+    if config_journal is None:
+        config_journal = ConfigJournal()
+    return config_journal
+
+
+def load_config():
+    return get_journal().current()
+
+
+class EventLog:
+    # コマンドと設定変更の履歴を新しい順に一定件数だけメモリに持つ。dump() で JSON Lines に書き出す
+    def __init__(self, size=EVENT_LOG_SIZE):
+        self.entries = collections.deque(maxlen=size)
+        self.seq = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def add(self, kind, **fields):
+        entry = dict(seq=next(self.seq), time=round(time.time(), 3), kind=kind, **fields)
+        with self.lock:
+            self.entries.append(entry)
+        return entry
+
+    def query(self, limit=20, text=None):
+        with self.lock:
+            entries = list(self.entries)
+        if text:
+            entries = [e for e in entries if text in json.dumps(e, ensure_ascii=False)]
+        return entries[-limit:]
+
+    def dump(self, path):
+        with self.lock:
+            entries = list(self.entries)
+        with open(path, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return len(entries)
+
+
+event_log = None
+
+
+def get_event_log():
+    global event_log
+    if event_log is None:
+        event_log = EventLog()
+    return event_log
+
+
+def state_changes(old, new):
+    # 2つのスナップショットで値が変わった項目だけを {項目: [旧, 新]} で返す
+    if old is None:
+        return {}
+    return {k: [thaw_value(getattr(old, k)), thaw_value(getattr(new, k))] for k in new._fields
+            if k != "version" and getattr(old, k) != getattr(new, k)}
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return "ON" if value else "OFF"
+    if isinstance(value, float):
+        return f"{value:g}"
+    if isinstance(value, (list, tuple)):
+        return ", ".join(map(str, value)) if all(isinstance(v, str) for v in value) else f"{len(value)} 件"
+    if isinstance(value, dict):
+        return f"{len(value)} 件"
+    return str(value)
+
+
+def format_changes(changes):
+    return ", ".join(f"{k}: 更新" if isinstance(new, (list, tuple, dict)) and format_value(old) == format_value(new)
+                     else f"{k}: {format_value(old)} → {format_value(new)}" for k, (old, new) in changes.items())
+
+
+keyboard_backend = None
+
+
+def get_keyboard_backend(name=None):
+    # name を省略したときだけ設定ファイルから選ぶ
+    global keyboard_backend
+    if keyboard_backend is None:
+        if name is None:
+            name = load_config().get("keyboard_backend", "keyboard")
+        keyboard_backend = create_keyboard_backend(name)
+    return keyboard_backend
+
+def save_config(config):
+    try:
+        get_journal().record(config)
+    except Exception as e:
+        print("設定保存に失敗:", e)
+
+COLOR_TARGETS = {
+    "crosshair": ("crosshair_color", "crosshair_alpha"),
+    "dot_outer": ("dot_outer_color", "dot_alpha"),
+    "dot_inner": ("dot_inner_color", "dot_alpha"),
+}
+
+
+def parse_color(text):
+    # "#rgb" / "#rrggbb" / "#rrggbbaa" / "rgb(r,g,b)" / "rgba(r,g,b,a)" / "hsv(h,s,v)" / "hsva(h,s,v,a)" / 色名
+    # 戻り値は ("#rrggbb", 透明度 0.0〜1.0 または None)
+    value = "".join(text.split()).lower()
+    alpha = None
+    if value.startswith("#") and len(value) == 9:
+        color = QtGui.QColor(value[:7])
+        alpha = int(value[7:], 16) / 255 if color.isValid() else None
+    elif value.startswith(("rgb(", "rgba(", "hsv(", "hsva(")) and value.endswith(")"):
+        name, args = value[:-1].split("(", 1)
+        try:
+            numbers = [float(v) for v in args.split(",")]
+        except ValueError:
+            raise ValueError(f"色の指定が不正です: {text}")
+        if len(numbers) != len(name):
+            raise ValueError(f"色の指定が不正です: {text}")
+        if len(numbers) == 4:
+            alpha = numbers[3] if numbers[3] <= 1.0 else numbers[3] / 255
+        if name.startswith("rgb"):
+            color = QtGui.QColor(*[max(0, min(int(v), 255)) for v in numbers[:3]])
+        else:
+            # 色相は度、彩度・明度は 0〜100
+            h, sat, v = numbers[:3]
+            color = QtGui.QColor.fromHsvF((h % 360) / 360, max(0.0, min(sat / 100, 1.0)),
+                                          max(0.0, min(v / 100, 1.0)))
+    else:
+        color = QtGui.QColor(value)
+    if not color.isValid():
+        raise ValueError(f"色の指定が不正です: {text}")
+    return color.name(), None if alpha is None else round(max(0.0, min(alpha, 1.0)), 2)
+
+
+class CrosshairOverlay(QtWidgets.QWidget):
+    # config を渡すと設定ファイルを読み書きしない（埋め込み用）。show/hooks が False なら
+    # 表示やキー無効化は show()/start_hooks() を呼ぶまで行わない。埋め込み時のプリセットと
+    # 停止ログは presets/stall_log を渡したときだけ使う
+    layer_hotkey = QtCore.pyqtSignal(str)
+
+    def __init__(self, config=None, show=True, hooks=True, presets=None, stall_log=None):
+        super().__init__()
+        self.setWindowFlags(
+            QtCore.Qt.FramelessWindowHint |
+            QtCore.Qt.WindowStaysOnTopHint |
+            QtCore.Qt.WindowTransparentForInput |
+            QtCore.Qt.Tool
+        )
+        self.setAttribute(QtCore.Qt.WA_TranslucentBackground)
+        if show:
+            self.showFullScreen()
+        else:
+            self.setGeometry(QtWidgets.QApplication.primaryScreen().geometry())
+
+        screen = QtWidgets.QApplication.primaryScreen().size()
+        self.screen_center = (screen.width() // 2, screen.height() // 2)
+        self.center_x, self.center_y = self.screen_center
+        self.size = 20
+        self.gap = 10
+        self.spread = 0.0
+
+        self.persist = config is None
+        config = load_config() if config is None else dict(DEFAULT_CONFIG, **copy_config(config))
+
+        self.crosshair_visible = config["crosshair_visible"]
+        self.dot_visible = config["dot_visible"]
+        self.dot_radius = config["dot_radius"]
+        self.crosshair_color = config["crosshair_color"]
+        self.dot_outer_color = config["dot_outer_color"]
+        self.dot_inner_color = config["dot_inner_color"]
+        self.launch_mode = config.get("launch_mode", "cui")
+
+        self.crosshair_alpha = config.get("crosshair_alpha", 1.0)
+        self.dot_alpha = config.get("dot_alpha", 1.0)
+
+
+
+        self.disabled_keys = list(config["disabled_keys"])
+        self.keyboard_backend = config.get("keyboard_backend", "keyboard")
+        self.key_layers = config.get("key_layers", {})
+        self.key_layer = config.get("key_layer", "")
+        self.key_layer_hotkeys = config.get("key_layer_hotkeys", {})
+        self.key_remaps = config.get("key_remaps", {})
+        self.hotkey_handles = {}
+        # フックのスレッドから emit されるので、GUI スレッドのイベントループ経由で届く
+        self.layer_hotkey.connect(self.on_layer_hotkey)
+        self.hooks_active = False
+        if hooks:
+            self.start_hooks()
+
+        self.adaptive_color = config.get("adaptive_color", False)
+        self.adaptive_rate = config.get("adaptive_rate", 10)
+        self.adaptive_cpu_budget = config.get("adaptive_cpu_budget", 0.02)
+        self.adaptive = AdaptiveColorController(self)
+        self.adaptive.configure(self.adaptive_rate, self.adaptive_cpu_budget)
+        if self.adaptive_color:
+            self.adaptive.start()
+
+        self.scope_enabled = config.get("scope_enabled", False)
+        self.scope_zoom = config.get("scope_zoom", 4)
+        self.scope_fps = config.get("scope_fps", 30)
+        self.scope = ScopeController(self)
+        if np is not None:
+            self.scope.configure(self.scope_zoom, self.scope_fps)
+        if self.scope_enabled:
+            self.scope.start()
+
+        self.renderer = None
+        self.set_render_backend(config.get("render_backend", "qpainter"))
+
+        self.scheduler = FrameScheduler(self)
+        self.dynamic_spread = False
+        self.spread_sensitivity = config.get("spread_sensitivity", 3000)
+        self.motion = None
+        if config.get("dynamic_spread", False):
+            try:
+                self.set_dynamic_spread(True)
+            except RuntimeError as e:
+                print(e)
+        self.blink_on_toggle = config.get("blink_on_toggle", False)
+        self.animation = "none"
+        self.set_animation(config.get("animation", "none"))
+
+        self.shm_name = config.get("shm_name", "crosshair_reticle")
+        self.publisher = None
+        if config.get("shm_publish", False):
+            self.set_shm_publish(True)
+
+        self.color_editors = {}
+
+        # 埋め込み時にライブラリが渡されなければフォルダには触れず、一覧は空のままにする
+        self.presets_enabled = self.persist or presets is not None
+        self.presets = presets if presets is not None else PresetLibrary()
+        if self.presets_enabled:
+            try:
+                os.makedirs(self.presets.directory, exist_ok=True)
+                self.presets.refresh()
+            except OSError as e:
+                print("プリセットフォルダを読めません:", e)
+        self.preset_notifier = PresetThumbnailNotifier(self)
+        self.preset_notifier.ready.connect(self.on_thumbnail_ready)
+
+        self.profiles = config.get("profiles", {})
+        self.profile_rules = config.get("profile_rules", [])
+        self.profile_switcher = None
+        if config.get("auto_profiles", False):
+            try:
+                self.set_auto_profiles(True)
+            except RuntimeError as e:
+                print(e)
+
+        self.anchor_window = ""
+        self.window_tracker = None
+        if config.get("anchor_window"):
+            try:
+                self.set_anchor(config["anchor_window"])
+            except RuntimeError as e:
+                print(e)
+
+        self.reticles = ReticleLayer(config.get("extra_reticles", []))
+
+        self.hud_color = config.get("hud_color", "#FFFFFF")
+        self.hud_fps_port = config.get("hud_fps_port", 47800)
+        self.hud = HudOverlay(self, self.hud_color, self.hud_fps_port)
+        for name in HudOverlay.ORDER:
+            if config.get("hud_" + name, False):
+                self.hud.set_enabled(name, True)
+
+        self.stall_threshold_ms = config.get("stall_threshold_ms", 200)
+        if stall_log is None:
+            stall_log = STALL_LOG_FILE if self.persist else ""
+        self.watchdog = StallWatchdog(self, self.stall_threshold_ms, log_file=stall_log)
+        self.watchdog.start()
+
+        self.paint_count = 0
+        self.state = None
+        self.publish_state()
+
+    @property
+    def keys(self):
+        return get_keyboard_backend(self.keyboard_backend)
+
+    def start_hooks(self):
+        # 保存されたキーを無効化する
+        if self.hooks_active:
+            return
+        self.hooks_active = True
+        for k in self.disabled_keys:
+            try:
+                self.keys.block_key(k)
+            except Exception as e:
+                print(f"キー {k} の無効化に失敗: {e}")
+        for hotkey in self.key_layer_hotkeys:
+            self.register_layer_hotkey(hotkey)
+        if self.key_remaps:
+            try:
+                self.keys.apply_remaps(self.key_remaps)
+            except (ValueError, KeyError) as e:
+                print(f"キーの置き換えに失敗: {e}")
+
+    def stop_hooks(self):
+        # 無効化を解除する。disabled_keys は残すので start_hooks() で元に戻せる
+        if not self.hooks_active:
+            return
+        self.hooks_active = False
+        for k in self.disabled_keys:
+            try:
+                self.keys.unblock_key(k)
+            except (KeyError, ValueError):
+                pass
+        for handle in self.hotkey_handles.values():
+            try:
+                self.keys.remove_hotkey(handle)
+            except (KeyError, ValueError):
+                pass
+        self.hotkey_handles.clear()
+        if self.key_remaps:
+            self.keys.apply_remaps({})
+
+    def set_key_remap_table(self, remaps):
+        if self.hooks_active:
+            self.keys.apply_remaps(remaps)
+        self.key_remaps = dict(remaps)
+
+    def set_key_remap(self, source, target):
+        # target が空なら置き換えをやめる
+        remaps = {k: v for k, v in self.key_remaps.items() if k != source}
+        if target:
+            if source == "enter":
+                raise ValueError("Enterキーは置き換えできません")
+            remaps[source] = target
+        self.set_key_remap_table(remaps)
+
+    def register_layer_hotkey(self, hotkey):
+        # フックのスレッドから呼ばれるので、切り替えはシグナルで GUI スレッドへ渡す（poll_commands がなくても動く）
+        layer = self.key_layer_hotkeys[hotkey]
+        try:
+            self.hotkey_handles[hotkey] = self.keys.add_hotkey(hotkey, lambda: self.layer_hotkey.emit(layer))
+        except (ValueError, KeyError) as e:
+            print(f"ホットキー {hotkey} を登録できません: {e}")
+
+    def on_layer_hotkey(self, layer):
+        if trace_recorder is not None:
+            trace_recorder.record("hotkey", "set_key_layer", layer)
+        try:
+            self.set_key_layer(layer)
+        except ValueError as e:
+            print(e)
+            return
+        self.commit_change("hotkey", layer)
+
+    def set_key_layer(self, name):
+        # 新旧レイヤーの差分だけを1回で反映する。"" なら全キーを有効に戻す
+        if name and name not in self.key_layers:
+            raise ValueError(f"キーレイヤー {name} はありません")
+        keys = [k for k in self.key_layers.get(name, []) if k != "enter"]
+        if self.hooks_active:
+            self.keys.apply_blocked([k for k in keys if k not in self.disabled_keys],
+                                    [k for k in self.disabled_keys if k not in keys])
+        self.disabled_keys = keys
+        self.key_layer = name
+
+    def save_key_layer(self, name):
+        self.key_layers = {**self.key_layers, name: list(self.disabled_keys)}
+        self.key_layer = name
+
+    def bind_key_layer(self, hotkey, name):
+        if name not in self.key_layers:
+            raise ValueError(f"キーレイヤー {name} はありません")
+        if hotkey in self.hotkey_handles:
+            self.keys.remove_hotkey(self.hotkey_handles.pop(hotkey))
+        self.key_layer_hotkeys = {**self.key_layer_hotkeys, hotkey: name}
+        if self.hooks_active:
+            self.register_layer_hotkey(hotkey)
+
+    def save_config(self):
+        # 埋め込み時（persist が False）は利用者の設定ファイルに書かない
+        if self.persist:
+            save_config(self.get_config())
+
+    def apply_settings(self, settings):
+        # 複数の設定をまとめて反映し、状態の公開と再描画を1回で済ませる
+        unknown = [k for k in settings if k not in DEFAULT_CONFIG]
+        if unknown:
+            raise ValueError(f"不明な設定: {', '.join(unknown)}")
+        self.apply_config(settings)
+        self.commit_change("api", "apply_settings")
+
+    def shutdown(self):
+        # タイマー・スレッド・フック・共有メモリを止めてウィンドウを閉じる
+        self.stop_hooks()
+        self.adaptive.stop()
+        self.scope.stop()
+        if self.motion is not None:
+            self.motion.stop()
+            self.motion = None
+        if self.profile_switcher is not None:
+            self.profile_switcher.stop()
+        if self.window_tracker is not None:
+            self.window_tracker.stop()
+        for name in list(self.hud.elements):
+            self.hud.set_enabled(name, False)
+        self.scheduler.timer.stop()
+        if hasattr(self, "save_timer"):
+            self.save_timer.stop()
+        self.watchdog.stop()
+        self.set_shm_publish(False)
+        self.renderer.detach()
+        self.close()
+        self.deleteLater()
+
+    class KeyCaptureDialog(QtWidgets.QDialog):
+        def __init__(self, parent=None, message="キーを押してください", allow_keys=None, cancel_callback=None, key_callback=None):
+            super().__init__(parent)
+            self.setWindowFlags(self.windowFlags() & ~QtCore.Qt.WindowContextHelpButtonHint)
+            self.setWindowTitle("キー入力待機")
+            self.setWindowModality(QtCore.Qt.ApplicationModal)
+            self.setLayout(QtWidgets.QVBoxLayout())
+            self.label = QtWidgets.QLabel(message)
+            self.layout().addWidget(self.label)
+            self.cancel_callback = cancel_callback
+            self.key_callback = key_callback
+            self.allow_keys = allow_keys
+
+            cancel_button = QtWidgets.QPushButton("キャンセル")
+            cancel_button.clicked.connect(self.cancel)
+            self.layout().addWidget(cancel_button)
+            self.resize(300, 100)
+
+        def cancel(self):
+            self.reject()
+            if self.cancel_callback:
+                self.cancel_callback()
+
+        def keyPressEvent(self, event):
+            # まず event.text() で取得を試みる
+            key = event.text().lower()
+            if not key:
+                # 取得できなければ従来の方法へフォールバック
+                key = QtGui.QKeySequence(event.key()).toString().lower()
+            if key == "return":
+                QtWidgets.QMessageBox.information(self, "無効化不可", "Enterキーは無効化できません。")
+                return
+            self.accept()
+            if self.key_callback:
+                self.key_callback(key)
+
+    def toggle_crosshair(self):
+        self.crosshair_visible = not self.crosshair_visible
+        if self.crosshair_visible and self.blink_on_toggle:
+            self.scheduler.add(BlinkAnimation())
+
+    def toggle_dot(self):
+        self.dot_visible = not self.dot_visible
+        if self.dot_visible and self.blink_on_toggle:
+            self.scheduler.add(BlinkAnimation())
+
+    def set_dot_size(self, diameter):
+        self.dot_radius = max(1, min(diameter, 100)) // 2
+
+    def pick_crosshair_color(self, value=None):
+        self.pick_color("crosshair", value)
+
+    def pick_dot_outer_color(self, value=None):
+        self.pick_color("dot_outer", value)
+
+    def pick_dot_inner_color(self, value=None):
+        self.pick_color("dot_inner", value)
+
+    def pick_color(self, target, value=None):
+        # 値があればそのまま反映し、なければ非モーダルのカラーダイアログを開く
+        if value is None:
+            self.open_color_editor(target)
+            return
+        color, alpha = parse_color(value)
+        self.apply_color(target, color, alpha)
+
+    def apply_color(self, target, color, alpha=None):
+        color_attr, alpha_attr = COLOR_TARGETS[target]
+        setattr(self, color_attr, color)
+        if alpha is not None:
+            setattr(self, alpha_attr, max(0.0, min(alpha, 1.0)))
+        self.sync_panel()
+        self.update(self.reticle_rect())
+
+    def open_color_editor(self, target):
+        if target in self.color_editors:
+            self.color_editors[target].raise_()
+            return
+        color_attr, alpha_attr = COLOR_TARGETS[target]
+        original = (getattr(self, color_attr), getattr(self, alpha_attr))
+        initial = QtGui.QColor(original[0])
+        initial.setAlphaF(original[1])
+        dialog = QtWidgets.QColorDialog(initial)
+        dialog.setOption(QtWidgets.QColorDialog.ShowAlphaChannel)
+        dialog.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+        dialog.setWindowFlags(dialog.windowFlags() | QtCore.Qt.WindowStaysOnTopHint)
+        # 選択中の色をそのままプレビューし、キャンセルなら元に戻す
+        dialog.currentColorChanged.connect(
+            lambda c: (self.apply_color(target, c.name(), round(c.alphaF(), 2)), self.schedule_save()))
+        dialog.rejected.connect(lambda: (self.apply_color(target, *original), self.schedule_save()))
+        dialog.finished.connect(lambda _: self.color_editors.pop(target, None))
+        self.color_editors[target] = dialog
+        dialog.show()
+
+    def schedule_save(self):
+        # ドラッグ中などの連続変更はまとめて1回だけ保存する
+        if not hasattr(self, "save_timer"):
+            self.save_timer = QtCore.QTimer(self)
+            self.save_timer.setSingleShot(True)
+            self.save_timer.timeout.connect(lambda: self.commit_change("panel", "color"))
+        self.save_timer.start(500)
+
+    def sync_panel(self):
+        # コントロールパネルが開いていれば表示を現在値に合わせる
+        if not hasattr(self, "color_swatches"):
+            return
+        self.crosshair_state.setText("ON" if self.crosshair_visible else "OFF")
+        self.dot_state.setText("ON" if self.dot_visible else "OFF")
+        self.disabled_keys_label.setText(", ".join(self.disabled_keys) if self.disabled_keys else "なし")
+        self.dot_slider.blockSignals(True)
+        self.dot_slider.setValue(self.dot_radius * 2)
+        self.dot_slider.blockSignals(False)
+        self.dot_value.setText(str(self.dot_radius * 2))
+        for target, (swatch, edit) in self.color_swatches.items():
+            color = getattr(self, COLOR_TARGETS[target][0])
+            swatch.setStyleSheet(f"background-color: {color}; border: 1px solid black;")
+            if not edit.hasFocus():
+                edit.setText(color)
+        for slider, label, value in ((self.alpha_slider, self.alpha_value, self.crosshair_alpha),
+                                     (self.dot_alpha_slider, self.dot_alpha_value, self.dot_alpha)):
+            slider.blockSignals(True)
+            slider.setValue(int(round(value * 100)))
+            slider.blockSignals(False)
+            label.setText(str(value))
+
+    def get_config(self):
+        return {
+            "crosshair_visible": self.crosshair_visible,
+            "dot_visible": self.dot_visible,
+            "dot_radius": self.dot_radius,
+            "crosshair_color": self.crosshair_color,
+            "dot_outer_color": self.dot_outer_color,
+            "dot_inner_color": self.dot_inner_color,
+            "disabled_keys": self.disabled_keys,
+            "crosshair_alpha": self.crosshair_alpha,
+            "dot_alpha": self.dot_alpha,
+            "launch_mode": self.launch_mode if hasattr(self, "launch_mode") else "cui",
+            "adaptive_color": self.adaptive_color,
+            "adaptive_rate": self.adaptive_rate,
+            "adaptive_cpu_budget": self.adaptive_cpu_budget,
+            "scope_enabled": self.scope_enabled,
+            "scope_zoom": self.scope_zoom,
+            "scope_fps": self.scope_fps,
+            "render_backend": self.render_backend,
+            "animation": self.animation,
+            "blink_on_toggle": self.blink_on_toggle,
+            "dynamic_spread": self.dynamic_spread,
+            "spread_sensitivity": self.spread_sensitivity,
+            "shm_publish": self.publisher is not None,
+            "shm_name": self.shm_name,
+            "stall_threshold_ms": self.stall_threshold_ms,
+            "auto_profiles": self.profile_switcher is not None,
+            "profiles": self.profiles,
+            "profile_rules": self.profile_rules,
+            "anchor_window": self.anchor_window,
+            "hud_clock": "clock" in self.hud.elements,
+            "hud_timer": "timer" in self.hud.elements,
+            "hud_fps": "fps" in self.hud.elements,
+            "hud_fps_port": self.hud_fps_port,
+            "hud_color": self.hud_color,
+            "keyboard_backend": self.keyboard_backend,
+            "extra_reticles": self.reticles.to_config(),
+            "key_layers": self.key_layers,
+            "key_layer": self.key_layer,
+            "key_layer_hotkeys": self.key_layer_hotkeys,
+            "key_remaps": self.key_remaps,
+        }
+
+    def add_reticle(self, name, offset_x=0, offset_y=0):
+        # 今のメインの見た目を引き継いで追加する
+        style = {k: getattr(self, k) for k in RETICLE_KEYS}
+        style.update(size=self.size, gap=self.gap)
+        self.update(self.reticles.add(name, offset_x, offset_y, style, self.center_x, self.center_y))
+
+    def set_reticle(self, name, key, value):
+        self.update(self.reticles.set(name, key, value, self.center_x, self.center_y))
+
+    def remove_reticle(self, name):
+        self.update(self.reticles.remove(name, self.center_x, self.center_y))
+
+    def set_hud(self, name, enabled):
+        if name not in HudOverlay.ORDER:
+            raise ValueError(f"不明なHUD項目: {name}")
+        self.hud.set_enabled(name, enabled)
+
+    def resizeEvent(self, event):
+        # 全画面化やウィンドウサイズ変更のあとで HUD を右上に置き直す
+        if hasattr(self, "hud"):
+            self.hud.layout()
+        super().resizeEvent(event)
+
+    def set_anchor(self, pattern, tracker=None):
+        if self.window_tracker is not None:
+            self.window_tracker.stop()
+            self.window_tracker = None
+        self.anchor_window = pattern or ""
+        if not self.anchor_window:
+            self.move_center(*self.screen_center)
+            return
+        self.window_tracker = tracker or create_window_tracker()
+        self.window_tracker.start(self.anchor_window, self.on_anchor_rect)
+
+    def on_anchor_rect(self, rect):
+        # rect は画面座標の (x, y, 幅, 高さ)。見つからなければ画面中央に戻す
+        if rect is None:
+            self.move_center(*self.screen_center)
+            return
+        x, y, width, height = rect
+        ratio = self.devicePixelRatioF() or 1.0
+        center = self.mapFromGlobal(QtCore.QPoint(int((x + width / 2) / ratio), int((y + height / 2) / ratio)))
+        self.move_center(center.x(), center.y())
+
+    def move_center(self, x, y):
+        # 位置だけを変える。スプライトは描き直さず、新旧の範囲だけ再描画する
+        if (x, y) == (self.center_x, self.center_y):
+            return
+        dirty = self.reticle_rect().united(self.reticles.bounds(self.center_x, self.center_y))
+        if self.scope.active:
+            dirty = dirty.united(self.scope.inset_rect())
+        self.center_x, self.center_y = x, y
+        dirty = dirty.united(self.reticle_rect()).united(self.reticles.bounds(x, y))
+        if self.scope.active:
+            dirty = dirty.united(self.scope.inset_rect())
+        self.update(dirty.adjusted(-1, -1, 1, 1))
+
+    def set_auto_profiles(self, enabled, backend=None):
+        if self.profile_switcher is not None:
+            self.profile_switcher.stop()
+            self.profile_switcher = None
+        if enabled:
+            self.profile_switcher = ProfileSwitcher(self, backend or create_foreground_backend())
+            self.profile_switcher.start()
+
+    def profile_settings(self, name):
+        if name not in self.profiles:
+            raise KeyError(f"プロファイル {name} がありません")
+        profile = dict(self.profiles[name])
+        preset = profile.pop("preset", None)
+        if preset:
+            profile = dict(self.presets.load(preset), **profile)
+        return profile
+
+    def apply_profile(self, name):
+        # 変わる項目だけを反映する（無効化キーも差分だけを付け外しする）
+        current = self.get_config()
+        changes = {k: v for k, v in self.profile_settings(name).items() if current.get(k) != v}
+        if changes:
+            self.apply_config(changes)
+        print(f"プロファイル {name} に切り替えました（変更 {len(changes)} 項目）。")
+
+    def save_profile(self, name):
+        config = self.get_config()
+        self.profiles[name] = {k: config[k] for k in RETICLE_KEYS + ("disabled_keys",)}
+        self.profiles[name]["disabled_keys"] = list(self.disabled_keys)
+
+    def add_profile_rule(self, pattern, profile):
+        self.profile_rules = [r for r in self.profile_rules if r["match"] != pattern]
+        self.profile_rules.append({"match": pattern, "profile": profile})
+
+    def apply_config(self, config):
+        # 設定の辞書をまとめて反映する（取り消し・やり直し・復元などで使う）
+        current = self.get_config()
+        for key in ("crosshair_visible", "dot_visible", "dot_radius", "crosshair_color", "dot_outer_color",
+                    "dot_inner_color", "crosshair_alpha", "dot_alpha", "launch_mode", "blink_on_toggle"):
+            if key in config:
+                setattr(self, key, config[key])
+        if config.get("render_backend", current["render_backend"]) != current["render_backend"]:
+            self.set_render_backend(config["render_backend"])
+        if config.get("stall_threshold_ms", current["stall_threshold_ms"]) != current["stall_threshold_ms"]:
+            self.set_stall_threshold(config["stall_threshold_ms"])
+        if "extra_reticles" in config and config["extra_reticles"] != current["extra_reticles"]:
+            dirty = self.reticles.bounds(self.center_x, self.center_y)
+            self.reticles = ReticleLayer(config["extra_reticles"])
+            self.update(dirty.united(self.reticles.bounds(self.center_x, self.center_y)))
+        if "key_layers" in config:
+            self.key_layers = config["key_layers"]
+        if config.get("key_remaps", current["key_remaps"]) != current["key_remaps"]:
+            self.set_key_remap_table(config["key_remaps"])
+        if config.get("key_layer", current["key_layer"]) != current["key_layer"]:
+            self.key_layer = config["key_layer"]
+        if "disabled_keys" in config:
+            for k in [k for k in self.disabled_keys if k not in config["disabled_keys"]]:
+                self.enable_key(k)
+            for k in config["disabled_keys"]:
+                self.disable_key(k)
+        if config.get("animation", current["animation"]) != current["animation"]:
+            self.set_animation(config["animation"])
+        keys = ("adaptive_color", "adaptive_rate", "adaptive_cpu_budget")
+        if any(config.get(k, current[k]) != current[k] for k in keys):
+            self.set_adaptive_color(*[config.get(k, current[k]) for k in keys])
+        keys = ("scope_enabled", "scope_zoom", "scope_fps")
+        if any(config.get(k, current[k]) != current[k] for k in keys):
+            self.set_scope(*[config.get(k, current[k]) for k in keys])
+        keys = ("dynamic_spread", "spread_sensitivity")
+        if any(config.get(k, current[k]) != current[k] for k in keys):
+            self.set_dynamic_spread(*[config.get(k, current[k]) for k in keys])
+        keys = ("shm_publish", "shm_name")
+        if any(config.get(k, current[k]) != current[k] for k in keys):
+            self.set_shm_publish(*[config.get(k, current[k]) for k in keys])
+        for name in HudOverlay.ORDER:
+            if config.get("hud_" + name, current["hud_" + name]) != current["hud_" + name]:
+                self.set_hud(name, config["hud_" + name])
+        if config.get("anchor_window", current["anchor_window"]) != current["anchor_window"]:
+            self.set_anchor(config["anchor_window"])
+        self.sync_panel()
+        self.update()
+
+    def journal(self):
+        if not self.persist:
+            raise RuntimeError("埋め込み時は設定の履歴（取り消し・復元）を使えません。")
+        return get_journal()
+
+    def undo(self):
+        config = self.journal().undo()
+        if config is None:
+            print("取り消せる変更はありません。")
+            return
+        self.apply_config(config)
+
+    def redo(self):
+        config = self.journal().redo()
+        if config is None:
+            print("やり直せる変更はありません。")
+            return
+        self.apply_config(config)
+
+    def revert_to_good(self):
+        config = self.journal().revert_good()
+        if config is None:
+            print("正常だった設定の記録がありません。")
+            return
+        self.apply_config(config)
+
+    def set_shm_publish(self, enabled, name=None):
+        if self.publisher is not None:
+            self.publisher.close()
+            self.publisher = None
+        if name:
+            self.shm_name = name
+        if enabled:
+            self.publisher = SharedReticlePublisher(self.shm_name)
+            self.update(self.reticle_rect())
+
+    def set_dynamic_spread(self, enabled, sensitivity=None, hook=True):
+        if sensitivity is not None:
+            self.spread_sensitivity = max(100, int(sensitivity))
+        if self.motion is not None:
+            self.motion.stop()
+            self.motion = None
+        self.dynamic_spread = enabled
+        if enabled:
+            self.motion = MotionSpread(self.spread_sensitivity)
+            self.motion.spread_changed.connect(self.set_spread)
+            self.motion.start(hook)
+        else:
+            self.set_spread(0.0)
+
+    def set_spread(self, spread):
+        if spread != self.spread:
+            self.spread = spread
+            self.update(self.reticle_rect())
+
+    def set_scope(self, enabled, zoom=None, fps=None):
+        if np is None:
+            raise RuntimeError("スコープ表示には NumPy が必要です。")
+        self.scope_enabled = enabled
+        if zoom is not None:
+            self.scope_zoom = max(2, min(int(zoom), 8))
+        if fps is not None:
+            self.scope_fps = max(1, min(int(fps), 120))
+        self.scope.configure(self.scope_zoom, self.scope_fps)
+        if enabled:
+            self.scope.start()
+        else:
+            self.scope.stop()
+
+    def set_adaptive_color(self, enabled, rate=None, cpu_budget=None):
+        self.adaptive_color = enabled
+        if rate is not None:
+            self.adaptive_rate = rate
+        if cpu_budget is not None:
+            self.adaptive_cpu_budget = cpu_budget
+        self.adaptive.configure(self.adaptive_rate, self.adaptive_cpu_budget)
+        if enabled:
+            self.adaptive.start()
+        else:
+            self.adaptive.stop()
+
+    def publish_state(self):
+        # 変更のたびに新しいスナップショットを作って丸ごと差し替える（GUIスレッドからのみ呼ぶ）
+        # 入れ子の辞書・リストも凍結して、他スレッドから書き換えられないようにする
+        config = {k: freeze_value(v) for k, v in self.get_config().items()}
+        version = self.state.version + 1 if self.state else 0
+        self.state = OverlayState(version=version, **config)
+
+    def commit_change(self, source, action):
+        # パネル操作やプロファイルの自動切り替えも、コマンドと同じく公開・記録・保存する
+        return publish_changes(self, get_event_log(), lambda config: self.save_config(), "change",
+                               source=source, action=action)
+
+    def print_parameters(self):
+        print("=== 現在のパラメータ ===")
+        print(f"  クロスヘア表示: {'ON' if self.crosshair_visible else 'OFF'}")
+        print(f"  クロスヘア色 : {self.crosshair_color}")
+        print(f"  ドット表示   : {'ON' if self.dot_visible else 'OFF'}")
+        print(f"  ドット外枠色 : {self.dot_outer_color}")
+        print(f"  ドット内側色 : {self.dot_inner_color}")
+        print(f"  ドット直径   : {self.dot_radius * 2}")
+        print(f"  クロスヘア透明度: {self.crosshair_alpha}")
+        print(f"  ドット透明度   : {self.dot_alpha}")
+        print(f"  アダプティブ色 : {'ON' if self.adaptive_color else 'OFF'} ({self.adaptive_rate}Hz)")
+        print(f"  スコープ     : {'ON' if self.scope_enabled else 'OFF'} (x{self.scope_zoom}, {self.scope_fps}fps)")
+        print(f"  描画方式     : {self.render_backend}")
+        print(f"  キー入力     : {self.keys.name}")
+        print(f"  アニメーション: {self.animation}（表示時の点滅: {'ON' if self.blink_on_toggle else 'OFF'}）")
+        print(f"  動的拡散     : {'ON' if self.dynamic_spread else 'OFF'} ({self.spread_sensitivity}px/秒で最大)")
+        print(f"  無効化キー   : {', '.join(self.disabled_keys) if self.disabled_keys else 'なし'}"
+              + (f"（レイヤー {self.key_layer}）" if self.key_layer else ""))
+        if self.key_remaps:
+            print(f"  置き換え     : {', '.join(f'{k} → {v}' for k, v in self.key_remaps.items())}")
+        print("=====================")
+
+    def paintEvent(self, event):
+        started = time.perf_counter()
+        self.paint_count += 1
+        painter = QtGui.QPainter(self)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        effects = self.scheduler.effects()
+        # HUD の数字だけが変わったときなどはクロスヘアを描かず、設定の辞書も作らない
+        if event.rect().intersects(self.reticle_rect(effects["scale"])):
+            settings = {k: getattr(self, k) for k in RETICLE_KEYS}
+            if self.adaptive.color:
+                settings["crosshair_color"] = self.adaptive.color
+            gap = int(round(self.gap + self.spread * SPREAD_GAP))
+            size = int(round((self.size + self.spread * SPREAD_SIZE) * effects["scale"]))
+            if effects["visible"]:
+                settings["crosshair_alpha"] *= effects["alpha"]
+                settings["dot_alpha"] *= effects["alpha"]
+                # 回転は各バックエンドに任せる（OpenGL は別の面に描くので painter の変換が効かない）
+                self.renderer.paint(painter, settings, self.center_x, self.center_y, size, gap, effects["angle"])
+            if self.publisher is not None:
+                self.publisher.publish(settings, size, gap, effects["angle"], effects["visible"])
+        if self.reticles.instances:
+            self.reticles.paint(painter, event.rect(), self.center_x, self.center_y, self.devicePixelRatioF() or 1.0)
+        if self.scope.active:
+            self.scope.paint(painter)
+        if self.hud.active:
+            self.hud.paint(painter, event.rect())
+        painter.end()
+        if self.scheduler.active:
+            self.scheduler.record_paint(time.perf_counter() - started)
+
+    def reticle_rect(self, scale=1.0):
+        # 回転しても収まるよう対角線ぶんの余白をとる
+        size = self.size + SPREAD_SIZE if self.dynamic_spread else self.size
+        extent = int(max(size * scale, self.dot_radius) * 1.5) + 4
+        return QtCore.QRect(self.center_x - extent, self.center_y - extent, extent * 2, extent * 2)
+
+    def set_render_backend(self, name):
+        # 新しいバックエンドを付けてから古いものを外す。使えなければ qpainter にし、実際に使っている名前を記録する
+        renderer = create_renderer(name)
+        try:
+            renderer.attach(self)
+        except Exception as e:
+            print(f"描画バックエンド {name} を使えないため qpainter を使います: {e}")
+            renderer = QPainterRenderer()
+        if self.renderer is not None:
+            self.renderer.detach()
+        self.renderer = renderer
+        self.render_backend = name if type(renderer) is RENDERERS.get(name) else renderer.name
+        self.update()
+
+    def set_stall_threshold(self, ms):
+        self.stall_threshold_ms = ms
+        self.watchdog.threshold = ms / 1000.0
+
+    def set_animation(self, name):
+        if name != "none" and name not in ANIMATIONS:
+            raise ValueError(f"不明なアニメーション: {name}")
+        for cls in ANIMATIONS.values():
+            self.scheduler.remove(cls)
+        self.animation = name
+        if name in ANIMATIONS:
+            self.scheduler.add(ANIMATIONS[name]())
+        self.update(self.reticle_rect())
+
+    def bloom(self):
+        self.scheduler.add(BloomAnimation())
+
+    def render_to_image(self, width, height, dpr=1.0):
+        # 現在の見た目を画面なしで画像化する
+        return render_reticle_image(self.get_config(), width, height, dpr, self.size)
+
+    
+    def disable_key(self, key):
+        if key == "enter":
+            print("Enterキーは無効化できません。")
+            return
+        if key not in self.disabled_keys:
+            self.disabled_keys.append(key)
+            if self.hooks_active:
+                self.keys.block_key(key)
+
+    def enable_key(self, key):
+        if key in self.disabled_keys:
+            self.disabled_keys.remove(key)
+            if not self.hooks_active:
+                return
+            try:
+                self.keys.unblock_key(key)
+            except KeyError:
+                pass  # すでにアンブロックされている場合は無視
+
+
+    def enable_all_keys(self):
+        # 無効化したキーだけを解除する。レイヤーのホットキーと置き換えはそのまま残す
+        if self.hooks_active:
+            self.keys.apply_blocked([], list(self.disabled_keys))
+        self.disabled_keys.clear()
+
+    def show_control_panel(self):
+        self.panel = QtWidgets.QWidget()
+        self.panel.setWindowTitle("Crosshair Control Panel")
+        layout = QtWidgets.QVBoxLayout()
+
+        # クロスヘア表示切替
+        self.crosshair_btn = QtWidgets.QPushButton("クロスヘア表示/非表示")
+        self.crosshair_state = QtWidgets.QLabel("ON" if self.crosshair_visible else "OFF")
+        self.crosshair_btn.clicked.connect(self.toggle_crosshair_button)
+        h1 = QtWidgets.QHBoxLayout()
+        h1.addWidget(self.crosshair_btn)
+        h1.addWidget(self.crosshair_state)
+        layout.addLayout(h1)
+
+        # ドット表示切替
+        self.dot_btn = QtWidgets.QPushButton("ドット表示/非表示")
+        self.dot_state = QtWidgets.QLabel("ON" if self.dot_visible else "OFF")
+        self.dot_btn.clicked.connect(self.toggle_dot_button)
+        h2 = QtWidgets.QHBoxLayout()
+        h2.addWidget(self.dot_btn)
+        h2.addWidget(self.dot_state)
+        layout.addLayout(h2)
+
+        # ドットサイズスライダー
+        dotsize_layout = QtWidgets.QHBoxLayout()
+        dotsize_label = QtWidgets.QLabel("ドットサイズ")
+        self.dot_slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.dot_slider.setMinimum(0)
+        self.dot_slider.setMaximum(100)
+        self.dot_slider.setValue(self.dot_radius * 2)
+        self.dot_value = QtWidgets.QLabel(str(self.dot_radius * 2))
+        self.dot_slider.valueChanged.connect(self.update_dot_size)
+        dotsize_layout.addWidget(dotsize_label)
+        dotsize_layout.addWidget(self.dot_slider)
+        dotsize_layout.addWidget(self.dot_value)
+        layout.addLayout(dotsize_layout)
+
+        # カラー選択ヘルパー関数（パネル内に埋め込む非モーダルの編集欄）
+        self.color_swatches = {}
+        def make_color_button(label_text, target):
+            column = QtWidgets.QVBoxLayout()
+            layout_ = QtWidgets.QHBoxLayout()
+            button = QtWidgets.QPushButton(label_text)
+            button.setCheckable(True)
+            square = QtWidgets.QLabel()
+            square.setFixedSize(20, 20)
+            edit = QtWidgets.QLineEdit()
+            edit.setPlaceholderText("#RRGGBB[AA] / rgba() / hsv()")
+            editor = QtWidgets.QColorDialog(QtGui.QColor(getattr(self, COLOR_TARGETS[target][0])))
+            editor.setWindowFlags(QtCore.Qt.Widget)
+            editor.setOptions(QtWidgets.QColorDialog.NoButtons | QtWidgets.QColorDialog.DontUseNativeDialog)
+            editor.hide()
+            self.color_swatches[target] = (square, edit)
+
+            def preview(color):
+                self.apply_color(target, color.name())
+                self.schedule_save()
+
+            def apply_text():
+                try:
+                    color, alpha = parse_color(edit.text())
+                except ValueError:
+                    edit.setStyleSheet("border: 1px solid red;")
+                    return
+                edit.setStyleSheet("")
+                self.apply_color(target, color, alpha)
+                editor.blockSignals(True)
+                editor.setCurrentColor(QtGui.QColor(color))
+                editor.blockSignals(False)
+                self.schedule_save()
+
+            button.toggled.connect(editor.setVisible)
+            editor.currentColorChanged.connect(preview)
+            edit.editingFinished.connect(apply_text)
+            layout_.addWidget(button)
+            layout_.addWidget(square)
+            layout_.addWidget(edit)
+            column.addLayout(layout_)
+            column.addWidget(editor)
+            return column
+
+        layout.addLayout(make_color_button("クロスヘア色", "crosshair"))
+        layout.addLayout(make_color_button("ドット外枠色", "dot_outer"))
+        layout.addLayout(make_color_button("ドット内側色", "dot_inner"))
+
+        # クロスヘア透明度スライダー
+        alpha_layout = QtWidgets.QHBoxLayout()
+        alpha_label = QtWidgets.QLabel("クロスヘア透明度")
+        self.alpha_slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.alpha_slider.setMinimum(0)
+        self.alpha_slider.setMaximum(100)
+        self.alpha_slider.setValue(int(self.crosshair_alpha * 100))
+        self.alpha_value = QtWidgets.QLabel(str(self.crosshair_alpha))
+        self.alpha_slider.valueChanged.connect(self.update_alpha)
+        alpha_layout.addWidget(alpha_label)
+        alpha_layout.addWidget(self.alpha_slider)
+        alpha_layout.addWidget(self.alpha_value)
+        layout.addLayout(alpha_layout)
+
+        # ドット透明度スライダー
+        dot_alpha_layout = QtWidgets.QHBoxLayout()
+        dot_alpha_label = QtWidgets.QLabel("ドット透明度")
+        self.dot_alpha_slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.dot_alpha_slider.setMinimum(0)
+        self.dot_alpha_slider.setMaximum(100)
+        self.dot_alpha_slider.setValue(int(self.dot_alpha * 100))
+        self.dot_alpha_value = QtWidgets.QLabel(str(self.dot_alpha))
+        self.dot_alpha_slider.valueChanged.connect(self.update_dot_alpha)
+        dot_alpha_layout.addWidget(dot_alpha_label)
+        dot_alpha_layout.addWidget(self.dot_alpha_slider)
+        dot_alpha_layout.addWidget(self.dot_alpha_value)
+        layout.addLayout(dot_alpha_layout)
+
+        # キー無効化
+        disable_layout = QtWidgets.QHBoxLayout()
+        disable_btn = QtWidgets.QPushButton("キーを無効化")
+        self.disabled_keys_label = QtWidgets.QLabel(", ".join(self.disabled_keys) if self.disabled_keys else "なし")
+        disable_btn.clicked.connect(self.disable_key_gui)
+        disable_layout.addWidget(disable_btn)
+        disable_layout.addWidget(self.disabled_keys_label)
+        layout.addLayout(disable_layout)
+
+        # キー有効化
+        enable_btn = QtWidgets.QPushButton("キーを有効化")
+        enable_btn.clicked.connect(self.enable_key_gui)
+        layout.addWidget(enable_btn)
+
+        # すべて有効化
+        enable_all_btn = QtWidgets.QPushButton("すべてのキーを有効化")
+        enable_all_btn.clicked.connect(self.enable_all_keys_gui)
+        layout.addWidget(enable_all_btn)
+
+        # プリセット
+        preset_label = QtWidgets.QLabel("プリセット")
+        self.preset_search = QtWidgets.QLineEdit()
+        self.preset_search.setPlaceholderText("名前・タグで検索（共有コードの貼り付けも可）")
+        self.preset_search.setMaxLength(1 << 24)  # 数千件のコードをまとめて貼り付けられるように
+        self.preset_list = QtWidgets.QListWidget()
+        self.preset_list.setIconSize(QtCore.QSize(PRESET_THUMB_SIZE, PRESET_THUMB_SIZE))
+        self.preset_list.setMinimumHeight(160)
+        self.preset_search.textChanged.connect(self.fill_preset_list)
+        self.preset_list.itemActivated.connect(self.activate_preset_item)
+        layout.addWidget(preset_label)
+        layout.addWidget(self.preset_search)
+        layout.addWidget(self.preset_list)
+
+        # 共有コード
+        share_layout = QtWidgets.QHBoxLayout()
+        self.share_code_edit = QtWidgets.QLineEdit()
+        self.share_code_edit.setPlaceholderText("共有コード")
+        self.share_code_edit.returnPressed.connect(self.apply_share_code_field)
+        share_copy_btn = QtWidgets.QPushButton("コピー")
+        share_copy_btn.clicked.connect(self.copy_share_code)
+        share_layout.addWidget(self.share_code_edit)
+        share_layout.addWidget(share_copy_btn)
+        layout.addLayout(share_layout)
+        self.fill_preset_list("")
+        self.presets.render_missing(lambda filename, path: self.preset_notifier.ready.emit(filename, path))
+
+        # CUIモードへ切り替え
+        cui_btn = QtWidgets.QPushButton("CUIモードに切り替え")
+        cui_btn.clicked.connect(self.switch_to_cui)
+        layout.addWidget(cui_btn)
+
+        self.panel.setLayout(layout)
+        self.sync_panel()
+        self.panel.setGeometry(100, 100, 300, 100)
+        self.panel.show()
+
+    def fill_preset_list(self, query):
+        # 索引だけで一覧を作る。サムネイルはキャッシュ済みのものだけ表示し、残りは描き終わり次第差し込む
+        self.preset_list.clear()
+        self.preset_items = {}
+        codes = find_share_codes(query) if SHARE_CODE_PREFIX in query.upper() else []
+        if codes:
+            # 共有コードが貼り付けられたら、その一覧を表示する（描画はせず色だけ示す）
+            self.preset_list.setUpdatesEnabled(False)
+            for code, settings in codes:
+                item = QtWidgets.QListWidgetItem(code)
+                item.setData(QtCore.Qt.UserRole + 1, settings)
+                item.setToolTip(f"{settings['crosshair_color']} / ドット {settings['dot_radius'] * 2}px")
+                item.setForeground(QtGui.QColor(settings["crosshair_color"]))
+                self.preset_list.addItem(item)
+            self.preset_list.setUpdatesEnabled(True)
+            return
+        for filename, entry in self.presets.search(query):
+            item = QtWidgets.QListWidgetItem(entry["name"])
+            item.setData(QtCore.Qt.UserRole, entry["name"])
+            item.setToolTip(", ".join(entry["tags"]))
+            path = self.presets.thumbnail_path(entry)
+            if os.path.exists(path):
+                item.setIcon(QtGui.QIcon(path))
+            self.preset_list.addItem(item)
+            self.preset_items[filename] = item
+
+    def on_thumbnail_ready(self, filename, path):
+        item = getattr(self, "preset_items", {}).get(filename)
+        if item is not None:
+            item.setIcon(QtGui.QIcon(path))
+
+    def load_preset(self, name):
+        self.apply_config(self.presets.load(name))
+
+    def import_share_code(self, code):
+        self.apply_config(decode_share_code(code))
+
+    def export_share_code(self):
+        return encode_share_code(self.get_config())
+
+    def activate_preset_item(self, item):
+        settings = item.data(QtCore.Qt.UserRole + 1)
+        if settings is not None:
+            self.apply_config(settings)
+        else:
+            self.load_preset(item.data(QtCore.Qt.UserRole))
+        self.commit_change("panel", "preset")
+
+    def apply_share_code_field(self):
+        try:
+            self.import_share_code(self.share_code_edit.text())
+        except ValueError as e:
+            QtWidgets.QMessageBox.warning(None, "共有コード", str(e))
+            return
+        self.commit_change("panel", "share_code")
+
+    def copy_share_code(self):
+        code = self.export_share_code()
+        self.share_code_edit.setText(code)
+        QtWidgets.QApplication.clipboard().setText(code)
+
+    def save_preset(self, name, tags=()):
+        if not self.presets_enabled:
+            raise RuntimeError("埋め込み時にプリセットを保存するには PresetLibrary を渡してください。")
+        self.presets.save(name, self.get_config(), tags)
+        print(f"プリセット {name} を保存しました。")
+
+    def toggle_crosshair_button(self):
+        self.toggle_crosshair()
+        self.crosshair_state.setText("ON" if self.crosshair_visible else "OFF")
+        self.commit_change("panel", "crosshair_visible")
+
+    def toggle_dot_button(self):
+        self.toggle_dot()
+        self.dot_state.setText("ON" if self.dot_visible else "OFF")
+        self.commit_change("panel", "dot_visible")
+
+    def update_dot_size(self, val):
+        self.set_dot_size(val)
+        self.dot_value.setText(str(val))
+        self.commit_change("panel", "dot_size")
+        
+    def update_alpha(self, val):
+        alpha = round(val / 100, 2)
+        self.crosshair_alpha = alpha
+        self.alpha_value.setText(str(alpha))
+        self.commit_change("panel", "crosshair_alpha")
+
+    def update_dot_alpha(self, val):
+        alpha = round(val / 100, 2)
+        self.dot_alpha = alpha
+        self.dot_alpha_value.setText(str(alpha))
+        self.commit_change("panel", "dot_alpha")
+
+    def set_crosshair_color(self, val):
+        self.crosshair_color = val
+
+    def set_dot_outer_color(self, val):
+        self.dot_outer_color = val
+
+    def set_dot_inner_color(self, val):
+        self.dot_inner_color = val
+
+    def disable_key_gui(self):
+        def on_key_selected(key):
+            self.disable_key(key)
+            self.disabled_keys_label.setText(", ".join(self.disabled_keys))
+            self.commit_change("panel", "disable_key")
+
+        dlg = self.KeyCaptureDialog(
+            self,
+            message="無効化したいキーを押してください（Enterキーは無効化できません）",
+            key_callback=on_key_selected
+        )
+        dlg.exec_()
+
+    def capture_disable_key(self, msgbox):
+        if self._disable_cancelled:
+            return  # キャンセルされたら何もしない
+
+        key = self.keys.read_key()
+        msgbox.close()
+
+        if key == "enter":
+            QtWidgets.QMessageBox.information(None, "無効化失敗", "Enterキーは無効化できません。")
+            return
+
+        self.disable_key(key)
+        self.disabled_keys_label.setText(", ".join(self.disabled_keys))
+        self.commit_change("panel", "disable_key")
+
+    def enable_key_gui(self):
+        def on_key_selected(key):
+            for k in self.disabled_keys:
+                try:
+                    self.keys.unblock_key(k)
+                except:
+                    pass
+
+            for k in self.disabled_keys:
+                if k != key:
+                    try:
+                        self.keys.block_key(k)
+                    except:
+                        pass
+
+            self.enable_key(key)
+
+            if key in self.disabled_keys:
+                self.disabled_keys.remove(key)
+
+            self.disabled_keys_label.setText(", ".join(self.disabled_keys) if self.disabled_keys else "なし")
+            self.commit_change("panel", "enable_key")
+
+        for k in self.disabled_keys:
+            try:
+               self.keys.unblock_key(k)
+            except:
+              pass
+
+        dlg = self.KeyCaptureDialog(
+            self,
+            message="有効化したいキーを押してください（現在無効化中のキー: " + ", ".join(self.disabled_keys) + "）",
+            key_callback=on_key_selected
+        )
+        dlg.exec_()
+
+    def capture_enable_key(self, msgbox):
+        if self._enable_cancelled:
+            return  # キャンセルされたら何もしない
+
+        # 一時的に無効化キーを解除してキーを取得
+        for k in self.disabled_keys:
+            try:
+                self.keys.unblock_key(k)
+            except KeyError:
+                pass
+
+        key = self.keys.read_key()
+
+        # 再度無効化（除外キー以外）
+        for k in self.disabled_keys:
+            if k != key:
+                try:
+                    self.keys.block_key(k)
+                except Exception:
+                    pass
+
+        msgbox.close()
+
+        self.enable_key(key)
+        self.disabled_keys_label.setText(", ".join(self.disabled_keys) if self.disabled_keys else "なし")
+        self.commit_change("panel", "enable_key")
+
+    def enable_all_keys_gui(self):
+        self.enable_all_keys()
+        self.disabled_keys_label.setText("なし")
+        self.commit_change("panel", "enable_all_keys")
+
+    def switch_to_cui(self):
+        config = load_config()
+        config["launch_mode"] = "cui"
+        save_config(config)
+        QtWidgets.QMessageBox.information(None, "切り替え", "CUIモードに切り替えます。再起動します。")
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+
+def draw_reticle(painter, settings, center_x, center_y, size=20, gap=10):
+    # クロスヘア
+    if settings["crosshair_visible"]:
+        color = QtGui.QColor(settings["crosshair_color"])
+        color.setAlphaF(settings["crosshair_alpha"])
+        pen = QtGui.QPen(color, 2)
+        painter.setPen(pen)
+        painter.drawLine(center_x - size, center_y,
+                         center_x - gap, center_y)
+        painter.drawLine(center_x + gap, center_y,
+                         center_x + size, center_y)
+        painter.drawLine(center_x, center_y - size,
+                         center_x, center_y - gap)
+        painter.drawLine(center_x, center_y + gap,
+                         center_x, center_y + size)
+
+    # ドット
+    dot_radius = settings["dot_radius"]
+    if settings["dot_visible"] and dot_radius > 0:
+        outer_color = QtGui.QColor(settings["dot_outer_color"])
+        outer_color.setAlphaF(settings["dot_alpha"])
+        painter.setBrush(QtGui.QBrush(outer_color))
+        painter.setPen(QtGui.QPen(outer_color))
+        painter.drawEllipse(QtCore.QRect(
+            center_x - dot_radius,
+            center_y - dot_radius,
+            dot_radius * 2,
+            dot_radius * 2
+        ))
+        if dot_radius > 1:
+            inner_r = dot_radius - 1
+            inner_color = QtGui.QColor(settings["dot_inner_color"])
+            inner_color.setAlphaF(settings["dot_alpha"])
+            painter.setBrush(QtGui.QBrush(inner_color))
+            painter.setPen(QtGui.QPen(inner_color))
+            painter.drawEllipse(QtCore.QRect(
+                center_x - inner_r,
+                center_y - inner_r,
+                inner_r * 2,
+                inner_r * 2
+            ))
+
+
+def draw_rotated(painter, center_x, center_y, angle, draw):
+    # angle が 0 以外なら中心まわりに回してから draw(x, y) を呼ぶ
+    if not angle:
+        draw(center_x, center_y)
+        return
+    painter.save()
+    painter.translate(center_x, center_y)
+    painter.rotate(angle)
+    draw(0, 0)
+    painter.restore()
+
+
+def render_reticle_image(settings, width, height, dpr=1.0, size=20, gap=10):
+    # 透明背景の QImage に描画する（width/height は論理ピクセル）
+    config = dict(DEFAULT_CONFIG, **(settings or {}))
+    image = QtGui.QImage(int(width * dpr), int(height * dpr), QtGui.QImage.Format_ARGB32_Premultiplied)
+    image.setDevicePixelRatio(dpr)
+    image.fill(QtCore.Qt.transparent)
+    painter = QtGui.QPainter(image)
+    painter.setRenderHint(QtGui.QPainter.Antialiasing)
+    draw_reticle(painter, config, width // 2, height // 2, size, gap)
+    painter.end()
+    return image
+
+
+def save_reticle_png(settings, path, width=64, height=64, dpr=1.0):
+    return render_reticle_image(settings, width, height, dpr).save(path, "PNG")
+
+
+def image_to_array(image):
+    # QImage → (高さ, 幅, 4) の uint8 配列（BGRA 順）
+    image = image.convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)
+    ptr = image.constBits()
+    ptr.setsize(image.sizeInBytes())
+    rows = np.frombuffer(ptr, dtype=np.uint8).reshape(image.height(), image.bytesPerLine())
+    return rows[:, :image.width() * 4].reshape(image.height(), image.width(), 4).copy()
+
+
+def compare_images(actual, expected, tolerance=GOLDEN_TOLERANCE, max_bad_pixels=0):
+    # 全画素の差分をまとめて計算し、チャンネル差の最大値が tolerance を超えた画素数で判定
+    if actual.shape != expected.shape:
+        return False, -1, 255
+    diff = np.abs(actual.astype(np.int16) - expected.astype(np.int16)).max(axis=2)
+    bad_pixels = int(np.count_nonzero(diff > tolerance))
+    return bad_pixels <= max_bad_pixels, bad_pixels, int(diff.max())
+
+
+def golden_matrix():
+    # 表示ON/OFF・サイズ・色・透明度・DPR の組み合わせ
+    colors = ["#00FF66", "#FF0000", "#FFFFFF"]
+    for crosshair_visible, dot_visible, dot_radius, color, alpha, dpr in itertools.product(
+            [True, False], [True, False], [0, 1, 2, 5, 12], colors, [1.0, 0.5], [1.0, 1.5, 2.0]):
+        if not crosshair_visible and not dot_visible:
+            continue
+        settings = {
+            "crosshair_visible": crosshair_visible,
+            "dot_visible": dot_visible,
+            "dot_radius": dot_radius,
+            "crosshair_color": color,
+            "dot_outer_color": "#FFFFFF",
+            "dot_inner_color": color,
+            "crosshair_alpha": alpha,
+            "dot_alpha": alpha,
+        }
+        name = "c{:d}_d{:d}_r{}_{}_a{}_x{}".format(
+            crosshair_visible, dot_visible, dot_radius, color.lstrip("#"), alpha, dpr)
+        yield name, settings, dpr
+
+
+def run_golden(path, update=False):
+    # 基準画像は1つの .npz にまとめて保存・比較する
+    if np is None:
+        print("ゴールデン画像テストには NumPy が必要です。")
+        return 1
+    started = time.perf_counter()
+    rendered = {name: image_to_array(render_reticle_image(settings, GOLDEN_SIZE, GOLDEN_SIZE, dpr))
+                for name, settings, dpr in golden_matrix()}
+    if update:
+        np.savez_compressed(path, **rendered)
+        print(f"{len(rendered)} 件の基準画像を {path} に保存しました。")
+        return 0
+    if not os.path.exists(path):
+        print(f"基準画像 {path} がありません。--golden-update で作成してください。")
+        return 1
+    failures = 0
+    with np.load(path) as golden:
+        for name, actual in rendered.items():
+            if name not in golden:
+                print(f"[NG] {name}: 基準画像がありません")
+                failures += 1
+                continue
+            ok, bad_pixels, max_diff = compare_images(actual, golden[name])
+            if not ok:
+                print(f"[NG] {name}: 不一致 {bad_pixels} 画素 (最大差 {max_diff})")
+                failures += 1
+    elapsed = time.perf_counter() - started
+    print(f"{len(rendered)} 件中 {failures} 件不一致 ({elapsed:.2f} 秒)")
+    return 1 if failures else 0
+
+
+class ScreenFrameSource:
+    # 画面の一部だけを取り込む（全画面はキャプチャしない）
+    def grab(self, x, y, width, height, out):
+        screen = QtWidgets.QApplication.primaryScreen()
+        image = screen.grabWindow(0, x, y, width, height).toImage()
+        image = image.convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)
+        if image.width() != width or image.height() != height:
+            return None
+        ptr = image.constBits()
+        ptr.setsize(image.sizeInBytes())
+        rows = np.frombuffer(ptr, dtype=np.uint8).reshape(height, image.bytesPerLine())
+        np.copyto(out, rows[:, :width * 4].reshape(height, width, 4))
+        return out
+
+
+class FakeFrameSource:
+    # テスト用: 決められたフレーム（BGRA の配列）を順番に返す
+    def __init__(self, frames):
+        self.frames = list(frames)
+        self.index = 0
+        self.requests = []
+
+    def grab(self, x, y, width, height, out):
+        self.requests.append((x, y, width, height))
+        if not self.frames:
+            return None
+        frame = self.frames[min(self.index, len(self.frames) - 1)]
+        self.index += 1
+        np.copyto(out, frame)
+        return out
+
+
+def _linearize(value):
+    return np.where(value <= 0.03928, value / 12.92, ((value + 0.055) / 1.055) ** 2.4)
+
+
+def color_luminance(color):
+    c = QtGui.QColor(color)
+    r, g, b = _linearize(np.array([c.redF(), c.greenF(), c.blueF()]))
+    return 0.2126 * r + 0.7152 * g + 0.0722 * b
+
+
+def contrast_ratio(lum_a, lum_b):
+    hi, lo = max(lum_a, lum_b), min(lum_a, lum_b)
+    return (hi + 0.05) / (lo + 0.05)
+
+
+class AdaptiveContrast:
+    # 背景の輝度から、元の色で見えにくいときだけ高コントラスト色へ切り替える（ヒステリシス付き）
+    def __init__(self, width=ADAPTIVE_ROI, height=ADAPTIVE_ROI, min_contrast=3.0, hysteresis=0.5,
+                 light_color="#FFFFFF", dark_color="#000000"):
+        self.min_contrast = min_contrast
+        self.hysteresis = hysteresis
+        self.light_color = light_color
+        self.dark_color = dark_color
+        self.frame = np.zeros((height, width, 4), dtype=np.uint8)
+        self.work = np.zeros((height, width, 3), dtype=np.float32)
+        self.means = np.zeros(3, dtype=np.float32)
+        self.color = None
+        self.background_luminance = None
+
+    def measure(self, frame):
+        # BGRA → チャンネル平均 → 相対輝度（作業用バッファは使い回す）
+        np.copyto(self.work, frame[..., :3], casting="unsafe")
+        self.work.mean(axis=(0, 1), out=self.means)
+        b, g, r = _linearize(self.means / 255.0)
+        self.background_luminance = float(0.2126 * r + 0.7152 * g + 0.0722 * b)
+        return self.background_luminance
+
+    def update(self, frame, base_color):
+        bg = self.measure(frame)
+        base_contrast = contrast_ratio(color_luminance(base_color), bg)
+        light_contrast = contrast_ratio(1.0, bg)
+        dark_contrast = contrast_ratio(0.0, bg)
+        best = self.light_color if light_contrast >= dark_contrast else self.dark_color
+        if self.color is None:
+            if base_contrast < self.min_contrast:
+                self.color = best
+        elif base_contrast >= self.min_contrast + self.hysteresis:
+            self.color = None
+        else:
+            current = light_contrast if self.color == self.light_color else dark_contrast
+            if max(light_contrast, dark_contrast) > current * (1.0 + self.hysteresis):
+                self.color = best
+        return self.color
+
+
+class AdaptiveColorController(QtCore.QObject):
+    def __init__(self, overlay, source=None, roi=ADAPTIVE_ROI):
+        super().__init__(overlay)
+        self.overlay = overlay
+        self.source = source if source is not None else ScreenFrameSource()
+        self.roi = roi
+        self.contrast = AdaptiveContrast(roi, roi)
+        self.rate = 10
+        self.cpu_budget = 0.02
+        self.interval = 100
+        self.cost = 0.0  # 1回あたりの処理時間（指数移動平均, 秒）
+        self.samples = 0
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.sample)
+
+    @property
+    def color(self):
+        return self.contrast.color if self.timer.isActive() else None
+
+    def configure(self, rate, cpu_budget):
+        self.rate = max(0.5, min(float(rate), 60.0))
+        self.cpu_budget = max(0.001, min(float(cpu_budget), 0.5))
+        self.interval = int(1000 / self.rate)
+        if self.timer.isActive():
+            self.timer.start(self.interval)
+
+    def start(self):
+        if np is None:
+            print("アダプティブカラーには NumPy が必要です。")
+            return
+        self.timer.start(self.interval)
+
+    def stop(self):
+        self.timer.stop()
+        self.contrast.color = None
+
+    def sample(self):
+        started = time.perf_counter()
+        half = self.roi // 2
+        frame = self.source.grab(self.overlay.center_x - half, self.overlay.center_y - half,
+                                 self.roi, self.roi, self.contrast.frame)
+        if frame is not None:
+            before = self.contrast.color
+            if self.contrast.update(frame, self.overlay.crosshair_color) != before:
+                self.overlay.update()
+        self.samples += 1
+        elapsed = time.perf_counter() - started
+        self.cost = elapsed if self.samples == 1 else self.cost * 0.9 + elapsed * 0.1
+        # CPU予算を超えたらサンプリング間隔を広げる
+        budget_interval = int(self.cost / self.cpu_budget * 1000)
+        if budget_interval > self.interval:
+            self.interval = budget_interval
+            self.timer.start(self.interval)
+
+
+ScopeStats = collections.namedtuple("ScopeStats", ["frames", "over_budget", "avg_ms", "max_ms", "budget_ms"])
+
+
+class ScopeController(QtCore.QObject):
+    # 中心付近だけを一定間隔で取り込み、拡大してスコープ枠に表示する
+    def __init__(self, overlay, source=None, roi=SCOPE_ROI):
+        super().__init__(overlay)
+        self.overlay = overlay
+        self.source = source if source is not None else ScreenFrameSource()
+        self.roi = roi
+        self.zoom = 0
+        self.fps = 30
+        self.frame_times = collections.deque(maxlen=120)
+        self.frames = 0
+        self.over_budget = 0
+        self.stats = ScopeStats(0, 0, 0.0, 0.0, 0.0)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+        self.image = None
+
+    @property
+    def active(self):
+        return self.timer.isActive() and self.image is not None
+
+    def configure(self, zoom, fps):
+        zoom = max(2, min(int(zoom), 8))
+        self.fps = max(1, min(int(fps), 120))
+        if zoom != self.zoom:
+            # バッファはサイズが変わるときだけ確保し直す
+            self.zoom = zoom
+            size = self.roi * zoom
+            self.capture = np.zeros((self.roi, self.roi, 4), dtype=np.uint8)
+            self.rows = np.zeros((size, self.roi, 4), dtype=np.uint8)
+            self.scaled = np.zeros((size, size, 4), dtype=np.uint8)
+            self.index = np.arange(size) // zoom
+            # scaled のメモリをそのまま参照する QImage（コピーしない）
+            self.image = QtGui.QImage(self.scaled.data, size, size, size * 4,
+                                      QtGui.QImage.Format_ARGB32_Premultiplied)
+        if self.timer.isActive():
+            self.timer.start(1000 // self.fps)
+
+    def inset_rect(self):
+        size = self.roi * self.zoom
+        return QtCore.QRect(self.overlay.center_x + SCOPE_OFFSET, self.overlay.center_y + SCOPE_OFFSET, size, size)
+
+    def start(self):
+        if np is None:
+            print("スコープ表示には NumPy が必要です。")
+            return
+        self.timer.start(1000 // self.fps)
+
+    def stop(self):
+        self.timer.stop()
+        self.overlay.update(self.inset_rect().adjusted(-1, -1, 1, 1))
+
+    def tick(self):
+        started = time.perf_counter()
+        half = self.roi // 2
+        frame = self.source.grab(self.overlay.center_x - half, self.overlay.center_y - half,
+                                 self.roi, self.roi, self.capture)
+        if frame is None:
+            return
+        # 最近傍補間: 行→列の順に、確保済みのバッファへ間引きコピー
+        np.take(self.capture, self.index, axis=0, out=self.rows)
+        np.take(self.rows, self.index, axis=1, out=self.scaled)
+        self.overlay.update(self.inset_rect())
+        self.record(time.perf_counter() - started)
+
+    def record(self, elapsed):
+        budget = 1.0 / self.fps
+        self.frames += 1
+        if elapsed > budget:
+            self.over_budget += 1
+        self.frame_times.append(elapsed)
+        self.stats = ScopeStats(
+            self.frames,
+            self.over_budget,
+            round(sum(self.frame_times) / len(self.frame_times) * 1000, 3),
+            round(max(self.frame_times) * 1000, 3),
+            round(budget * 1000, 3),
+        )
+
+    def paint(self, painter):
+        rect = self.inset_rect()
+        painter.drawImage(rect.topLeft(), self.image)
+        painter.setBrush(QtCore.Qt.NoBrush)
+        painter.setPen(QtGui.QPen(QtGui.QColor(self.overlay.crosshair_color), 1))
+        painter.drawRect(rect.adjusted(0, 0, -1, -1))
+
+
+RETICLE_KEYS = (
+    "crosshair_visible",
+    "dot_visible",
+    "dot_radius",
+    "crosshair_color",
+    "dot_outer_color",
+    "dot_inner_color",
+    "crosshair_alpha",
+    "dot_alpha",
+)
+
+
+class QPainterRenderer:
+    # 従来どおり QPainter でベクター描画する
+    name = "qpainter"
+
+    def attach(self, overlay):
+        pass
+
+    def detach(self):
+        pass
+
+    def paint(self, painter, settings, center_x, center_y, size=20, gap=10, angle=0.0):
+        draw_rotated(painter, center_x, center_y, angle,
+                     lambda x, y: draw_reticle(painter, settings, x, y, size, gap))
+
+    def memory_bytes(self):
+        return 0
+
+
+class NumpyRenderer:
+    # NumPy で乗算済み ARGB のスプライトを作り、コピーなしで QImage として貼り付ける
+    name = "numpy"
+
+    def __init__(self):
+        self.key = None
+        self.sprite = None
+        self.image = None
+        self.extent = 0
+
+    def attach(self, overlay):
+        pass
+
+    def detach(self):
+        self.key = None
+        self.sprite = None
+        self.image = None
+
+    def paint(self, painter, settings, center_x, center_y, size=20, gap=10, angle=0.0):
+        key = tuple(settings[k] for k in RETICLE_KEYS) + (size, gap)
+        if key != self.key:
+            self.rasterize(settings, size, gap)
+            self.key = key
+        draw_rotated(painter, center_x, center_y, angle,
+                     lambda x, y: painter.drawImage(x - self.extent, y - self.extent, self.image))
+
+    def rasterize(self, settings, size, gap):
+        dot_radius = settings["dot_radius"] if settings["dot_visible"] else 0
+        extent = max(size, dot_radius) + 2
+        dim = extent * 2
+        if self.sprite is None or self.extent != extent:
+            self.extent = extent
+            self.sprite = np.zeros((dim, dim, 4), dtype=np.uint8)
+            self.image = QtGui.QImage(self.sprite.data, dim, dim, dim * 4,
+                                      QtGui.QImage.Format_ARGB32_Premultiplied)
+            centers = np.arange(dim, dtype=np.float32) - extent + 0.5
+            self.distance = np.hypot(centers[:, None], centers[None, :])
+        # 乗算済み RGBA を float で合成してから BGRA の uint8 に書き戻す
+        canvas = np.zeros((dim, dim, 4), dtype=np.float32)
+        if settings["crosshair_visible"]:
+            coverage = np.zeros((dim, dim), dtype=np.float32)
+            near, far = extent - size - 1, extent - gap + 1
+            coverage[extent - 1:extent + 1, near:far] = 1.0
+            coverage[extent - 1:extent + 1, dim - far:dim - near] = 1.0
+            coverage[near:far, extent - 1:extent + 1] = 1.0
+            coverage[dim - far:dim - near, extent - 1:extent + 1] = 1.0
+            self.composite(canvas, coverage, settings["crosshair_color"], settings["crosshair_alpha"])
+        if settings["dot_visible"] and dot_radius > 0:
+            # QPainter の drawEllipse（ペン幅1）の外周にほぼ合わせた半径
+            coverage = np.clip(dot_radius + 0.9 - self.distance, 0.0, 1.0)
+            self.composite(canvas, coverage, settings["dot_outer_color"], settings["dot_alpha"])
+            if dot_radius > 1:
+                coverage = np.clip(dot_radius - 0.1 - self.distance, 0.0, 1.0)
+                self.composite(canvas, coverage, settings["dot_inner_color"], settings["dot_alpha"])
+        np.rint(canvas[..., [2, 1, 0, 3]] * 255.0, out=canvas)
+        np.copyto(self.sprite, canvas, casting="unsafe")
+
+    @staticmethod
+    def composite(canvas, coverage, color, alpha):
+        c = QtGui.QColor(color)
+        a = coverage * alpha
+        source = np.array([c.redF(), c.greenF(), c.blueF(), 1.0], dtype=np.float32)
+        canvas *= (1.0 - a)[..., None]
+        canvas += a[..., None] * source
+
+    def memory_bytes(self):
+        if self.sprite is None:
+            return 0
+        return self.sprite.nbytes + self.distance.nbytes
+
+
+class GLReticleWidget(QtWidgets.QOpenGLWidget):
+    # オーバーレイ全体を覆う透明な OpenGL 面。描画は QPainter の OpenGL エンジンで行う
+    def __init__(self, parent):
+        super().__init__(parent)
+        surface = QtGui.QSurfaceFormat()
+        surface.setAlphaBufferSize(8)
+        self.setFormat(surface)
+        self.setAttribute(QtCore.Qt.WA_AlwaysStackOnTop)
+        self.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)
+        self.args = None
+
+    def paintGL(self):
+        painter = QtGui.QPainter(self)
+        painter.setCompositionMode(QtGui.QPainter.CompositionMode_Source)
+        painter.fillRect(self.rect(), QtCore.Qt.transparent)
+        painter.setCompositionMode(QtGui.QPainter.CompositionMode_SourceOver)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        if self.args is not None:
+            settings, center_x, center_y, size, gap, angle = self.args
+            draw_rotated(painter, center_x, center_y, angle,
+                         lambda x, y: draw_reticle(painter, settings, x, y, size, gap))
+        painter.end()
+
+
+class OpenGLRenderer:
+    # QOpenGLWidget で描画する（opengl-software ではソフトウェア Mesa を使う）
+    name = "opengl"
+
+    def __init__(self):
+        self.widget = None
+
+    def attach(self, overlay):
+        if not QtGui.QOpenGLContext().create():
+            raise RuntimeError("OpenGL コンテキストを作成できません")
+        self.widget = GLReticleWidget(overlay)
+        self.widget.setGeometry(overlay.rect())
+        self.widget.show()
+
+    def detach(self):
+        if self.widget is not None:
+            self.widget.deleteLater()
+            self.widget = None
+
+    def paint(self, painter, settings, center_x, center_y, size=20, gap=10, angle=0.0):
+        args = (settings, center_x, center_y, size, gap, angle)
+        if self.widget is not None and args != self.widget.args:
+            self.widget.args = args
+            self.widget.update()
+
+    def memory_bytes(self):
+        if self.widget is None:
+            return 0
+        return self.widget.width() * self.widget.height() * 4
+
+
+RENDERERS = {
+    "qpainter": QPainterRenderer,
+    "numpy": NumpyRenderer,
+    "opengl": OpenGLRenderer,
+    "opengl-software": OpenGLRenderer,
+}
+
+
+def create_renderer(name):
+    if name not in RENDERERS:
+        print(f"不明な描画バックエンド {name} のため qpainter を使います。")
+        name = "qpainter"
+    if name == "numpy" and np is None:
+        print("numpy バックエンドには NumPy が必要です。qpainter を使います。")
+        name = "qpainter"
+    return RENDERERS[name]()
+
+
+def benchmark_renderers(frames=2000, width=256, height=256):
+    # 各バックエンドの1フレームあたりの描画コストとメモリを比べる
+    base = dict(DEFAULT_CONFIG, dot_radius=6)
+    changed = dict(base, crosshair_alpha=0.5)
+    results = []
+    for name in RENDERERS:
+        try:
+            renderer = create_renderer(name)
+            if isinstance(renderer, OpenGLRenderer):
+                host = QtWidgets.QWidget()
+                host.resize(width, height)
+                renderer.attach(host)
+                target = renderer.widget
+            else:
+                target = QtGui.QImage(width, height, QtGui.QImage.Format_ARGB32_Premultiplied)
+            row = [name]
+            for label, variants in (("静止", [base]), ("変更", [base, changed])):
+                tracemalloc.start()
+                started = time.perf_counter()
+                for i in range(frames):
+                    settings = variants[i % len(variants)]
+                    if isinstance(renderer, OpenGLRenderer):
+                        renderer.paint(None, settings, width // 2, height // 2)
+                        target.grabFramebuffer()
+                    else:
+                        target.fill(QtCore.Qt.transparent)
+                        painter = QtGui.QPainter(target)
+                        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+                        renderer.paint(painter, settings, width // 2, height // 2)
+                        painter.end()
+                elapsed = time.perf_counter() - started
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                row.append((label, elapsed / frames * 1e6, peak))
+            row.append(renderer.memory_bytes())
+            renderer.detach()
+            results.append(row)
+        except Exception as e:
+            results.append([name, str(e)])
+    return results
+
+
+class Animation:
+    # duration が None のものは止めるまで続く
+    duration = None
+
+    def __init__(self):
+        self.elapsed = 0.0
+
+    @property
+    def finished(self):
+        return self.duration is not None and self.elapsed >= self.duration
+
+    def advance(self, dt):
+        self.elapsed += dt
+
+    def apply(self, effects):
+        pass
+
+
+class PulseAnimation(Animation):
+    period = 1.2
+
+    def apply(self, effects):
+        effects["alpha"] *= 0.55 + 0.45 * math.cos(2 * math.pi * self.elapsed / self.period)
+
+
+class RotationAnimation(Animation):
+    speed = 90.0  # 度/秒
+
+    def apply(self, effects):
+        effects["angle"] = (effects["angle"] + self.elapsed * self.speed) % 360
+
+
+class BloomAnimation(Animation):
+    duration = 0.3
+
+    def apply(self, effects):
+        remaining = max(0.0, 1.0 - self.elapsed / self.duration)
+        effects["scale"] *= 1.0 + 0.6 * remaining * remaining
+
+
+class BlinkAnimation(Animation):
+    duration = 0.6
+    count = 3
+
+    def apply(self, effects):
+        phase = int(self.elapsed / (self.duration / (self.count * 2)))
+        if phase % 2 == 0:
+            effects["visible"] = False
+
+
+ANIMATIONS = {
+    "pulse": PulseAnimation,
+    "rotate": RotationAnimation,
+}
+
+FrameStats = collections.namedtuple("FrameStats", ["frames", "fps", "avg_ms", "max_ms", "throttled"])
+
+
+class FrameScheduler(QtCore.QObject):
+    # すべてのアニメーションを1つのタイマーでまとめて進める。何も動いていなければタイマーは止める
+    def __init__(self, overlay, fps=60, cpu_cap=0.05):
+        super().__init__(overlay)
+        self.overlay = overlay
+        self.fps = fps
+        self.max_fps = fps
+        self.cpu_cap = cpu_cap
+        self.animations = []
+        self.last = None
+        self.dirty = None
+        self.frame_times = collections.deque(maxlen=120)
+        self.frames = 0
+        self.throttled = 0
+        self.tick_cost = 0.0
+        self.stats = FrameStats(0, fps, 0.0, 0.0, 0)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+
+    @property
+    def active(self):
+        return bool(self.animations)
+
+    def add(self, animation):
+        # 同じ種類のアニメーションは置き換える
+        self.animations = [a for a in self.animations if type(a) is not type(animation)]
+        self.animations.append(animation)
+        if not self.timer.isActive():
+            self.last = time.perf_counter()
+            self.timer.start(int(1000 / self.fps))
+
+    def remove(self, cls):
+        self.animations = [a for a in self.animations if not isinstance(a, cls)]
+
+    def effects(self):
+        effects = {"alpha": 1.0, "scale": 1.0, "angle": 0.0, "visible": True}
+        for animation in self.animations:
+            animation.apply(effects)
+        return effects
+
+    def tick(self):
+        started = time.perf_counter()
+        dt = started - self.last
+        self.last = started
+        for animation in self.animations:
+            animation.advance(dt)
+        self.animations = [a for a in self.animations if not a.finished]
+        rect = self.overlay.reticle_rect(self.effects()["scale"])
+        # 前フレームの範囲も含めて、クロスヘア周辺だけを再描画する
+        self.overlay.update(rect if self.dirty is None else rect.united(self.dirty))
+        self.dirty = rect
+        if not self.animations:
+            self.timer.stop()
+            self.dirty = None
+        self.tick_cost = time.perf_counter() - started
+
+    def record_paint(self, paint_cost):
+        # 1フレーム = tick + paintEvent。CPU上限を超えたらフレームレートを落とし、余裕が戻れば max_fps まで戻す
+        elapsed = self.tick_cost + paint_cost
+        self.frames += 1
+        self.frame_times.append(elapsed)
+        average = sum(self.frame_times) / len(self.frame_times)
+        peak = max(self.frame_times)
+        if average * self.fps > self.cpu_cap and self.fps > 10:
+            self.set_fps(max(10, int(self.fps * 0.75)))
+            self.throttled += 1
+        elif self.fps < self.max_fps and len(self.frame_times) >= 30:
+            faster = min(self.max_fps, int(self.fps / 0.75) + 1)
+            # 上げた後も上限の8割に収まるときだけ戻す。戻したら新しいレートで測り直す
+            if average * faster <= self.cpu_cap * 0.8:
+                self.set_fps(faster)
+                self.frame_times.clear()
+        self.stats = FrameStats(self.frames, self.fps, round(average * 1000, 3), round(peak * 1000, 3),
+                                self.throttled)
+
+    def set_fps(self, fps):
+        self.fps = fps
+        if self.timer.isActive():
+            self.timer.start(int(1000 / self.fps))
+
+
+class MotionSpread(QtCore.QObject):
+    # 高頻度のマウス移動をフックで溜め、別スレッドで速度にまとめて表示レートでGUIへ送る
+    spread_changed = QtCore.pyqtSignal(float)
+
+    def __init__(self, sensitivity=3000, settle=0.15, rate=SPREAD_RATE):
+        super().__init__()
+        self.sensitivity = sensitivity
+        self.settle = settle  # 速度の平滑化の時定数（秒）
+        self.rate = rate
+        self.samples = collections.deque(maxlen=4096)
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.hooked = None
+        self.last_pos = None
+        self.last_step = None
+        self.speed = 0.0
+        self.spread = 0.0
+        self.pushed = 0.0
+        self.received = 0
+
+    def on_mouse_event(self, event):
+        # フック側は追加と通知だけにとどめる
+        if isinstance(event, mouse.MoveEvent):
+            self.samples.append((event.time, event.x, event.y))
+            self.wakeup.set()
+
+    def feed(self, t, x, y):
+        self.samples.append((t, x, y))
+        self.wakeup.set()
+
+    def step(self, now):
+        dt = now - self.last_step if self.last_step is not None else 1.0 / self.rate
+        self.last_step = now
+        distance = 0.0
+        while self.samples:
+            t, x, y = self.samples.popleft()
+            self.received += 1
+            if self.last_pos is not None:
+                distance += math.hypot(x - self.last_pos[0], y - self.last_pos[1])
+            self.last_pos = (x, y)
+        instant = distance / max(dt, 1e-3)
+        self.speed += (1.0 - math.exp(-dt / self.settle)) * (instant - self.speed)
+        spread = min(1.0, self.speed / self.sensitivity)
+        self.spread = 0.0 if spread < 0.005 else spread
+        return self.spread
+
+    def push(self):
+        # 見た目が変わる程度に動いたときだけGUIスレッドへ送る
+        if abs(self.spread - self.pushed) >= 0.01 or (self.spread == 0.0 and self.pushed != 0.0):
+            self.pushed = self.spread
+            self.spread_changed.emit(self.spread)
+
+    def run(self):
+        interval = 1.0 / self.rate
+        while not self.stopped.is_set():
+            if self.spread == 0.0 and not self.samples:
+                # 静止中はマウスが動くまで眠る
+                self.wakeup.wait()
+                self.wakeup.clear()
+                self.last_step = time.perf_counter() - interval
+                continue
+            self.step(time.perf_counter())
+            self.push()
+            time.sleep(interval)
+
+    def start(self, hook=True):
+        if hook:
+            if mouse is None:
+                raise RuntimeError("拡散表示には mouse パッケージが必要です。")
+            self.hooked = mouse.hook(self.on_mouse_event)
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.hooked is not None:
+            mouse.unhook(self.hooked)
+            self.hooked = None
+        self.stopped.set()
+        self.wakeup.set()
+        self.samples.clear()
+        self.speed = self.spread = self.pushed = 0.0
+        self.last_pos = None
+
+
+class SharedReticlePublisher:
+    # 描画したクロスヘアを共有メモリへ公開する（読み取りは reticle_reader.py）
+    def __init__(self, name):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=reticle_reader.BUFFER_SIZE)
+        except FileExistsError:
+            # 前回異常終了したときの領域が残っていれば再利用する
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = name
+        # 書き込み可能なポインタとして QImage に渡す（memoryview だと QImage 側でコピーされる）
+        self.pixels = (ctypes.c_char * (reticle_reader.BUFFER_SIZE - reticle_reader.HEADER_SIZE)).from_buffer(
+            self.shm.buf, reticle_reader.HEADER_SIZE)
+        self.address = sip.voidptr(ctypes.addressof(self.pixels))
+        self.key = None
+        self.seq = 0
+        self.write_header(0, 0)
+
+    def write_header(self, width, height):
+        reticle_reader.HEADER.pack_into(self.shm.buf, 0, reticle_reader.MAGIC, reticle_reader.VERSION,
+                                        reticle_reader.FORMAT_ARGB32_PREMULTIPLIED,
+                                        width, height, width * 4, self.seq)
+
+    def publish(self, settings, size, gap, angle=0.0, visible=True):
+        # 見た目が変わったときだけ書き換える
+        key = tuple(settings[k] for k in RETICLE_KEYS) + (size, gap, angle, visible)
+        if key == self.key:
+            return False
+        self.key = key
+        extent = int(max(size, settings["dot_radius"]) * 1.5) + 4
+        side = min(extent * 2, reticle_reader.MAX_SIDE)
+        stride = side * 4
+        # 書き込み中は seq を奇数にして、読み取り側に読み直させる
+        self.seq += 1
+        reticle_reader.SEQ.pack_into(self.shm.buf, reticle_reader.SEQ_OFFSET, self.seq)
+        # 共有メモリ上に直接描く（中間バッファなし）
+        image = QtGui.QImage(self.address, side, side, stride, QtGui.QImage.Format_ARGB32_Premultiplied)
+        image.fill(QtCore.Qt.transparent)
+        if visible:
+            painter = QtGui.QPainter(image)
+            painter.setRenderHint(QtGui.QPainter.Antialiasing)
+            painter.translate(side // 2, side // 2)
+            if angle:
+                painter.rotate(angle)
+            draw_reticle(painter, settings, 0, 0, size, gap)
+            painter.end()
+        del image
+        self.seq += 1
+        self.write_header(side, side)
+        return True
+
+    def close(self):
+        self.address = None
+        self.pixels = None
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def check_shared_reticle(frames=20, timeout=5.0):
+    # 別プロセスの reticle_reader で公開中のフレームを読み、途中書きのものが混ざらないか確かめる。
+    # 問題の一覧を返す（空なら成功）
+    name = f"crosshair_check_{os.getpid()}"
+    publisher = SharedReticlePublisher(name)
+    settings = dict(DEFAULT_CONFIG)
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    reader = context.Process(target=reticle_reader.probe, args=(name, results, frames, timeout))
+    try:
+        publisher.publish(settings, 20, 10)
+        reader.start()
+        # 読み取り中も角度を変えて書き続ける
+        angle = 0
+        summaries = None
+        deadline = time.monotonic() + timeout * frames
+        while summaries is None and time.monotonic() < deadline:
+            angle = (angle + 7) % 360
+            publisher.publish(settings, 20, 10, angle)
+            try:
+                summaries = results.get(timeout=0.002)
+            except queue.Empty:
+                pass
+        reader.join(timeout)
+    finally:
+        if reader.is_alive():
+            reader.terminate()
+        publisher.close()
+    if not summaries:
+        return ["読み取りプロセスがフレームを受け取れませんでした"]
+    problems = []
+    for seq, width, height, stride, fmt, length, opaque in summaries:
+        if seq & 1:
+            problems.append(f"seq={seq}: 書き込み途中のフレームです")
+        if not 0 < width <= reticle_reader.MAX_SIDE or height != width:
+            problems.append(f"seq={seq}: 大きさ {width}x{height} が不正です")
+        if stride != width * 4 or length != stride * height:
+            problems.append(f"seq={seq}: stride {stride} / {length} バイトが大きさと合いません")
+        if fmt != reticle_reader.FORMAT_ARGB32_PREMULTIPLIED:
+            problems.append(f"seq={seq}: 形式 {fmt} が不正です")
+        if not opaque:
+            problems.append(f"seq={seq}: 不透明な画素がありません")
+    return problems
+
+
+StallRecord = collections.namedtuple("StallRecord", ["started", "duration_ms", "queue_depth", "stack"])
+
+
+class StallWatchdog(QtCore.QObject):
+    # GUIスレッドの心拍が途切れたら、その間のスタックとコマンド待ち数を記録する
+    def __init__(self, parent=None, threshold_ms=200, interval_ms=50, log_file=STALL_LOG_FILE):
+        super().__init__(parent)
+        self.threshold = threshold_ms / 1000.0
+        self.interval = interval_ms / 1000.0
+        self.gui_thread_id = threading.get_ident()
+        self.beat = time.monotonic()
+        self.sample = None
+        self.records = collections.deque(maxlen=100)
+        self.snapshot = ()
+        self.stopped = threading.Event()
+        self.logger = logging.getLogger("crosshair.stall")
+        self.logger.propagate = False
+        if log_file and not any(isinstance(h, logging.handlers.RotatingFileHandler) for h in self.logger.handlers):
+            try:
+                handler = logging.handlers.RotatingFileHandler(
+                    log_file, maxBytes=256 * 1024, backupCount=3, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+                self.logger.addHandler(handler)
+            except OSError as e:
+                print("停止ログを開けません:", e)
+        if not self.logger.handlers:
+            # ログファイルなしのとき、lastResort で埋め込み先の stderr に停止記録が出ないようにする
+            self.logger.addHandler(logging.NullHandler())
+        self.timer = QtCore.QTimer(self)
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.timeout.connect(self.heartbeat)
+        self.thread = None
+
+    def start(self):
+        self.beat = time.monotonic()
+        self.timer.start(int(self.interval * 1000))
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.watch, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.timer.stop()
+        self.stopped.set()
+
+    def heartbeat(self):
+        # GUIスレッド側: 前回からの間隔が閾値を超えていれば停止として確定する
+        now = time.monotonic()
+        gap = now - self.beat
+        self.beat = now
+        if gap - self.interval > self.threshold:
+            sample = self.sample or (0, "")
+            self.sample = None
+            self.record(StallRecord(time.time() - gap, round(gap * 1000, 1), sample[0], sample[1]))
+
+    def watch(self):
+        # 監視スレッド側: 止まっている最中に1回だけ GUIスレッドのスタックを採取する
+        sampled_beat = None
+        while not self.stopped.wait(self.interval):
+            beat = self.beat
+            if time.monotonic() - beat > self.threshold and sampled_beat != beat:
+                sampled_beat = beat
+                frame = sys._current_frames().get(self.gui_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+                self.sample = (command_queue.qsize(), stack)
+
+    def record(self, stall):
+        self.records.append(stall)
+        self.snapshot = tuple(self.records)
+        self.logger.warning("GUI停止 %.1fms 待ちコマンド=%d\n%s", stall.duration_ms, stall.queue_depth, stall.stack)
+
+
+def preset_hash(settings):
+    # 見た目に関わる項目だけから内容ハッシュを作る（名前やタグが違っても同じ画像なら共有）
+    visual = {k: settings.get(k, DEFAULT_CONFIG[k]) for k in RETICLE_KEYS}
+    return hashlib.sha1(json.dumps(visual, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class PresetLibrary:
+    # プリセットフォルダの *.json を索引化し、サムネイルは内容ハッシュごとにキャッシュする
+    def __init__(self, directory=PRESET_DIR):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+        self.thumb_dir = os.path.join(directory, ".thumbs")
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def refresh(self):
+        # 更新時刻とサイズが索引と同じファイルは読み直さない
+        os.makedirs(self.thumb_dir, exist_ok=True)
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+        entries = {}
+        changed = False
+        for item in os.scandir(self.directory):
+            if not item.is_file() or not item.name.endswith(".json") or item.name == "index.json":
+                continue
+            st = item.stat()
+            entry = cached.get(item.name)
+            if entry is None or entry["mtime"] != st.st_mtime or entry["size"] != st.st_size:
+                try:
+                    preset = self.read(item.path)
+                except (OSError, ValueError) as e:
+                    print(f"プリセット {item.name} を読めません: {e}")
+                    continue
+                entry = {
+                    "name": preset["name"],
+                    "tags": preset["tags"],
+                    "hash": preset_hash(preset["settings"]),
+                    "mtime": st.st_mtime,
+                    "size": st.st_size,
+                }
+                changed = True
+            entry["search"] = " ".join([entry["name"]] + entry["tags"]).lower()
+            entries[item.name] = entry
+        if changed or len(entries) != len(cached):
+            with open(self.index_path, "w", encoding="utf-8") as f:
+                json.dump({k: {f: v for f, v in e.items() if f != "search"} for k, e in entries.items()},
+                          f, ensure_ascii=False)
+        with self.lock:
+            self.entries = entries
+        return entries
+
+    @staticmethod
+    def read(path):
+        # 配布用の {"name", "tags", "settings"} 形式と、設定ファイルそのままの形式の両方を受け付ける
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        settings = data.get("settings", data)
+        return {
+            "name": data.get("name", os.path.splitext(os.path.basename(path))[0]),
+            "tags": [str(t).lower() for t in data.get("tags", [])],
+            "settings": {k: settings[k] for k in RETICLE_KEYS if k in settings},
+        }
+
+    def search(self, query=""):
+        # 空白区切りの語をすべて含む（名前またはタグ）ものを名前順で返す
+        words = query.lower().split()
+        with self.lock:
+            items = list(self.entries.items())
+        return sorted(((filename, entry) for filename, entry in items
+                       if all(w in entry["search"] for w in words)), key=lambda item: item[1]["name"])
+
+    def find(self, name):
+        name = name.lower()
+        for filename, entry in self.search():
+            if entry["name"].lower() == name or os.path.splitext(filename)[0].lower() == name:
+                return filename
+        return None
+
+    def load(self, name):
+        filename = self.find(name)
+        if filename is None:
+            raise KeyError(f"プリセット {name} がありません")
+        return self.read(os.path.join(self.directory, filename))["settings"]
+
+    def save(self, name, settings, tags=()):
+        filename = "".join(c if c.isalnum() or c in "-_" else "_" for c in name) + ".json"
+        preset = {"name": name, "tags": list(tags), "settings": {k: settings[k] for k in RETICLE_KEYS}}
+        with open(os.path.join(self.directory, filename), "w", encoding="utf-8") as f:
+            json.dump(preset, f, ensure_ascii=False, indent=4)
+        self.refresh()
+        return filename
+
+    def thumbnail_path(self, entry):
+        return os.path.join(self.thumb_dir, entry["hash"] + ".png")
+
+    def render_missing(self, callback=None, workers=4):
+        # キャッシュにないサムネイルだけをワーカーで描く。callback(ファイル名, 画像パス) はワーカースレッドから呼ばれる
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                                  thread_name_prefix="thumbnail")
+        jobs = []
+        pending = set()
+        for filename, entry in self.search():
+            path = self.thumbnail_path(entry)
+            if os.path.exists(path):
+                continue
+            if entry["hash"] in pending:
+                continue
+            pending.add(entry["hash"])
+            jobs.append(self.executor.submit(self.render_thumbnail, filename, path, callback))
+        return jobs
+
+    def render_thumbnail(self, filename, path, callback):
+        settings = self.read(os.path.join(self.directory, filename))["settings"]
+        image = render_reticle_image(settings, PRESET_THUMB_SIZE, PRESET_THUMB_SIZE)
+        tmp = path + ".tmp.png"
+        image.save(tmp, "PNG")
+        os.replace(tmp, path)
+        if callback:
+            callback(filename, path)
+        return path
+
+
+class PresetThumbnailNotifier(QtCore.QObject):
+    # ワーカーからの完了通知を GUIスレッドへ渡す
+    ready = QtCore.pyqtSignal(str, str)
+
+
+class WindowsForegroundBackend:
+    # SetWinEventHook で前面ウィンドウの切り替えを受け取る（ポーリングなし）
+    EVENT_SYSTEM_FOREGROUND = 0x0003
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+
+    def __init__(self):
+        from ctypes import wintypes
+        self.wintypes = wintypes
+        self.user32 = ctypes.windll.user32
+        self.kernel32 = ctypes.windll.kernel32
+        self.names = {}  # pid → プロセス名のキャッシュ
+        self.hook = None
+        self.proc = None
+        self.poller = None
+
+    def process_name(self, pid):
+        name = self.names.get(pid)
+        if name is not None:
+            return name
+        name = ""
+        handle = self.kernel32.OpenProcess(self.PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if handle:
+            buffer = ctypes.create_unicode_buffer(1024)
+            size = self.wintypes.DWORD(len(buffer))
+            if self.kernel32.QueryFullProcessImageNameW(handle, 0, buffer, ctypes.byref(size)):
+                name = os.path.basename(buffer.value).lower()
+            self.kernel32.CloseHandle(handle)
+        if len(self.names) > 256:
+            self.names.clear()
+        self.names[pid] = name
+        return name
+
+    def describe(self, hwnd):
+        pid = self.wintypes.DWORD()
+        self.user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
+        length = self.user32.GetWindowTextLengthW(hwnd)
+        title = ctypes.create_unicode_buffer(length + 1)
+        self.user32.GetWindowTextW(hwnd, title, length + 1)
+        return self.process_name(pid.value), title.value
+
+    def current(self):
+        return self.describe(self.user32.GetForegroundWindow())
+
+    def start(self, callback):
+        w = self.wintypes
+        WinEventProc = ctypes.WINFUNCTYPE(None, w.HANDLE, w.DWORD, w.HWND, w.LONG, w.LONG, w.DWORD, w.DWORD)
+        self.proc = WinEventProc(lambda hook, event, hwnd, *args: callback(*self.describe(hwnd)))
+        # WINEVENT_OUTOFCONTEXT なので、呼び出し元（GUIスレッド）のメッセージループで通知される
+        self.hook = self.user32.SetWinEventHook(self.EVENT_SYSTEM_FOREGROUND, self.EVENT_SYSTEM_FOREGROUND,
+                                                0, self.proc, 0, 0, 0)
+        if not self.hook:
+            # フックを入れられない環境（サービスセッションなど）では前面ウィンドウを定期的に見る
+            print("SetWinEventHook に失敗したため、前面アプリをポーリングで監視します。")
+            self.proc = None
+            self.poller = PollingForegroundBackend(self.user32.GetForegroundWindow, self.describe)
+            self.poller.start(callback)
+            return
+        callback(*self.current())
+
+    def stop(self):
+        if self.hook:
+            self.user32.UnhookWinEvent(self.hook)
+        if self.poller is not None:
+            self.poller.stop()
+        self.hook = None
+        self.proc = None
+        self.poller = None
+
+
+class PollingForegroundBackend(QtCore.QObject):
+    # イベントが使えない環境用。識別子が変わったときだけ名前を引き直す
+    def __init__(self, handle, describe, interval_ms=500):
+        super().__init__()
+        self.handle = handle
+        self.describe = describe
+        self.interval_ms = interval_ms
+        self.last = None
+        self.callback = None
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.poll)
+
+    def start(self, callback):
+        self.callback = callback
+        self.last = None
+        self.poll()
+        self.timer.start(self.interval_ms)
+
+    def stop(self):
+        self.timer.stop()
+
+    def poll(self):
+        handle = self.handle()
+        if handle != self.last:
+            self.last = handle
+            self.callback(*self.describe(handle))
+
+
+class FakeForegroundBackend:
+    # テスト用: set_foreground() で前面アプリの切り替えを発生させる
+    def __init__(self, process="", title=""):
+        self.process = process
+        self.title = title
+        self.callback = None
+
+    def start(self, callback):
+        self.callback = callback
+        callback(self.process, self.title)
+
+    def stop(self):
+        self.callback = None
+
+    def set_foreground(self, process, title=""):
+        self.process, self.title = process, title
+        if self.callback:
+            self.callback(process, title)
+
+
+def check_profile_switching():
+    # FakeForegroundBackend で前面アプリを切り替え、ProfileSwitcher が選ぶプロファイルと反映結果を確かめる。
+    # 問題の一覧を返す（空なら成功）
+    global event_log
+    settings = {
+        "profiles": {
+            "default": {"crosshair_color": "#00FF66", "dot_radius": 2},
+            "shooter": {"crosshair_color": "#FF0000", "dot_radius": 4},
+            "editor": {"crosshair_visible": False},
+        },
+        "profile_rules": [{"match": "shooter*.exe", "profile": "shooter"}, {"match": "*- notepad", "profile": "editor"}],
+    }
+    backend = FakeForegroundBackend("explorer.exe", "desktop")
+    target = create_overlay(settings, show=False)
+    events = EventLog()
+    saved, event_log = event_log, events
+    problems = []
+
+    def expect(step, profile, **values):
+        switcher = target.profile_switcher
+        if switcher.active != profile:
+            problems.append(f"{step}: プロファイル {switcher.active} (期待値 {profile})")
+        config = target.get_config()
+        for key, value in values.items():
+            if config[key] != value:
+                problems.append(f"{step}: {key}={config[key]!r} (期待値 {value!r})")
+
+    try:
+        target.set_auto_profiles(True, backend)
+        expect("起動時", "default", crosshair_color="#00FF66", dot_radius=2)
+        backend.set_foreground("shooter_x.exe", "Shooter X")
+        expect("プロセス名で一致", "shooter", crosshair_color="#FF0000", dot_radius=4)
+        logged = len(events.query(limit=EVENT_LOG_SIZE))
+        backend.set_foreground("shooter_x.exe", "Shooter X - lobby")
+        if len(events.query(limit=EVENT_LOG_SIZE)) != logged:
+            problems.append("同じプロファイルへの切り替えが記録されました")
+        backend.set_foreground("notepad.exe", "memo.txt - Notepad")
+        expect("タイトルで一致", "editor", crosshair_visible=False, crosshair_color="#FF0000")
+        backend.set_foreground("explorer.exe", "desktop")
+        expect("一致なし", "default", crosshair_color="#00FF66", dot_radius=2)
+        # 起動時の分を除き、切り替えごとに変わった項目だけが記録されていること
+        changes = [e["changes"] for e in events.query(limit=EVENT_LOG_SIZE) if e.get("source") == "profile"][1:]
+        if [sorted(c) for c in changes] != [["crosshair_color", "dot_radius"], ["crosshair_visible"],
+                                            ["crosshair_color", "dot_radius"]]:
+            problems.append(f"記録された変更が想定と違います: {changes}")
+        target.set_auto_profiles(False)
+        if backend.callback is not None:
+            problems.append("自動切り替えを止めても前面アプリの監視が残っています")
+    finally:
+        event_log = saved
+        target.shutdown()
+    return problems
+
+
+def create_foreground_backend():
+    if sys.platform == "win32":
+        try:
+            return WindowsForegroundBackend()
+        except (AttributeError, OSError):
+            pass
+    raise RuntimeError("前面アプリの監視は Windows のみ対応しています。")
+
+
+class ProfileSwitcher:
+    # 前面アプリのプロセス名・タイトルをルールと照合し、対応するプロファイルの差分だけを反映する
+    def __init__(self, overlay, backend):
+        self.overlay = overlay
+        self.backend = backend
+        self.active = None
+        self.foreground = ("", "")
+
+    def start(self):
+        self.backend.start(self.on_foreground)
+
+    def stop(self):
+        self.backend.stop()
+
+    def match(self, process, title):
+        process, title = process.lower(), title.lower()
+        for rule in self.overlay.profile_rules:
+            pattern = rule["match"].lower()
+            if fnmatch.fnmatch(process, pattern) or fnmatch.fnmatch(title, pattern):
+                return rule["profile"]
+        return "default" if "default" in self.overlay.profiles else None
+
+    def on_foreground(self, process, title):
+        self.foreground = (process, title)
+        profile = self.match(process, title)
+        if profile is None or profile == self.active:
+            return
+        self.active = profile
+        try:
+            self.overlay.apply_profile(profile)
+        except KeyError as e:
+            print(e)
+            return
+        self.overlay.commit_change("profile", profile)
+
+
+class WindowsWindowTracker(QtCore.QObject):
+    # 対象ウィンドウの移動・サイズ変更イベントを受け、まとめてからクライアント領域を通知する
+    EVENT_SYSTEM_FOREGROUND = 0x0003
+    EVENT_OBJECT_DESTROY = 0x8001
+    EVENT_OBJECT_LOCATIONCHANGE = 0x800B
+    WINEVENT_SKIPOWNPROCESS = 0x0002
+    OBJID_WINDOW = 0
+
+    def __init__(self, coalesce_ms=16):
+        super().__init__()
+        self.names = WindowsForegroundBackend()
+        self.wintypes = self.names.wintypes
+        self.user32 = self.names.user32
+        self.hooks = []
+        self.target_hooks = []
+        self.proc = None
+        self.hwnd = None
+        self.pattern = ""
+        self.callback = None
+        self.last = None
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(coalesce_ms)
+        self.timer.timeout.connect(self.flush)
+
+    def find(self):
+        pattern = self.pattern.lower()
+        found = []
+        WNDENUMPROC = ctypes.WINFUNCTYPE(ctypes.c_bool, self.wintypes.HWND, self.wintypes.LPARAM)
+
+        def visit(hwnd, _):
+            if self.user32.IsWindowVisible(hwnd):
+                process, title = self.names.describe(hwnd)
+                if fnmatch.fnmatch(process, pattern) or fnmatch.fnmatch(title.lower(), pattern):
+                    found.append(hwnd)
+                    return False
+            return True
+        self.user32.EnumWindows(WNDENUMPROC(visit), 0)
+        return found[0] if found else None
+
+    def start(self, pattern, callback):
+        self.pattern = pattern
+        self.callback = callback
+        w = self.wintypes
+        WinEventProc = ctypes.WINFUNCTYPE(None, w.HANDLE, w.DWORD, w.HWND, w.LONG, w.LONG, w.DWORD, w.DWORD)
+        self.proc = WinEventProc(self.on_event)
+        # 前面切り替えだけは全体から受け、対象ウィンドウを探し直すきっかけにする
+        hook = self.user32.SetWinEventHook(self.EVENT_SYSTEM_FOREGROUND, self.EVENT_SYSTEM_FOREGROUND, 0,
+                                           self.proc, 0, 0, self.WINEVENT_SKIPOWNPROCESS)
+        if hook:
+            self.hooks.append(hook)
+        self.track(self.find())
+        self.flush()
+
+    def track(self, hwnd):
+        # 移動・破棄のイベントは対象ウィンドウのプロセス・スレッドに絞って受ける
+        for hook in self.target_hooks:
+            self.user32.UnhookWinEvent(hook)
+        self.target_hooks = []
+        self.hwnd = hwnd
+        if hwnd is None:
+            return
+        pid = self.wintypes.DWORD()
+        tid = self.user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
+        for event in (self.EVENT_OBJECT_DESTROY, self.EVENT_OBJECT_LOCATIONCHANGE):
+            hook = self.user32.SetWinEventHook(event, event, 0, self.proc, pid.value, tid, 0)
+            if hook:
+                self.target_hooks.append(hook)
+
+    def stop(self):
+        self.track(None)
+        for hook in self.hooks:
+            self.user32.UnhookWinEvent(hook)
+        self.hooks = []
+        self.proc = None
+        self.timer.stop()
+
+    def on_event(self, hook, event, hwnd, id_object, id_child, thread, event_time):
+        if event == self.EVENT_SYSTEM_FOREGROUND and (self.hwnd is None or not self.user32.IsWindow(self.hwnd)):
+            self.track(self.find())
+        elif hwnd != self.hwnd or id_object != self.OBJID_WINDOW:
+            return
+        # ドラッグ中は大量に届くので、一定間隔に1回だけ位置を読み直す
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def client_rect(self):
+        if self.hwnd is None or not self.user32.IsWindow(self.hwnd):
+            return None
+        rect = self.wintypes.RECT()
+        self.user32.GetClientRect(self.hwnd, ctypes.byref(rect))
+        origin = self.wintypes.POINT(0, 0)
+        self.user32.ClientToScreen(self.hwnd, ctypes.byref(origin))
+        return (origin.x, origin.y, rect.right - rect.left, rect.bottom - rect.top)
+
+    def flush(self):
+        rect = self.client_rect()
+        if rect != self.last:
+            self.last = rect
+            self.callback(rect)
+
+
+class FakeWindowTracker:
+    # テスト用: set_rect() で対象ウィンドウの移動・消失を発生させる
+    def __init__(self, rect=None):
+        self.rect = rect
+        self.callback = None
+        self.pattern = ""
+
+    def start(self, pattern, callback):
+        self.pattern = pattern
+        self.callback = callback
+        callback(self.rect)
+
+    def stop(self):
+        self.callback = None
+
+    def set_rect(self, rect):
+        self.rect = rect
+        if self.callback:
+            self.callback(rect)
+
+
+def create_window_tracker():
+    if sys.platform == "win32":
+        try:
+            return WindowsWindowTracker()
+        except (AttributeError, OSError):
+            pass
+    raise RuntimeError("この環境ではウィンドウ追従に対応していません。")
+
+
+class GlyphAtlas:
+    # HUD で使う文字だけを等幅のセルに並べて1枚の画像に描いておく
+    def __init__(self, color="#FFFFFF", chars=HUD_CHARS, point_size=12):
+        font = QtGui.QFont("Consolas")
+        font.setStyleHint(QtGui.QFont.Monospace)
+        font.setPointSize(point_size)
+        font.setBold(True)
+        metrics = QtGui.QFontMetrics(font)
+        self.cell_width = max(metrics.horizontalAdvance(ch) for ch in chars) + 2
+        self.cell_height = metrics.height() + 2
+        self.index = {ch: i for i, ch in enumerate(chars)}
+        self.image = QtGui.QImage(self.cell_width * len(chars), self.cell_height,
+                                  QtGui.QImage.Format_ARGB32_Premultiplied)
+        self.image.fill(QtCore.Qt.transparent)
+        painter = QtGui.QPainter(self.image)
+        painter.setFont(font)
+        for ch, i in self.index.items():
+            x = i * self.cell_width + 1
+            # 背景に埋もれないよう黒い影を付ける
+            painter.setPen(QtGui.QColor(0, 0, 0, 200))
+            painter.drawText(x + 1, metrics.ascent() + 2, ch)
+            painter.setPen(QtGui.QColor(color))
+            painter.drawText(x, metrics.ascent() + 1, ch)
+        painter.end()
+
+    def source(self, ch):
+        return QtCore.QRect(self.index.get(ch, self.index[" "]) * self.cell_width, 0,
+                            self.cell_width, self.cell_height)
+
+
+class HudElement:
+    def __init__(self, width):
+        self.width = width
+        self.text = " " * width
+        self.origin = QtCore.QPoint(0, 0)
+
+    def cell_rect(self, i, atlas):
+        return QtCore.QRect(self.origin.x() + i * atlas.cell_width, self.origin.y(),
+                            atlas.cell_width, atlas.cell_height)
+
+    def rect(self, atlas):
+        return QtCore.QRect(self.origin.x(), self.origin.y(), self.width * atlas.cell_width, atlas.cell_height)
+
+    def set_text(self, text, atlas):
+        # 変わった文字のセルだけを返す
+        text = text.rjust(self.width)[-self.width:]
+        dirty = [self.cell_rect(i, atlas) for i, (old, new) in enumerate(zip(self.text, text)) if old != new]
+        self.text = text
+        return dirty
+
+
+class HudOverlay(QtCore.QObject):
+    # 時計・経過時間・ゲームの FPS を、変わった桁だけの再描画で表示する
+    ORDER = ("clock", "timer", "fps")
+
+    def __init__(self, overlay, color="#FFFFFF", fps_port=47800):
+        super().__init__(overlay)
+        self.overlay = overlay
+        self.atlas = GlyphAtlas(color)
+        self.elements = {}
+        self.session_start = time.monotonic()
+        self.fps_port = fps_port
+        self.fps = None
+        self.fps_received = 0.0
+        self.socket = None
+        self.repaints = 0
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.tick)
+
+    @property
+    def active(self):
+        return bool(self.elements)
+
+    def set_color(self, color):
+        self.atlas = GlyphAtlas(color)
+        self.layout()
+
+    def set_enabled(self, name, enabled):
+        if enabled and name not in self.elements:
+            self.elements[name] = HudElement(10 if name == "timer" else 8)
+            if name == "timer":
+                self.session_start = time.monotonic()
+            if name == "fps":
+                self.open_fps_channel()
+        elif not enabled and name in self.elements:
+            self.overlay.update(self.elements.pop(name).rect(self.atlas))
+            if name == "fps" and self.socket is not None:
+                self.socket.close()
+                self.socket = None
+        self.layout()
+        if self.elements and not self.timer.isActive():
+            self.tick()
+        elif not self.elements:
+            self.timer.stop()
+
+    def layout(self):
+        # 画面右上から縦に並べる
+        y = HUD_MARGIN
+        for name in self.ORDER:
+            element = self.elements.get(name)
+            if element is None:
+                continue
+            old = element.rect(self.atlas)
+            element.origin = QtCore.QPoint(self.overlay.width() - HUD_MARGIN - element.width * self.atlas.cell_width, y)
+            element.text = " " * element.width
+            self.overlay.update(old.united(element.rect(self.atlas)))
+            y += self.atlas.cell_height + 2
+        # 並べ直した要素は次の tick を待たずにすぐ書き直す
+        for name in self.elements:
+            self.refresh(name)
+
+    def open_fps_channel(self):
+        self.socket = QtNetwork.QUdpSocket(self)
+        if not self.socket.bind(QtNetwork.QHostAddress.LocalHost, self.fps_port):
+            print(f"FPS 受信ポート {self.fps_port} を開けません。")
+        self.socket.readyRead.connect(self.read_fps)
+
+    def read_fps(self):
+        while self.socket.hasPendingDatagrams():
+            data, _, _ = self.socket.readDatagram(self.socket.pendingDatagramSize())
+            try:
+                self.feed_fps(float(data.decode("ascii", errors="ignore").split()[-1]))
+            except (ValueError, IndexError):
+                pass
+
+    def feed_fps(self, fps):
+        self.fps = fps
+        self.fps_received = time.monotonic()
+        self.refresh("fps")
+
+    def text(self, name):
+        if name == "clock":
+            return time.strftime("%H:%M:%S")
+        if name == "timer":
+            elapsed = int(time.monotonic() - self.session_start)
+            return "T {:02d}:{:02d}:{:02d}".format(elapsed // 3600, elapsed // 60 % 60, elapsed % 60)
+        if self.fps is None or time.monotonic() - self.fps_received > 2.0:
+            return "FPS  --"
+        return "FPS {:>4d}".format(int(round(self.fps)))
+
+    def refresh(self, name):
+        element = self.elements.get(name)
+        if element is None:
+            return
+        for rect in element.set_text(self.text(name), self.atlas):
+            self.overlay.update(rect)
+            self.repaints += 1
+
+    def tick(self):
+        for name in self.elements:
+            self.refresh(name)
+        # 次の秒の変わり目に合わせて起きる
+        if self.elements:
+            self.timer.start(1000 - int(time.time() * 1000) % 1000 + 1)
+
+    def paint(self, painter, area):
+        for element in self.elements.values():
+            if not area.intersects(element.rect(self.atlas)):
+                continue
+            for i, ch in enumerate(element.text):
+                if ch == " ":
+                    continue
+                cell = element.cell_rect(i, self.atlas)
+                if area.intersects(cell):
+                    painter.drawImage(cell.topLeft(), self.atlas.image, self.atlas.source(ch))
+
+
+KeyEvent = collections.namedtuple("KeyEvent", ["event_type", "name", "scan_code", "time"])
+
+# keyboard パッケージのキー名 → Linux のキーコード（input-event-codes.h）
+LINUX_KEY_CODES = {
+    "esc": 1, "1": 2, "2": 3, "3": 4, "4": 5, "5": 6, "6": 7, "7": 8, "8": 9, "9": 10, "0": 11,
+    "-": 12, "=": 13, "backspace": 14, "tab": 15,
+    "q": 16, "w": 17, "e": 18, "r": 19, "t": 20, "y": 21, "u": 22, "i": 23, "o": 24, "p": 25,
+    "[": 26, "]": 27, "enter": 28, "ctrl": 29,
+    "a": 30, "s": 31, "d": 32, "f": 33, "g": 34, "h": 35, "j": 36, "k": 37, "l": 38,
+    ";": 39, "'": 40, "`": 41, "shift": 42, "\\": 43,
+    "z": 44, "x": 45, "c": 46, "v": 47, "b": 48, "n": 49, "m": 50, ",": 51, ".": 52, "/": 53,
+    "right shift": 54, "alt": 56, "space": 57, "caps lock": 58,
+    "f1": 59, "f2": 60, "f3": 61, "f4": 62, "f5": 63, "f6": 64, "f7": 65, "f8": 66, "f9": 67, "f10": 68,
+    "num lock": 69, "scroll lock": 70, "f11": 87, "f12": 88,
+    "right ctrl": 97, "print screen": 99, "alt gr": 100,
+    "home": 102, "up": 103, "page up": 104, "left": 105, "right": 106, "end": 107, "down": 108,
+    "page down": 109, "insert": 110, "delete": 111, "pause": 119,
+    "left windows": 125, "right windows": 126, "menu": 127,
+}
+# 左右まとめて指定する名前（keyboard パッケージでも両側が対象になる）
+LINUX_KEY_GROUPS = {
+    "ctrl": (29, 97),
+    "shift": (42, 54),
+    "alt": (56, 100),
+    "windows": (125, 126),
+    "left ctrl": (29,),
+    "left shift": (42,),
+    "left alt": (56,),
+    "right alt": (100,),
+}
+LINUX_KEY_NAMES = {code: name for name, code in LINUX_KEY_CODES.items()}
+
+
+def linux_key_codes(name):
+    name = name.lower()
+    if name in LINUX_KEY_GROUPS:
+        return LINUX_KEY_GROUPS[name]
+    if name in LINUX_KEY_CODES:
+        return (LINUX_KEY_CODES[name],)
+    if evdev is not None:
+        code = evdev.ecodes.ecodes.get("KEY_" + name.upper().replace(" ", ""))
+        if code is not None:
+            return (code,)
+    raise ValueError(f"不明なキー名: {name}")
+
+
+def compile_key_table(blocked, remaps):
+    # スキャンコード → 送るコード（-1 は捨てる）。そのまま通すキーは載せない。置き換えは無効化より優先
+    table = dict.fromkeys(blocked, -1)
+    for sources, target in remaps.items():
+        for code in sources:
+            table[code] = target
+    return table
+
+
+class KeyboardModuleBackend:
+    # keyboard パッケージのフックを1つだけ入れ、無効化と置き換えを同じ表で処理する
+    name = "keyboard"
+
+    def __init__(self):
+        self.blocked_keys = {}
+        self.remaps = {}
+        self.table = {}
+        self.hook = None
+        self.lock = threading.Lock()
+
+    def block_key(self, key):
+        self.apply_blocked([key], [])
+
+    def unblock_key(self, key):
+        if key not in self.blocked_keys:
+            raise KeyError(key)
+        self.apply_blocked([], [key])
+
+    def apply_blocked(self, add, remove):
+        # 追加と解除をまとめて表1つの差し替えで反映するので、両方に含まれるキーは一瞬も有効にならない
+        codes = {key: keyboard.key_to_scan_codes(key) for key in add}
+        with self.lock:
+            self.blocked_keys.update(codes)
+            for key in remove:
+                self.blocked_keys.pop(key, None)
+            self.compile_table()
+
+    def apply_remaps(self, remaps):
+        codes = {keyboard.key_to_scan_codes(src): keyboard.key_to_scan_codes(dst)[0] for src, dst in remaps.items()}
+        with self.lock:
+            self.remaps = codes
+            self.compile_table()
+
+    def compile_table(self):
+        self.table = compile_key_table((c for cs in self.blocked_keys.values() for c in cs), self.remaps)
+        # 表が空の間はフックを外しておく
+        if self.table and self.hook is None:
+            self.hook = keyboard.hook(self.filter, suppress=True)
+        elif not self.table and self.hook is not None:
+            keyboard.unhook(self.hook)
+            self.hook = None
+
+    def filter(self, event):
+        # フックのスレッドで全キーに対して呼ばれる。表にないキーはそのまま通す
+        target = self.table.get(event.scan_code)
+        if target is None:
+            return True
+        if target >= 0:
+            if event.event_type == KEY_DOWN:
+                keyboard.press(target)
+            else:
+                keyboard.release(target)
+        return False
+
+    def add_hotkey(self, hotkey, callback):
+        return keyboard.add_hotkey(hotkey, callback)
+
+    def remove_hotkey(self, handle):
+        keyboard.remove_hotkey(handle)
+
+    def read_event(self):
+        return keyboard.read_event(suppress=False)
+
+    def read_key(self):
+        return keyboard.read_key()
+
+    def close(self):
+        with self.lock:
+            if self.hook is not None:
+                keyboard.unhook(self.hook)
+                self.hook = None
+            self.table = {}
+
+
+class EvdevKeyboardBackend:
+    # キーボードを grab して仮想デバイス（uinput）へ転送し、無効化キーだけを落とす
+    name = "evdev"
+
+    def __init__(self, devices=None, sink=None):
+        if devices is None:
+            if evdev is None:
+                raise RuntimeError("evdev パッケージがインストールされていません。")
+            devices = [d for d in map(evdev.InputDevice, evdev.list_devices())
+                       if LINUX_KEY_CODES["a"] in d.capabilities().get(EV_KEY, [])]
+            if not devices:
+                raise RuntimeError("キーボードが見つかりません（/dev/input の権限を確認してください）。")
+            sink = evdev.UInput.from_device(*devices, name="crosshair-keyboard")
+        self.devices = devices
+        self.sink = sink
+        self.blocked_keys = {}
+        self.blocked = frozenset()
+        self.remaps = {}
+        # スキャンコード → 送るコード（-1 は捨てる）。そのまま通すキーは載せない。
+        # 変更のたびに丸ごと作り直して差し替える
+        self.table = {}
+        self.hotkeys = {}
+        self.hotkey_ids = itertools.count(1)
+        self.pressed = set()
+        self.lock = threading.Lock()
+        self.captured = queue.Queue()
+        self.capturing = 0
+        self.threads = []
+        for device in devices:
+            device.grab()
+            thread = threading.Thread(target=self.filter_events, args=(device,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def filter_events(self, device):
+        # 1イベントあたりの処理は種類の判定と表の参照1回だけにする
+        write = self.sink.write_event
+        emit = self.sink.write
+        try:
+            for event in device.read_loop():
+                if event.type == EV_KEY:
+                    if self.capturing:
+                        self.capture(event)
+                    if self.hotkeys:
+                        self.match_hotkeys(event)
+                    if event.code in self.table:
+                        code = self.table[event.code]
+                        if code >= 0:
+                            emit(EV_KEY, code, event.value)
+                        continue
+                write(event)
+        except OSError:
+            pass  # デバイスが外された
+
+    def capture(self, event):
+        if event.value == 2:
+            return  # オートリピートは読み取りに渡さない
+        name = LINUX_KEY_NAMES.get(event.code, str(event.code))
+        self.captured.put(KeyEvent(KEY_DOWN if event.value else KEY_UP, name, event.code, time.time()))
+
+    def match_hotkeys(self, event):
+        if event.value == 2:
+            return
+        if not event.value:
+            self.pressed.discard(event.code)
+            return
+        self.pressed.add(event.code)
+        for parts, callback in list(self.hotkeys.values()):
+            if event.code in parts[-1] and all(self.pressed.intersection(part) for part in parts):
+                callback()
+
+    def block_key(self, key):
+        self.apply_blocked([key], [])
+
+    def unblock_key(self, key):
+        if key not in self.blocked_keys:
+            raise KeyError(key)
+        self.apply_blocked([], [key])
+
+    def apply_blocked(self, add, remove):
+        # 追加と解除をまとめて1回の差し替えで反映する（読み取り側はロック不要）
+        codes = {key: linux_key_codes(key) for key in add}
+        with self.lock:
+            self.blocked_keys.update(codes)
+            for key in remove:
+                self.blocked_keys.pop(key, None)
+            self.blocked = frozenset(c for cs in self.blocked_keys.values() for c in cs)
+            self.compile_table()
+
+    def apply_remaps(self, remaps):
+        codes = {linux_key_codes(src): linux_key_codes(dst)[0] for src, dst in remaps.items()}
+        with self.lock:
+            self.remaps = codes
+            self.compile_table()
+
+    def compile_table(self):
+        self.table = compile_key_table(self.blocked, self.remaps)
+
+    def add_hotkey(self, hotkey, callback):
+        parts = tuple(linux_key_codes(part.strip()) for part in hotkey.split("+"))
+        handle = next(self.hotkey_ids)
+        # 辞書ごと差し替えるのでフィルタ側はロック不要
+        self.hotkeys = {**self.hotkeys, handle: (parts, callback)}
+        return handle
+
+    def remove_hotkey(self, handle):
+        hotkeys = dict(self.hotkeys)
+        del hotkeys[handle]
+        self.hotkeys = hotkeys
+
+    def read_event(self):
+        with self.lock:
+            self.capturing += 1
+        try:
+            return self.captured.get()
+        finally:
+            with self.lock:
+                self.capturing -= 1
+                if not self.capturing:
+                    self.captured = queue.Queue()
+
+    def read_key(self):
+        while True:
+            event = self.read_event()
+            if event.event_type == KEY_DOWN:
+                return event.name
+
+    def close(self):
+        for device in self.devices:
+            try:
+                device.ungrab()
+            except OSError:
+                pass
+            device.close()
+        self.sink.close()
+
+
+FakeInputEvent = collections.namedtuple("FakeInputEvent", ["type", "code", "value"])
+
+
+class FakeKeyboardDevice:
+    # テスト用: press()/release() で入力を流し込み、close() で読み取りを終える。
+    # events を渡すとその列を流し終えたところで止まる（ベンチマーク用）
+    def __init__(self, events=None):
+        self.events = events
+        self.queue = queue.Queue()
+        self.grabbed = False
+
+    def grab(self):
+        self.grabbed = True
+
+    def ungrab(self):
+        self.grabbed = False
+
+    def press(self, name, value=1):
+        self.queue.put(FakeInputEvent(EV_KEY, linux_key_codes(name)[0], value))
+        self.queue.put(FakeInputEvent(EV_SYN, 0, 0))
+
+    def release(self, name):
+        self.press(name, 0)
+
+    def read_loop(self):
+        if self.events is not None:
+            return iter(self.events)
+        return iter(self.queue.get, None)
+
+    def close(self):
+        self.queue.put(None)
+
+
+class FakeKeySink:
+    # uinput の代わりに転送されたイベントを溜める
+    def __init__(self):
+        self.events = []
+
+    def write_event(self, event):
+        self.events.append(event)
+
+    def write(self, etype, code, value):
+        self.events.append(FakeInputEvent(etype, code, value))
+
+    def close(self):
+        pass
+
+
+def create_keyboard_backend(name):
+    if name == "evdev":
+        try:
+            return EvdevKeyboardBackend()
+        except (RuntimeError, OSError) as e:
+            print(f"evdev バックエンドを使えないため keyboard を使います: {e}")
+    return KeyboardModuleBackend()
+
+
+def benchmark_keyboard(count=200000, blocked=("windows", "caps lock", "f1", "tab"),
+                       remaps=(("caps lock", "ctrl"), ("f1", "esc"))):
+    # 押下・離し・SYN を並べた入力列をフィルタに通し、1イベントあたりのコストを測る
+    names = [n for n in LINUX_KEY_CODES if n not in ("enter",)]
+    events = []
+    for i in range(count // 4):
+        code = LINUX_KEY_CODES[names[i % len(names)]]
+        events += [FakeInputEvent(EV_KEY, code, 1), FakeInputEvent(EV_SYN, 0, 0),
+                   FakeInputEvent(EV_KEY, code, 0), FakeInputEvent(EV_SYN, 0, 0)]
+    results = []
+    sink = FakeKeySink()
+    started = time.perf_counter()
+    for event in events:
+        sink.write_event(event)
+    results.append(("転送のみ", (time.perf_counter() - started) / len(events) * 1e9, len(sink.events)))
+    for keys, remap in (((), ()), (blocked, ()), (blocked, remaps)):
+        sink = FakeKeySink()
+        backend = EvdevKeyboardBackend([], sink)
+        backend.apply_blocked(keys, [])
+        backend.apply_remaps(dict(remap))
+        started = time.perf_counter()
+        backend.filter_events(FakeKeyboardDevice(events))
+        elapsed = time.perf_counter() - started
+        label = f"無効化 {len(keys)} 件" + (f"＋置換 {len(remap)} 件" if remap else "")
+        results.append((label, elapsed / len(events) * 1e9, len(sink.events)))
+    return len(events), results
+
+
+RETICLE_INSTANCE_KEYS = ("offset_x", "offset_y", "size", "gap") + RETICLE_KEYS
+
+
+def parse_reticle_value(key, text):
+    # CUI から受け取った文字列を項目の型に合わせて変換する
+    if key in ("offset_x", "offset_y", "size", "gap", "dot_radius"):
+        return int(text)
+    if key in ("crosshair_alpha", "dot_alpha"):
+        value = float(text)
+        if not 0.0 <= value <= 1.0:
+            raise ValueError("透明度は 0.0〜1.0 で指定してください")
+        return value
+    if key in ("crosshair_visible", "dot_visible"):
+        if text not in ("on", "off"):
+            raise ValueError("on か off で指定してください")
+        return text == "on"
+    if key in ("crosshair_color", "dot_outer_color", "dot_inner_color"):
+        return parse_color(text)[0]
+    raise ValueError(f"不明な項目: {key}")
+
+
+class ReticleInstance:
+    # 追加の照準1つ分。見た目が変わったときだけスプライトを描き直す
+    def __init__(self, name, settings):
+        self.name = name
+        self.settings = dict(DEFAULT_CONFIG, size=20, gap=10, offset_x=0, offset_y=0)
+        self.settings.update({k: v for k, v in settings.items() if k in RETICLE_INSTANCE_KEYS})
+        self.key = None
+        self.sprite = None
+
+    def extent(self):
+        dot_radius = self.settings["dot_radius"] if self.settings["dot_visible"] else 0
+        return max(self.settings["size"], dot_radius) + 2
+
+    def rect(self, center_x, center_y):
+        extent = self.extent()
+        return QtCore.QRect(center_x + self.settings["offset_x"] - extent,
+                            center_y + self.settings["offset_y"] - extent, extent * 2, extent * 2)
+
+    def image(self, dpr):
+        key = tuple(self.settings[k] for k in RETICLE_KEYS) + (self.settings["size"], self.settings["gap"], dpr)
+        if key != self.key:
+            dim = self.extent() * 2
+            self.sprite = render_reticle_image(self.settings, dim, dim, dpr, self.settings["size"], self.settings["gap"])
+            self.key = key
+        return self.sprite
+
+    def to_config(self):
+        config = {"name": self.name}
+        config.update({k: self.settings[k] for k in RETICLE_INSTANCE_KEYS})
+        return config
+
+
+class ReticleLayer:
+    # 追加の照準をまとめて持つ。変更のたびにその照準の新旧の範囲だけを返す
+    def __init__(self, configs=()):
+        self.instances = collections.OrderedDict()
+        for config in configs:
+            self.instances[config["name"]] = ReticleInstance(config["name"], config)
+
+    def to_config(self):
+        return [instance.to_config() for instance in self.instances.values()]
+
+    def bounds(self, center_x, center_y):
+        rect = QtCore.QRect()
+        for instance in self.instances.values():
+            rect = rect.united(instance.rect(center_x, center_y))
+        return rect
+
+    def add(self, name, offset_x, offset_y, style, center_x, center_y):
+        if name in self.instances:
+            raise ValueError(f"照準 {name} はすでにあります")
+        instance = ReticleInstance(name, dict(style, offset_x=offset_x, offset_y=offset_y))
+        self.instances[name] = instance
+        return instance.rect(center_x, center_y)
+
+    def set(self, name, key, value, center_x, center_y):
+        if name not in self.instances:
+            raise ValueError(f"照準 {name} はありません")
+        if key not in RETICLE_INSTANCE_KEYS:
+            raise ValueError(f"不明な項目: {key}")
+        instance = self.instances[name]
+        dirty = instance.rect(center_x, center_y)
+        instance.settings[key] = value
+        return dirty.united(instance.rect(center_x, center_y))
+
+    def remove(self, name, center_x, center_y):
+        if name not in self.instances:
+            raise ValueError(f"照準 {name} はありません")
+        return self.instances.pop(name).rect(center_x, center_y)
+
+    def paint(self, painter, area, center_x, center_y, dpr=1.0):
+        # 再描画範囲にかかる照準だけをキャッシュ済みスプライトから貼る
+        for instance in self.instances.values():
+            rect = instance.rect(center_x, center_y)
+            if area.intersects(rect):
+                painter.drawImage(rect.topLeft(), instance.image(dpr))
+
+
+# 共有コード v1: version, flags(表示), dot_radius, 色×3 (RGB), 透明度×2 (0〜100), CRC の下位8ビット
+SHARE_CODE_STRUCT = struct.Struct("<BBB3s3s3sBB")
+SHARE_CODE_LENGTH = len(SHARE_CODE_PREFIX) + (SHARE_CODE_STRUCT.size + 1) * 8 // 5
+# base32 の文字を int(..., 32) の数字に置き換える表（0/1/8/9 は base32 にないので不正な文字にする）
+SHARE_CODE_DIGITS = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ234567" + "0189",
+                                  "0123456789abcdefghijklmnopqrstuv" + "!!!!")
+
+
+def encode_share_code(settings):
+    # 見た目の設定を短い文字列にする。CUI は入力を小文字にするので大文字小文字を区別しない base32 を使う
+    payload = SHARE_CODE_STRUCT.pack(
+        SHARE_CODE_VERSION,
+        bool(settings["crosshair_visible"]) | bool(settings["dot_visible"]) << 1,
+        max(0, min(int(settings["dot_radius"]), 255)),
+        bytes.fromhex(settings["crosshair_color"][1:7]),
+        bytes.fromhex(settings["dot_outer_color"][1:7]),
+        bytes.fromhex(settings["dot_inner_color"][1:7]),
+        int(round(max(0.0, min(settings["crosshair_alpha"], 1.0)) * 100)),
+        int(round(max(0.0, min(settings["dot_alpha"], 1.0)) * 100)),
+    )
+    payload += bytes((binascii.crc32(payload) & 0xFF,))
+    return SHARE_CODE_PREFIX + base64.b32encode(payload).decode("ascii")
+
+
+def decode_share_code(code):
+    # 不正なコードは ValueError。辞書1つ以外はほぼ確保しない
+    code = code.strip().upper()
+    if len(code) != SHARE_CODE_LENGTH or not code.startswith(SHARE_CODE_PREFIX):
+        raise ValueError("共有コードの形式が違います")
+    # 15バイト = 24文字ちょうどなので、1つの整数として読めばパディング処理が要らない
+    try:
+        payload = int(code[len(SHARE_CODE_PREFIX):].translate(SHARE_CODE_DIGITS), 32).to_bytes(
+            SHARE_CODE_STRUCT.size + 1, "big")
+    except (ValueError, OverflowError):
+        raise ValueError("共有コードの形式が違います")
+    if payload[0] != SHARE_CODE_VERSION:
+        raise ValueError(f"対応していない共有コードのバージョンです: {payload[0]}")
+    if binascii.crc32(payload[:-1]) & 0xFF != payload[-1]:
+        raise ValueError("共有コードが壊れています")
+    _, flags, radius, crosshair, outer, inner, crosshair_alpha, dot_alpha = SHARE_CODE_STRUCT.unpack_from(payload)
+    return {
+        "crosshair_visible": bool(flags & 1),
+        "dot_visible": bool(flags & 2),
+        "dot_radius": radius,
+        "crosshair_color": "#" + crosshair.hex().upper(),
+        "dot_outer_color": "#" + outer.hex().upper(),
+        "dot_inner_color": "#" + inner.hex().upper(),
+        "crosshair_alpha": crosshair_alpha / 100,
+        "dot_alpha": dot_alpha / 100,
+    }
+
+
+def find_share_codes(text):
+    # 貼り付けられた文字列から有効なコードだけを (コード, 設定) で返す
+    found = []
+    for word in text.split():
+        if len(word) == SHARE_CODE_LENGTH and word[:len(SHARE_CODE_PREFIX)].upper() == SHARE_CODE_PREFIX:
+            try:
+                found.append((word, decode_share_code(word)))
+            except ValueError:
+                pass
+    return found
+
+
+def benchmark_share_codes(count=10000):
+    base = dict(DEFAULT_CONFIG)
+    codes = [encode_share_code(dict(base, dot_radius=i % 50, crosshair_alpha=(i % 101) / 100)) for i in range(count)]
+    text = "\n".join(codes)
+    started = time.perf_counter()
+    found = find_share_codes(text)
+    elapsed = time.perf_counter() - started
+    # 確保量は時間とは別に測る（tracemalloc 中は遅くなるため）
+    tracemalloc.start()
+    find_share_codes(text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return len(found), elapsed, peak
+
+
+COMMANDS = {
+    "-crosshair": "toggle_crosshair",
+    "-dot": "toggle_dot",
+    "--crosshair-color": "pick_crosshair_color",
+    "--dot-out-color": "pick_dot_outer_color",
+    "--dot-in-color": "pick_dot_inner_color",
+    "--all-enable-keys": "enable_all_keys",
+    "-gui": "enter_gui_mode",
+    "-exit": "exit",
+    "-help": "help",
+    "--crosshair-alpha": "set_crosshair_alpha",
+    "--dot-alpha": "set_dot_alpha",
+    "launch_mode": "cui",
+    "-gui": "switch_to_gui",
+    "-cui": "switch_to_cui",
+    "-bloom": "bloom",
+    "-undo": "undo",
+    "-redo": "redo",
+    "-mark-good": "mark_good",
+    "-revert-good": "revert_to_good",
+    "-params": "print_parameters",
+}
+
+def clear_keyboard_buffer():
+    try:
+        # バッファに残っているイベントを全て読み捨てる
+        while True:
+            event = get_keyboard_backend().read_event()
+            # ここに到達するとイベントを消費する
+            if event.event_type == KEY_UP:
+                # 何も押されていないときはbreak
+                break
+    except:
+        # イベントが無い場合や例外発生時は終了
+        pass
+
+CUI_ONLY_COMMANDS = [
+    "-dotsize",
+    "--disable-key",
+    "--multiple-disable-keys",
+    "--enable-key",
+    "--remap-key",
+    "--unremap-key",
+    "--key-layer",
+    "--key-layer-save",
+    "--key-layer-hotkey",
+    "-key-layers",
+    "--adaptive-color",
+    "--scope",
+    "-scope-stats",
+    "--animation",
+    "--blink-on-toggle",
+    "-anim-stats",
+    "--dynamic-spread",
+    "--shm-publish",
+    "-stalls",
+    "-presets",
+    "-preset-load",
+    "-preset-save",
+    "-export-code",
+    "-import-code",
+    "--auto-profile",
+    "-profile",
+    "-profile-save",
+    "-profile-rule",
+    "-profiles",
+    "--anchor",
+    "--reticle",
+    "-reticles",
+    "--hud",
+    "-history",
+    "-events",
+    "--events-dump",
+    "--trace-start",
+    "--trace-stop",
+]
+
+
+class CommandNotifier(QtCore.QObject):
+    # コマンドが積まれたことを GUI スレッドへ知らせる（別スレッドからの emit はキュー接続で届く）
+    posted = QtCore.pyqtSignal()
+
+
+command_notifier = None
+
+
+def send_command(cmd, val=None, source="cui"):
+    # GUIスレッドへコマンドを送り、処理完了を待てる Future を返す
+    ack = concurrent.futures.Future()
+    command_queue.put((cmd, val, ack, source))
+    if command_notifier is not None:
+        command_notifier.posted.emit()
+    return ack
+
+
+class CommandLineInterface:
+    def __init__(self):
+        self.loop = None
+        self.interactive = sys.stdin.isatty()
+        self.history = []
+        self.stdin_reader = None
+
+    # ---- 入力 ----
+    def setup_readline(self):
+        if readline is None or not self.interactive:
+            return
+        try:
+            readline.read_history_file(HISTORY_FILE)
+        except (OSError, IOError):
+            pass
+        readline.set_history_length(HISTORY_LENGTH)
+        readline.set_completer(self.complete)
+        readline.set_completer_delims(" ")
+        readline.parse_and_bind("tab: complete")
+
+    def save_history(self):
+        if readline is None or not self.interactive:
+            return
+        try:
+            readline.write_history_file(HISTORY_FILE)
+        except (OSError, IOError):
+            pass
+
+    def complete(self, text, state):
+        candidates = sorted(set(COMMANDS) | set(CUI_ONLY_COMMANDS))
+        matches = [c for c in candidates if c.startswith("-") and c.startswith(text)]
+        return matches[state] if state < len(matches) else None
+
+    async def open_stdin(self):
+        # パイプ入力（POSIX）はイベントループに直接つなぐ。対話時/Windowsは input() をエグゼキュータで待つ
+        if self.interactive or sys.platform == "win32":
+            return
+        reader = asyncio.StreamReader()
+        protocol = asyncio.StreamReaderProtocol(reader)
+        try:
+            await self.loop.connect_read_pipe(lambda: protocol, sys.stdin)
+        except (ValueError, OSError):
+            return
+        self.stdin_reader = reader
+
+    async def read_line(self):
+        if self.stdin_reader is not None:
+            line = await self.stdin_reader.readline()
+            if not line:
+                return None
+            return line.decode("utf-8", errors="replace")
+        try:
+            return await self.loop.run_in_executor(None, input, ">>> " if self.interactive else "")
+        except EOFError:
+            return None
+
+    async def read_key(self):
+        await self.loop.run_in_executor(None, clear_keyboard_buffer)
+        return await self.loop.run_in_executor(None, get_keyboard_backend().read_key)
+
+    async def read_keys_until_enter(self):
+        def collect():
+            keys = []
+            clear_keyboard_buffer()
+            while True:
+                k = get_keyboard_backend().read_event()
+                if k.event_type == KEY_DOWN:
+                    if k.name == "enter":
+                        return keys
+                    if k.name not in keys:
+                        keys.append(k.name)
+        return await self.loop.run_in_executor(None, collect)
+
+    # ---- 送信 ----
+    async def send(self, cmd, val=None):
+        # GUIスレッドの処理完了を待つ（スクリプト入力時はここで背圧がかかる）
+        try:
+            await asyncio.wrap_future(send_command(cmd, val))
+        except Exception as e:
+            print(f"[NG] {cmd}: {e}")
+            return False
+        if not self.interactive:
+            print(f"[OK] {cmd}")
+        return True
+
+    # ---- コマンド処理 ----
+    async def handle(self, raw):
+        if raw.startswith("-dotsize"):
+            parts = raw.lower().split()
+            if len(parts) == 2 and parts[1].isdigit():
+                await self.send("set_dot_size", int(parts[1]))
+            else:
+                print("使用方法: -dotsize [0〜100]")
+        elif raw == "--disable-key":
+            print("どのキーを無効化しますか？キーを押してください。")
+            key = await self.read_key()
+            if key == "enter":
+                print("Enterキーは無効化できません。")
+            elif await self.send("disable_key", key):
+                print(f"キー {key} を無効化しました。")
+        elif raw == "--multiple-disable-keys":
+            print("無効化したいキーをすべて押し、最後にEnterを押してください。")
+            keys = await self.read_keys_until_enter()
+            for k in keys:
+                await self.send("disable_key", k)
+            print(f"キー {', '.join(keys)} を無効化しました。")
+        elif raw.startswith("--remap-key"):
+            parts = raw.lower().split()
+            if len(parts) == 3:
+                await self.send("set_key_remap", (parts[1].replace("_", " "), parts[2].replace("_", " ")))
+            else:
+                print("使用方法: --remap-key 元 先")
+        elif raw.startswith("--unremap-key"):
+            parts = raw.lower().split()
+            if len(parts) == 2:
+                await self.send("set_key_remap", (parts[1].replace("_", " "), ""))
+            else:
+                print("使用方法: --unremap-key 元")
+        elif raw.startswith("--key-layer-save"):
+            parts = raw.split()
+            if len(parts) == 2:
+                await self.send("save_key_layer", parts[1])
+            else:
+                print("使用方法: --key-layer-save 名前")
+        elif raw.startswith("--key-layer-hotkey"):
+            parts = raw.split()
+            if len(parts) == 3:
+                await self.send("bind_key_layer", (parts[1].lower(), parts[2]))
+            else:
+                print("使用方法: --key-layer-hotkey ホットキー 名前")
+        elif raw.startswith("--key-layer"):
+            parts = raw.split()
+            if len(parts) == 2:
+                await self.send("set_key_layer", "" if parts[1].lower() == "none" else parts[1])
+            else:
+                print("使用方法: --key-layer 名前|none")
+        elif raw == "-key-layers":
+            state = current_state()
+            if state is None or not state.key_layers:
+                print("キーレイヤーはありません。")
+            else:
+                hotkeys = {}
+                for hotkey, name in state.key_layer_hotkeys.items():
+                    hotkeys.setdefault(name, []).append(hotkey)
+                for name, keys in state.key_layers.items():
+                    mark = "*" if name == state.key_layer else " "
+                    print(f"  {mark} {name}: {', '.join(keys) if keys else 'なし'}"
+                          + (f"  [{', '.join(hotkeys[name])}]" if name in hotkeys else ""))
+        elif raw == "--enable-key":
+            state = current_state()
+            disabled_keys = state.disabled_keys if state else ()
+            print(f"無効化されているキー: {', '.join(disabled_keys) if disabled_keys else 'なし'}")
+            print("有効化したいキーを押してください。")
+            key = await self.read_key()
+            if await self.send("enable_key", key):
+                print(f"キー {key} を有効化しました。")
+        elif raw.split(" ", 1)[0] in ("--crosshair-color", "--dot-out-color", "--dot-in-color") and " " in raw:
+            name, value = raw.split(" ", 1)
+            try:
+                parse_color(value)
+            except ValueError as e:
+                print(e)
+                print(f"使用方法: {name} [#rrggbb / #rrggbbaa / rgba(r,g,b,a) / hsv(h,s,v)]")
+            else:
+                await self.send(COMMANDS[name], value)
+        elif raw.startswith("--crosshair-alpha"):
+            parts = raw.lower().split()
+            try:
+                if len(parts) != 2:
+                    raise ValueError
+                await self.send("set_crosshair_alpha", float(parts[1]))
+            except ValueError:
+                print("使用方法: --crosshair-alpha [0.0〜1.0]")
+        elif raw.startswith("--dot-alpha"):
+            parts = raw.lower().split()
+            try:
+                if len(parts) != 2:
+                    raise ValueError
+                await self.send("set_dot_alpha", float(parts[1]))
+            except ValueError:
+                print("使用方法: --dot-alpha [0.0〜1.0]")
+        elif raw.startswith("--adaptive-color"):
+            parts = raw.lower().split()
+            try:
+                if len(parts) < 2 or len(parts) > 4 or parts[1] not in ("on", "off"):
+                    raise ValueError
+                rate = float(parts[2]) if len(parts) > 2 else None
+                cpu_budget = float(parts[3]) if len(parts) > 3 else None
+                await self.send("set_adaptive_color", (parts[1] == "on", rate, cpu_budget))
+            except ValueError:
+                print("使用方法: --adaptive-color on|off [Hz] [CPU割合]")
+        elif raw.startswith("--scope"):
+            parts = raw.lower().split()
+            try:
+                if len(parts) < 2 or len(parts) > 4 or parts[1] not in ("on", "off"):
+                    raise ValueError
+                zoom = int(parts[2]) if len(parts) > 2 else None
+                fps = int(parts[3]) if len(parts) > 3 else None
+                await self.send("set_scope", (parts[1] == "on", zoom, fps))
+            except ValueError:
+                print("使用方法: --scope on|off [倍率2〜8] [fps]")
+        elif raw == "-scope-stats":
+            stats = overlay.scope.stats if overlay else None
+            if stats is None or stats.frames == 0:
+                print("スコープはまだ描画されていません。")
+            else:
+                print(f"スコープ: {stats.frames} フレーム, 平均 {stats.avg_ms}ms, 最大 {stats.max_ms}ms, "
+                      f"予算 {stats.budget_ms}ms 超過 {stats.over_budget} 回")
+        elif raw.startswith("--animation"):
+            parts = raw.lower().split()
+            if len(parts) == 2 and (parts[1] == "none" or parts[1] in ANIMATIONS):
+                await self.send("set_animation", parts[1])
+            else:
+                print("使用方法: --animation none|pulse|rotate")
+        elif raw.startswith("--blink-on-toggle"):
+            parts = raw.lower().split()
+            if len(parts) == 2 and parts[1] in ("on", "off"):
+                await self.send("set_blink_on_toggle", parts[1] == "on")
+            else:
+                print("使用方法: --blink-on-toggle on|off")
+        elif raw == "-anim-stats":
+            stats = overlay.scheduler.stats if overlay else None
+            if stats is None or stats.frames == 0:
+                print("アニメーションはまだ描画されていません。")
+            else:
+                print(f"アニメーション: {stats.frames} フレーム, {stats.fps}fps, 平均 {stats.avg_ms}ms, "
+                      f"最大 {stats.max_ms}ms, 間引き {stats.throttled} 回")
+        elif raw.startswith("--dynamic-spread"):
+            parts = raw.lower().split()
+            try:
+                if len(parts) < 2 or len(parts) > 3 or parts[1] not in ("on", "off"):
+                    raise ValueError
+                sensitivity = int(parts[2]) if len(parts) > 2 else None
+                await self.send("set_dynamic_spread", (parts[1] == "on", sensitivity))
+            except ValueError:
+                print("使用方法: --dynamic-spread on|off [px/秒]")
+        elif raw.startswith("--shm-publish"):
+            parts = raw.split()
+            if 2 <= len(parts) <= 3 and parts[1].lower() in ("on", "off"):
+                await self.send("set_shm_publish", (parts[1].lower() == "on", parts[2] if len(parts) > 2 else None))
+            else:
+                print("使用方法: --shm-publish on|off [名前]")
+        elif raw.startswith("-stalls"):
+            parts = raw.lower().split()
+            count = int(parts[1]) if len(parts) == 2 and parts[1].isdigit() else 5
+            stalls = overlay.watchdog.snapshot if overlay else ()
+            if not stalls:
+                print("GUIの停止は記録されていません。")
+            for stall in stalls[-count:]:
+                started = time.strftime("%H:%M:%S", time.localtime(stall.started))
+                print(f"--- {started} {stall.duration_ms}ms 停止（待ちコマンド {stall.queue_depth} 件）")
+                print(stall.stack.rstrip() or "  (スタック未取得)")
+            if stalls:
+                print(f"詳細は {STALL_LOG_FILE} を参照してください。")
+        elif raw.startswith("-presets"):
+            library = overlay.presets if overlay else PresetLibrary()
+            results = library.search(raw[len("-presets"):])
+            for filename, entry in results:
+                tags = f" [{', '.join(entry['tags'])}]" if entry["tags"] else ""
+                print(f"  {entry['name']}{tags}")
+            print(f"{len(results)} 件のプリセット")
+        elif raw == "-export-code":
+            state = current_state()
+            print(encode_share_code(state._asdict()) if state else "オーバーレイが起動していません。")
+        elif raw.startswith("-import-code"):
+            parts = raw.split()
+            if len(parts) == 2:
+                try:
+                    decode_share_code(parts[1])
+                except ValueError as e:
+                    print(e)
+                else:
+                    await self.send("import_code", parts[1])
+            else:
+                print("使用方法: -import-code コード")
+        elif raw.startswith("-preset-load"):
+            parts = raw.split(maxsplit=1)
+            if len(parts) == 2:
+                await self.send("load_preset", parts[1])
+            else:
+                print("使用方法: -preset-load 名前")
+        elif raw.startswith("-preset-save"):
+            parts = raw.split()
+            if len(parts) >= 2:
+                await self.send("save_preset", (parts[1], parts[2:]))
+            else:
+                print("使用方法: -preset-save 名前 [タグ...]")
+        elif raw.startswith("--auto-profile"):
+            parts = raw.lower().split()
+            if len(parts) == 2 and parts[1] in ("on", "off"):
+                await self.send("set_auto_profiles", parts[1] == "on")
+            else:
+                print("使用方法: --auto-profile on|off")
+        elif raw == "-profiles":
+            state = current_state()
+            if state is not None:
+                for name in sorted(state.profiles):
+                    print(f"  プロファイル: {name}")
+                for rule in state.profile_rules:
+                    print(f"  ルール: {rule['match']} → {rule['profile']}")
+        elif raw.startswith("-profile-save"):
+            parts = raw.split()
+            if len(parts) == 2:
+                await self.send("save_profile", parts[1])
+            else:
+                print("使用方法: -profile-save 名前")
+        elif raw.startswith("-profile-rule"):
+            parts = raw.split()
+            if len(parts) == 3:
+                await self.send("add_profile_rule", (parts[1], parts[2]))
+            else:
+                print("使用方法: -profile-rule パターン 名前（例: -profile-rule valorant*.exe valorant）")
+        elif raw.startswith("-profile "):
+            await self.send("apply_profile", raw.split(maxsplit=1)[1])
+        elif raw.startswith("--anchor"):
+            parts = raw.split(maxsplit=1)
+            await self.send("set_anchor", parts[1] if len(parts) == 2 else "")
+        elif raw.startswith("--reticle"):
+            # 名前（parts[2]）以外は大文字小文字を区別しない
+            parts = [p if i == 2 else p.lower() for i, p in enumerate(raw.split())]
+            try:
+                if len(parts) in (3, 5) and parts[1] == "add":
+                    offset = (int(parts[3]), int(parts[4])) if len(parts) == 5 else (0, 0)
+                    await self.send("add_reticle", (parts[2],) + offset)
+                elif len(parts) == 5 and parts[1] == "set":
+                    await self.send("set_reticle", (parts[2], parts[3], parse_reticle_value(parts[3], parts[4])))
+                elif len(parts) == 3 and parts[1] == "remove":
+                    await self.send("remove_reticle", parts[2])
+                else:
+                    raise ValueError("引数が足りません")
+            except ValueError as e:
+                print(f"{e}。使用方法: --reticle add 名前 [dx dy] / set 名前 項目 値 / remove 名前")
+                print(f"  項目: {', '.join(RETICLE_INSTANCE_KEYS)}")
+        elif raw == "-reticles":
+            reticles = overlay.state.extra_reticles if overlay and overlay.state else []
+            if not reticles:
+                print("追加の照準はありません。")
+            for r in reticles:
+                print(f"  {r['name']}: 位置 ({r['offset_x']:+d}, {r['offset_y']:+d}) 長さ {r['size']} 隙間 {r['gap']} "
+                      f"色 {r['crosshair_color']} ドット {'ON' if r['dot_visible'] else 'OFF'}")
+        elif raw.startswith("--hud"):
+            parts = raw.lower().split()
+            if len(parts) == 3 and parts[1] in HudOverlay.ORDER and parts[2] in ("on", "off"):
+                await self.send("set_hud", (parts[1], parts[2] == "on"))
+            else:
+                print("使用方法: --hud clock|timer|fps on|off")
+        elif raw.startswith("-events"):
+            parts = raw.split(maxsplit=2)
+            limit = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 20
+            text = parts[-1] if len(parts) > 1 and not parts[-1].isdigit() else None
+            for e in get_event_log().query(limit, text):
+                stamp = time.strftime("%H:%M:%S", time.localtime(e["time"]))
+                detail = format_changes(e["changes"]) if e.get("changes") else e.get("error", "")
+                print(f"  #{e['seq']} {stamp} {e['kind']} {e.get('cmd', e.get('action', ''))} {detail}")
+        elif raw.startswith("--trace-start"):
+            parts = raw.split(maxsplit=1)
+            if len(parts) == 2:
+                await self.send("trace_start", parts[1])
+            else:
+                print("使用方法: --trace-start パス")
+        elif raw == "--trace-stop":
+            await self.send("trace_stop")
+        elif raw.startswith("--events-dump"):
+            parts = raw.split(maxsplit=1)
+            if len(parts) == 2:
+                try:
+                    count = get_event_log().dump(os.path.expanduser(parts[1]))
+                    print(f"{count} 件を {parts[1]} に書き出しました。")
+                except OSError as e:
+                    print("書き出しに失敗しました:", e)
+            else:
+                print("使用方法: --events-dump パス")
+        elif raw == "-history":
+            for i, line in enumerate(self.history[-HISTORY_LENGTH:], 1):
+                print(f"  {i:3d}  {line}")
+        elif raw == "-gui":
+            config = load_config()
+            config["launch_mode"] = "gui"
+            save_config(config)
+            print("GUIモードに切り替えます。再起動してください。")
+            self.save_history()
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+        elif raw == "-cui":
+            config = load_config()
+            config["launch_mode"] = "cui"
+            save_config(config)
+            print("CUIモードに切り替えます。再起動してください。")
+            self.save_history()
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+        elif raw in COMMANDS:
+            if raw == "-exit":
+                # 設定保存とキー解除は GUIスレッドの aboutToQuit で行う
+                await self.send("exit")
+                return False
+            elif raw == "-help":
+                print_help()
+            else:
+                await self.send(COMMANDS[raw])
+        elif raw == "":
+            pass
+        else:
+            print("不明なコマンドです。-help で確認してください。")
+        return True
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.setup_readline()
+        await self.open_stdin()
+        print("終了するにはウィンドウを閉じるか -exit を入力してください。")
+        print("-help でコマンド一覧を表示できます。")
+        try:
+            while True:
+                line = await self.read_line()
+                if line is None:
+                    break
+                # 小文字にするのはコマンド名だけ（パスや名前の引数はそのまま渡す）
+                command, *rest = line.strip().split(maxsplit=1) or [""]
+                raw = " ".join([command.lower()] + rest)
+                if raw:
+                    self.history.append(raw)
+                if not await self.handle(raw):
+                    break
+        finally:
+            self.save_history()
+
+
+def input_thread():
+    asyncio.run(CommandLineInterface().run())
+
+
+def execute_command(overlay, cmd, val):
+    # コマンド1件をオーバーレイに反映する（GUIスレッドから呼ぶ。poll_commands とトレース再生で共用）
+    if cmd == "toggle_crosshair":
+        overlay.toggle_crosshair()
+    elif cmd == "toggle_dot":
+        overlay.toggle_dot()
+    elif cmd == "set_dot_size":
+        overlay.set_dot_size(val)
+    elif cmd == "pick_crosshair_color":
+        overlay.pick_crosshair_color(val)
+    elif cmd == "pick_dot_outer_color":
+        overlay.pick_dot_outer_color(val)
+    elif cmd == "pick_dot_inner_color":
+        overlay.pick_dot_inner_color(val)
+    elif cmd == "disable_key":
+        overlay.disable_key(val)
+    elif cmd == "enable_key":
+        overlay.enable_key(val)
+    elif cmd == "enable_all_keys":
+        overlay.enable_all_keys()
+    elif cmd == "set_crosshair_alpha":
+        overlay.crosshair_alpha = max(0.0, min(val, 1.0))
+    elif cmd == "set_dot_alpha":
+        overlay.dot_alpha = max(0.0, min(val, 1.0))
+    elif cmd == "set_adaptive_color":
+        overlay.set_adaptive_color(*val)
+    elif cmd == "set_scope":
+        overlay.set_scope(*val)
+    elif cmd == "set_animation":
+        overlay.set_animation(val)
+    elif cmd == "set_blink_on_toggle":
+        overlay.blink_on_toggle = val
+    elif cmd == "bloom":
+        overlay.bloom()
+    elif cmd == "set_dynamic_spread":
+        overlay.set_dynamic_spread(*val)
+    elif cmd == "set_shm_publish":
+        overlay.set_shm_publish(*val)
+    elif cmd == "undo":
+        overlay.undo()
+    elif cmd == "redo":
+        overlay.redo()
+    elif cmd == "mark_good":
+        overlay.journal().mark_good()
+    elif cmd == "revert_to_good":
+        overlay.revert_to_good()
+    elif cmd == "import_code":
+        overlay.import_share_code(val)
+    elif cmd == "load_preset":
+        overlay.load_preset(val)
+    elif cmd == "save_preset":
+        overlay.save_preset(*val)
+    elif cmd == "set_auto_profiles":
+        overlay.set_auto_profiles(val)
+    elif cmd == "apply_profile":
+        overlay.apply_profile(val)
+    elif cmd == "save_profile":
+        overlay.save_profile(val)
+    elif cmd == "add_profile_rule":
+        overlay.add_profile_rule(*val)
+    elif cmd == "set_anchor":
+        overlay.set_anchor(val)
+    elif cmd == "add_reticle":
+        overlay.add_reticle(*val)
+    elif cmd == "set_reticle":
+        overlay.set_reticle(*val)
+    elif cmd == "remove_reticle":
+        overlay.remove_reticle(val)
+    elif cmd == "set_key_remap":
+        overlay.set_key_remap(*val)
+    elif cmd == "set_key_layer":
+        overlay.set_key_layer(val)
+    elif cmd == "save_key_layer":
+        overlay.save_key_layer(val)
+    elif cmd == "bind_key_layer":
+        overlay.bind_key_layer(*val)
+    elif cmd == "set_hud":
+        overlay.set_hud(*val)
+    elif cmd == "enter_gui_mode":
+        overlay.show_control_panel()
+    elif cmd == "print_parameters":
+        overlay.print_parameters()
+
+
+def publish_changes(overlay, events, save, kind, **fields):
+    # 状態を公開し、変わった項目を記録・保存して再描画する。戻り値は {項目: [旧, 新]}
+    previous = overlay.state
+    overlay.publish_state()
+    changes = state_changes(previous, overlay.state)
+    events.add(kind, **fields, changes=changes)
+    save(overlay.get_config())
+    overlay.update()
+    return changes
+
+
+def process_command(overlay, cmd, val, events, save=save_config):
+    # 実行して状態を公開し、変わった項目を記録・保存する
+    execute_command(overlay, cmd, val)
+    return publish_changes(overlay, events, save, "command",
+                           cmd=cmd, val=val if isinstance(val, (str, int, float, bool, type(None))) else repr(val))
+
+
+class TraceRecorder:
+    # poll_commands に届いたコマンドを JSON Lines で記録する（t は記録開始からの秒数）
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8")
+        self.started = time.monotonic()
+        self.count = 0
+
+    def record(self, source, cmd, val):
+        entry = {"t": round(time.monotonic() - self.started, 4), "source": source, "cmd": cmd, "val": val}
+        self.file.write(json.dumps(entry, ensure_ascii=False, default=repr) + "\n")
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+        return self.count
+
+
+trace_recorder = None
+
+
+def start_trace(path):
+    global trace_recorder
+    stop_trace()
+    trace_recorder = TraceRecorder(os.path.expanduser(path))
+
+
+def stop_trace():
+    global trace_recorder
+    if trace_recorder is None:
+        return 0
+    count = trace_recorder.close()
+    trace_recorder = None
+    return count
+
+
+def load_trace(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+ReplayStats = collections.namedtuple(
+    "ReplayStats", ["commands", "errors", "elapsed", "latencies", "paints", "config_writes"])
+
+
+class ScratchConfig:
+    # 一時フォルダのジャーナル・プリセットと専用のイベントログで、保存ありのオーバーレイを
+    # 利用者の設定に触れずに動かす。抜けるときに差し替えたグローバルを戻し、フォルダを消す
+    def __init__(self, prefix, keys=None, events=None):
+        self.prefix = prefix
+        self.keys = keys
+        self.events = events or EventLog()
+        self.workdir = None
+        self.journal = None
+
+    def __enter__(self):
+        global config_journal, keyboard_backend, event_log
+        self.saved = (config_journal, keyboard_backend, event_log)
+        event_log = self.events
+        self.workdir = tempfile.mkdtemp(prefix=self.prefix)
+        self.journal = config_journal = ConfigJournal(os.path.join(self.workdir, "config.json"),
+                                                      os.path.join(self.workdir, "config.json.journal"),
+                                                      os.path.join(self.workdir, "config.json.good"))
+        if self.keys is not None:
+            keyboard_backend = self.keys
+        return self
+
+    def __exit__(self, *exc):
+        global config_journal, keyboard_backend, event_log
+        config_journal, keyboard_backend, event_log = self.saved
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def overlay(self, show=True, hooks=False):
+        presets = PresetLibrary(os.path.join(self.workdir, "presets"))
+        return CrosshairOverlay(show=show, hooks=hooks, presets=presets, stall_log="")
+
+
+def replay_trace(entries, realtime=False):
+    # 画面なしのオーバーレイにトレースを流す。設定は一時フォルダのジャーナルに書き、利用者の設定には触れない
+    app = QtWidgets.QApplication.instance()
+    with ScratchConfig("crosshair_replay_") as scratch:
+        target = scratch.overlay()
+        app.processEvents()
+        target.paint_count = 0
+        events = EventLog()
+        writes = 0
+
+        def save(config):
+            nonlocal writes
+            writes += scratch.journal.record(config)
+
+        latencies = collections.defaultdict(list)
+        errors = 0
+        started = time.perf_counter()
+        try:
+            for entry in entries:
+                if realtime:
+                    while time.perf_counter() - started < entry["t"]:
+                        app.processEvents()
+                        time.sleep(0.001)
+                t0 = time.perf_counter()
+                try:
+                    process_command(target, entry["cmd"], entry["val"], events, save)
+                except Exception:
+                    errors += 1
+                latencies[entry["cmd"]].append(time.perf_counter() - t0)
+                app.processEvents()
+            elapsed = time.perf_counter() - started
+        finally:
+            target.shutdown()
+    return ReplayStats(len(entries), errors, elapsed, dict(latencies), target.paint_count, writes)
+
+
+SoakSample = collections.namedtuple("SoakSample", ["step", "rss", "traced", "blocks", "widgets", "qobjects"])
+
+
+def process_rss():
+    # 現在の常駐メモリ（バイト）。取得できない環境では 0
+    if sys.platform == "win32":
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", ctypes.c_uint32), ("PageFaultCount", ctypes.c_uint32)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return 0
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def qt_object_counts(app):
+    # ウィジェット数と、アプリ・トップレベルから辿れる QObject の総数
+    widgets = app.allWidgets()
+    roots = [app] + list(app.topLevelWidgets())
+    return len(widgets), sum(len(root.findChildren(QtCore.QObject)) + 1 for root in roots)
+
+
+def soak_sample(app, step):
+    # 閉じたパネルなど deleteLater() 済みのオブジェクトを消してから数える
+    app.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+    gc.collect()
+    traced, _ = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    widgets, qobjects = qt_object_counts(app)
+    return SoakSample(step, process_rss(), traced, blocks, widgets, qobjects)
+
+
+def run_soak(steps=20000, samples=10, warmup=0.2):
+    # 1ステップ = コマンド1件＋再描画。一定間隔でスライダー操作・キーの無効化/解除・パネルの開き直しを挟む
+    # 保存ありのオーバーレイを一時フォルダのジャーナルに向けて動かし、設定の保存経路も含めて測る
+    app = QtWidgets.QApplication.instance()
+    keys = EvdevKeyboardBackend([FakeKeyboardDevice()], FakeKeySink())
+    # イベントログは小さくして、基準の時点で満杯になるようにする
+    with ScratchConfig("crosshair_soak_", keys, EventLog(256)) as scratch:
+        target = scratch.overlay(show=True, hooks=True)
+        try:
+            return soak_steps(app, target, steps, samples, warmup)
+        finally:
+            target.shutdown()
+            app.processEvents()
+
+
+def soak_steps(app, target, steps, samples, warmup):
+    target.show_control_panel()
+    events = get_event_log()
+    commands = [
+        ("toggle_dot", None), ("toggle_crosshair", None), ("set_dot_size", 6), ("set_dot_size", 10),
+        ("pick_crosshair_color", "#00ff66"), ("pick_crosshair_color", "red"), ("set_crosshair_alpha", 0.5),
+        ("set_crosshair_alpha", 1.0), ("bloom", None), ("set_hud", ("clock", True)), ("set_hud", ("clock", False)),
+        ("add_reticle", ("soak", 0, 40)), ("set_reticle", ("soak", "size", 30)), ("remove_reticle", "soak"),
+    ]
+    keys = ["f1", "f2", "caps lock", "windows"]
+    tracemalloc.start()
+    results = []
+    interval = max(1, steps // samples)
+    for step in range(steps + 1):
+        cmd, val = commands[step % len(commands)]
+        process_command(target, cmd, val, events)
+        target.repaint()
+        if step % 7 == 0:
+            target.dot_slider.setValue(step % 100)
+            target.alpha_slider.setValue((step * 3) % 100)
+        if step % 11 == 0:
+            key = keys[step % len(keys)]
+            target.disable_key(key)
+            target.enable_key(key)
+        if step % 500 == 0:
+            target.show_control_panel()
+        app.processEvents()
+        if step % interval == 0:
+            results.append(soak_sample(app, step))
+    tracemalloc.stop()
+    baseline = results[min(len(results) - 1, int(len(results) * warmup))]
+    return baseline, results
+
+
+def gui_main():
+    global overlay, command_notifier
+    if load_config().get("render_backend") == "opengl-software":
+        QtCore.QCoreApplication.setAttribute(QtCore.Qt.AA_UseSoftwareOpenGL)
+    app = QtWidgets.QApplication(sys.argv)
+    overlay = CrosshairOverlay()
+
+    # 起動時のモードに応じてGUIパネルを自動表示
+    config = load_config()
+    if config.get("launch_mode") == "gui":
+        overlay.show_control_panel()
+    
+     # 起動時にパラメータとヘルプを表示
+    overlay.print_parameters()
+    print_help()
+
+    events = get_event_log()
+
+    def poll_commands():
+        while not command_queue.empty():
+            cmd, val, ack, source = command_queue.get()
+            try:
+                if cmd == "exit":
+                    if ack:
+                        ack.set_result(True)
+                    app.quit()
+                    return
+                if cmd == "trace_start":
+                    start_trace(val)
+                    print(f"{val} にコマンドを記録します。")
+                    changes = None
+                elif cmd == "trace_stop":
+                    print(f"{stop_trace()} 件を記録しました。")
+                    changes = None
+                else:
+                    if trace_recorder is not None:
+                        trace_recorder.record(source, cmd, val)
+                    changes = process_command(overlay, cmd, val, events)
+                if changes:
+                    print("[変更] " + format_changes(changes))
+            except Exception as e:
+                events.add("error", cmd=cmd, val=repr(val), error=str(e))
+                if ack:
+                    ack.set_exception(e)
+                continue
+            if ack:
+                ack.set_result(True)
+
+    app.aboutToQuit.connect(lambda: [
+    save_config(overlay.get_config()),
+    overlay.enable_all_keys(),  # 終了時に解除
+    overlay.set_shm_publish(False),  # 共有メモリを片付ける
+    get_journal().compact(),  # 追記分をスナップショットへまとめる
+    get_journal().mark_good(),  # 正常終了できた設定を記録
+    get_keyboard_backend().close(),  # つかんだキーボードを手放す
+    stop_trace()
+    ])
+    # 積まれたらすぐ処理する。タイマーは通知より前に積まれた分などの取りこぼし用
+    command_notifier = CommandNotifier()
+    command_notifier.posted.connect(poll_commands, QtCore.Qt.QueuedConnection)
+    poll_timer = QtCore.QTimer()
+    poll_timer.timeout.connect(poll_commands)
+    poll_timer.start(100)
+    overlay.show()
+    sys.exit(app.exec_())
+
+def create_overlay(settings=None, app=None, show=True, hooks=False, presets=None, stall_log=""):
+    # 既存の PyQt アプリの中にオーバーレイを作る。ホームフォルダの設定・プリセット・停止ログには触れず、
+    # キー無効化は start_hooks()、終了は shutdown() を呼び出し側が行う
+    if app is None:
+        app = QtWidgets.QApplication.instance()
+    if app is None:
+        raise RuntimeError("先に QApplication を作成してください。")
+    return CrosshairOverlay(settings or {}, show=show, hooks=hooks, presets=presets, stall_log=stall_log)
+
+
+def golden_main(update):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QtWidgets.QApplication(sys.argv[:1])
+    path = GOLDEN_FILE
+    if len(sys.argv) > 2:
+        path = sys.argv[2]
+    if update:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    sys.exit(run_golden(path, update))
+
+def shm_check_main():
+    # 例: python crosshair7.py --shm-check
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QtWidgets.QApplication(sys.argv[:1])
+    problems = check_shared_reticle()
+    for problem in problems:
+        print(problem)
+    print("共有メモリの読み取り: " + ("失敗" if problems else "成功"))
+    sys.exit(1 if problems else 0)
+
+def profile_check_main():
+    # 例: python crosshair7.py --profile-check
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QtWidgets.QApplication(sys.argv[:1])
+    problems = check_profile_switching()
+    for problem in problems:
+        print(problem)
+    print("プロファイルの自動切り替え: " + ("失敗" if problems else "成功"))
+    sys.exit(1 if problems else 0)
+
+def bench_render_main():
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    if "--software-gl" in sys.argv:
+        QtCore.QCoreApplication.setAttribute(QtCore.Qt.AA_UseSoftwareOpenGL)
+    app = QtWidgets.QApplication(sys.argv[:1])
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else 2000
+    print(f"描画バックエンド比較 ({frames} フレーム, 256x256)")
+    for row in benchmark_renderers(frames):
+        if len(row) == 2:
+            print(f"  {row[0]:<16} 利用不可: {row[1]}")
+            continue
+        name, (_, static_us, static_peak), (_, change_us, change_peak), memory = row
+        print(f"  {name:<16} 静止 {static_us:8.1f}us/frame  変更 {change_us:8.1f}us/frame  "
+              f"一時メモリ {max(static_peak, change_peak) / 1024:7.1f}KiB  常駐バッファ {memory / 1024:7.1f}KiB")
+    sys.exit(0)
+
+def replay_main():
+    # 例: python crosshair7.py --replay session.trace [--realtime]
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    if len(sys.argv) < 3:
+        print("使用方法: --replay トレースファイル [--realtime]")
+        sys.exit(2)
+    app = QtWidgets.QApplication(sys.argv[:1])
+    # 記録にある操作は対象外（再起動・終了・記録操作）
+    entries = [e for e in load_trace(sys.argv[2]) if e["cmd"] not in ("switch_to_gui", "switch_to_cui", "exit")]
+    stats = replay_trace(entries, "--realtime" in sys.argv)
+    everything = [t for ts in stats.latencies.values() for t in ts]
+    print(f"再生: {stats.commands} 件 ({stats.errors} 件失敗) {stats.elapsed:.3f} 秒, "
+          f"{stats.commands / stats.elapsed if stats.elapsed else 0:.0f} 件/秒")
+    print(f"  遅延 p50 {percentile(everything, 50) * 1000:.3f}ms  p95 {percentile(everything, 95) * 1000:.3f}ms  "
+          f"p99 {percentile(everything, 99) * 1000:.3f}ms  最大 {max(everything, default=0) * 1000:.3f}ms")
+    print(f"  再描画 {stats.paints} 回  設定の書き込み {stats.config_writes} 回")
+    for cmd, times in sorted(stats.latencies.items(), key=lambda item: -sum(item[1])):
+        print(f"  {cmd:<24} {len(times):6d} 件  p50 {percentile(times, 50) * 1000:8.3f}ms  "
+              f"p99 {percentile(times, 99) * 1000:8.3f}ms")
+    sys.exit(0)
+
+def soak_main():
+    # 例: python crosshair7.py --soak [ステップ数] [--rss-mib N] [--traced-kib N] [--qobjects N]
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QtWidgets.QApplication(sys.argv[:1])
+    args = sys.argv[2:]
+    steps = int(args[0]) if args and args[0].isdigit() else 20000
+
+    def option(name, default):
+        return float(args[args.index(name) + 1]) if name in args[:-1] else default
+
+    budget = {"rss": option("--rss-mib", 16) * 1024 * 1024, "traced": option("--traced-kib", 512) * 1024,
+              "qobjects": option("--qobjects", 20)}
+    started = time.perf_counter()
+    baseline, results = run_soak(steps)
+    print(f"耐久テスト: {steps} ステップ ({time.perf_counter() - started:.1f} 秒)")
+    print("   step      RSS(MiB)  traced(KiB)   blocks  widgets  QObjects")
+    for r in results:
+        print(f"  {r.step:6d}  {r.rss / 1048576:10.1f}  {r.traced / 1024:11.1f}  {r.blocks:7d}  {r.widgets:7d}  {r.qobjects:8d}")
+    last = results[-1]
+    growth = {"rss": last.rss - baseline.rss, "traced": last.traced - baseline.traced,
+              "qobjects": last.qobjects - baseline.qobjects}
+    failed = [k for k in budget if growth[k] > budget[k]]
+    print(f"  基準 step {baseline.step} からの増加: RSS {growth['rss'] / 1048576:+.1f}MiB, "
+          f"traced {growth['traced'] / 1024:+.1f}KiB, QObject {growth['qobjects']:+d}, "
+          f"widgets {last.widgets - baseline.widgets:+d}")
+    if failed:
+        print("NG: 予算超過 " + ", ".join(failed))
+        sys.exit(1)
+    print("OK")
+    sys.exit(0)
+
+def bench_codes_main():
+    count = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else 10000
+    found, elapsed, peak = benchmark_share_codes(count)
+    print(f"共有コードの読み取り: {found} 件 {elapsed * 1000:.1f}ms ({elapsed / max(found, 1) * 1e6:.2f}us/件, "
+          f"一時メモリ {peak / 1024:.0f}KiB)")
+    sys.exit(0)
+
+def bench_keyboard_main():
+    count = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else 200000
+    total, results = benchmark_keyboard(count)
+    print(f"evdev フィルタの処理コスト ({total} イベント, 偽デバイス)")
+    for label, ns, forwarded in results:
+        print(f"  {label:<16} {ns:8.1f}ns/event  転送 {forwarded} 件")
+    sys.exit(0)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench-keyboard":
+        bench_keyboard_main()
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench-codes":
+        bench_codes_main()
+    if len(sys.argv) > 1 and sys.argv[1] == "--replay":
+        replay_main()
+    if len(sys.argv) > 1 and sys.argv[1] == "--soak":
+        soak_main()
+    if len(sys.argv) > 1 and sys.argv[1] in ("--golden-check", "--golden-update"):
+        golden_main(sys.argv[1] == "--golden-update")
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench-render":
+        bench_render_main()
+    if len(sys.argv) > 1 and sys.argv[1] == "--shm-check":
+        shm_check_main()
+    if len(sys.argv) > 1 and sys.argv[1] == "--profile-check":
+        profile_check_main()
+    config = load_config()
+    if config.get("launch_mode") == "gui":
+        gui_main()  # GUIモード → コントロールパネル＋オーバーレイのみ
+    else:
+        threading.Thread(target=input_thread, daemon=True).start()
+        gui_main()  # CUIモード → オーバーレイ＋CUIプロンプト
+
@@ -0,0 +1,112 @@
+
+# クロスヘアが共有メモリへ公開したスプライトを読み取る小さなライブラリ（Qt 不要）
+#
+#   reader = ReticleReader("crosshair_reticle")
+#   frame = reader.read()   # 更新がなければ None
+#   frame.width, frame.height, frame.stride, frame.pixels (BGRA 乗算済み)
+#
+# ヘッダ（リトルエンディアン, 32バイト）:
+#   magic "XHR1" / version / format / width / height / stride / seq(uint64)
+# seq は書き込み中は奇数、書き終わると偶数になる。
+
+import sys
+import time
+import struct
+import collections
+from multiprocessing import shared_memory
+
+MAGIC = b"XHR1"
+VERSION = 1
+FORMAT_ARGB32_PREMULTIPLIED = 1  # メモリ上は B, G, R, A の順
+HEADER = struct.Struct("<4sHHIIIQ")
+HEADER_SIZE = 32
+SEQ_OFFSET = 20
+SEQ = struct.Struct("<Q")
+MAX_SIDE = 256
+BUFFER_SIZE = HEADER_SIZE + MAX_SIDE * MAX_SIDE * 4
+
+ReticleFrame = collections.namedtuple("ReticleFrame", ["seq", "width", "height", "stride", "format", "pixels"])
+
+
+def attach(name, shared_tracker=False):
+    # 読み取り側が終了しても共有メモリを消さないよう、リソーストラッカーには登録しない。
+    # 書き込み側から multiprocessing で起動されたときはトラッカーが共通なので、登録を外すと書き込み側の分まで消える
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if sys.platform != "win32" and not shared_tracker:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class ReticleReader:
+    def __init__(self, name, shared_tracker=False):
+        self.shm = attach(name, shared_tracker)
+        self.last_seq = None
+
+    def close(self):
+        self.shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def seq(self):
+        return SEQ.unpack_from(self.shm.buf, SEQ_OFFSET)[0]
+
+    def read(self, force=False, retries=100):
+        # seq が前後で一致し偶数のときだけ一貫したフレームとして返す
+        for _ in range(retries):
+            before = self.seq()
+            if before & 1:
+                continue
+            if before == self.last_seq and not force:
+                return None
+            magic, version, fmt, width, height, stride, _ = HEADER.unpack_from(self.shm.buf, 0)
+            if magic != MAGIC:
+                return None
+            pixels = bytes(self.shm.buf[HEADER_SIZE:HEADER_SIZE + stride * height])
+            if self.seq() == before:
+                self.last_seq = before
+                return ReticleFrame(before, width, height, stride, fmt, pixels)
+        return None
+
+    def wait(self, timeout=1.0, interval=0.005):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            frame = self.read()
+            if frame is not None:
+                return frame
+            time.sleep(interval)
+        return None
+
+
+def probe(name, results, frames=20, timeout=5.0):
+    # 別プロセスから読み取れるかの確認用。読めたフレームの要約を results（multiprocessing.Queue）へ送る
+    summaries = []
+    with ReticleReader(name, shared_tracker=True) as reader:
+        for _ in range(frames):
+            frame = reader.wait(timeout)
+            if frame is None:
+                break
+            opaque = sum(1 for a in frame.pixels[3::4] if a)
+            summaries.append((frame.seq, frame.width, frame.height, frame.stride, frame.format,
+                              len(frame.pixels), opaque))
+    results.put(summaries)
+
+
+if __name__ == "__main__":
+    # 例: python reticle_reader.py crosshair_reticle
+    name = sys.argv[1] if len(sys.argv) > 1 else "crosshair_reticle"
+    with ReticleReader(name) as reader:
+        while True:
+            frame = reader.wait(timeout=5.0)
+            if frame is None:
+                print("更新なし")
+                continue
+            opaque = sum(1 for a in frame.pixels[3::4] if a)
+            print(f"seq={frame.seq} {frame.width}x{frame.height} 不透明画素={opaque}")